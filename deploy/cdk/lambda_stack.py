@@ -86,12 +86,20 @@ class LambdaStack(core.Stack):
         self.cogify_lambda = self._lambda(
             f"{construct_id}-cogify-fn",
             "../lambdas/cogify",
+            memory_size=config.COGIFY_MEMORY_SIZE,
             env={
                 "EARTHDATA_USERNAME": config.EARTHDATA_USERNAME,
                 "EARTHDATA_PASSWORD": config.EARTHDATA_PASSWORD,
+                "EARTHDATA_TOKEN": config.EARTHDATA_TOKEN,
             },
         )
 
+        # Sends discovered and cogified file objects to the queues in batches
+        self.enqueue_lambda = self._python_lambda(
+            f"{construct_id}-enqueue-fn",
+            "../lambdas/enqueue",
+        )
+
         # Proxy lambda to trigger discovery step function
         self.trigger_discovery_lambda = self._python_lambda(
             f"{construct_id}-trigger-discover-fn",
@@ -102,11 +110,18 @@ class LambdaStack(core.Stack):
         self.trigger_cogify_lambda = self._python_lambda(
             f"{construct_id}-trigger-cogify-fn",
             "../lambdas/proxy",
+            env={"MAX_OBJECTS_PER_EXECUTION": str(config.COGIFY_BATCH_SIZE)},
         )
 
         # Proxy lambda to trigger ingest and publish step function
         self.trigger_ingest_lambda = self._python_lambda(
-            f"{construct_id}-trigger-ingest-fn", "../lambdas/proxy"
+            f"{construct_id}-trigger-ingest-fn",
+            "../lambdas/proxy",
+            env={
+                "MAX_OBJECTS_PER_EXECUTION": str(
+                    config.PUBLICATION_OBJECTS_PER_EXECUTION
+                )
+            },
         )
 
         # Builds stac
@@ -129,6 +144,25 @@ class LambdaStack(core.Stack):
             env={
                 "COGNITO_APP_SECRET": config.COGNITO_APP_SECRET,
                 "STAC_INGESTOR_API_URL": config.STAC_INGESTOR_API_URL,
+                "STAC_INGESTOR_BULK_PATH": config.STAC_INGESTOR_BULK_PATH,
+            },
+        )
+
+        # Builds and submits batches of STAC items in one invocation, its image
+        # is built from the lambdas directory to reuse build-stac and submit-stac
+        self.publish_stac_lambda = self._lambda(
+            f"{construct_id}-publish-stac-fn",
+            "../lambdas",
+            file="publish-stac/Dockerfile",
+            memory_size=1024,
+            role=external_role,
+            env={
+                "DATA_MANAGEMENT_ROLE_ARN": config.DATA_MANAGEMENT_ROLE_ARN,
+                "CMR_API_URL": config.CMR_API_URL,
+                "COGNITO_APP_SECRET": config.COGNITO_APP_SECRET,
+                "STAC_INGESTOR_API_URL": config.STAC_INGESTOR_API_URL,
+                "STAC_INGESTOR_BULK_PATH": config.STAC_INGESTOR_BULK_PATH,
+                "BUILD_WORKERS": str(config.PUBLICATION_BUILD_WORKERS),
             },
         )
 
@@ -144,14 +178,33 @@ class LambdaStack(core.Stack):
                 "DATA_MANAGEMENT_ROLE_ARN": config.DATA_MANAGEMENT_ROLE_ARN,
             },
             role=external_role,
+            memory_size=config.DATA_TRANSFER_MEMORY_SIZE,
         )
+        if config.SOURCE_ROLE_ARN:
+            self.data_transfer_lambda.add_environment(
+                "SOURCE_ROLE_ARN", config.SOURCE_ROLE_ARN
+            )
+            self.data_transfer_lambda.add_to_role_policy(
+                iam.PolicyStatement(
+                    resources=[config.SOURCE_ROLE_ARN],
+                    actions=["sts:AssumeRole"],
+                )
+            )
 
-        ndjson_bucket = self._bucket(f"{construct_id}-ndjson-bucket")
-        ndjson_bucket.grant_read_write(self.build_stac_lambda.role)
-        ndjson_bucket.grant_read(self.submit_stac_lambda.role)
+        self.ndjson_bucket = self._bucket(f"{construct_id}-ndjson-bucket")
+        self.ndjson_bucket.grant_read_write(self.build_stac_lambda.role)
+        self.ndjson_bucket.grant_read(self.submit_stac_lambda.role)
+        self.ndjson_bucket.grant_read_write(self.publish_stac_lambda.role)
 
-        self.build_stac_lambda.add_environment("BUCKET", ndjson_bucket.bucket_name)
-        self.submit_stac_lambda.add_environment("BUCKET", ndjson_bucket.bucket_name)
+        self.build_stac_lambda.add_environment("BUCKET", self.ndjson_bucket.bucket_name)
+        self.build_stac_lambda.add_environment("ITEM_CACHE_PREFIX", "stac-cache")
+        self.submit_stac_lambda.add_environment(
+            "BUCKET", self.ndjson_bucket.bucket_name
+        )
+        self.publish_stac_lambda.add_environment(
+            "BUCKET", self.ndjson_bucket.bucket_name
+        )
+        self.publish_stac_lambda.add_environment("ITEM_CACHE_PREFIX", "stac-cache")
 
         self.give_permissions()
 
@@ -159,6 +212,7 @@ class LambdaStack(core.Stack):
         self,
         name,
         dir,
+        file="Dockerfile",
         memory_size=1024,
         timeout_seconds=900,
         env=None,
@@ -171,7 +225,7 @@ class LambdaStack(core.Stack):
             function_name=name,
             code=aws_lambda.Code.from_asset_image(
                 directory=dir,
-                file="Dockerfile",
+                file=file,
                 entrypoint=["/usr/local/bin/python", "-m", "awslambdaric"],
                 cmd=["handler.handler"],
             ),
@@ -213,6 +267,7 @@ class LambdaStack(core.Stack):
         for bucket in [internal_bucket, mcp_bucket, *external_buckets]:
             bucket.grant_read(self.s3_discovery_lambda.role)
             bucket.grant_read(self.build_stac_lambda.role)
+            bucket.grant_read(self.publish_stac_lambda.role)
             bucket.grant_read(self.data_transfer_lambda.role)
 
         mcp_bucket.grant_read_write(self.data_transfer_lambda)
@@ -221,6 +276,7 @@ class LambdaStack(core.Stack):
             self, f"{self.construct_id}-secret", config.COGNITO_APP_SECRET
         )
         cognito_app_secret.grant_read(self.submit_stac_lambda.role)
+        cognito_app_secret.grant_read(self.publish_stac_lambda.role)
 
     def _bucket(self, name):
         return s3.Bucket.from_bucket_name(
@@ -5,6 +5,8 @@ from aws_cdk import (
     aws_lambda_event_sources as lambda_event_sources,
 )
 
+import config
+
 if TYPE_CHECKING:
     from .lambda_stack import LambdaStack
 
@@ -31,7 +33,7 @@ class QueueStack(core.Stack):
         lambda_stack.trigger_cogify_lambda.add_event_source(
             lambda_event_sources.SqsEventSource(
                 self.cogify_queue,
-                batch_size=10,
+                batch_size=config.COGIFY_BATCH_SIZE,
                 max_batching_window=core.Duration.seconds(20),
                 report_batch_item_failures=True,
             )
@@ -46,11 +48,13 @@ class QueueStack(core.Stack):
             ),
         )
         self.stac_ready_queue.grant_send_messages(lambda_stack.cogify_lambda.role)
+        self.cogify_queue.grant_send_messages(lambda_stack.enqueue_lambda.role)
+        self.stac_ready_queue.grant_send_messages(lambda_stack.enqueue_lambda.role)
 
         lambda_stack.trigger_ingest_lambda.add_event_source(
             lambda_event_sources.SqsEventSource(
                 self.stac_ready_queue,
-                batch_size=10,
+                batch_size=config.STAC_READY_BATCH_SIZE,
                 max_batching_window=core.Duration.seconds(30),
                 report_batch_item_failures=True,
             )
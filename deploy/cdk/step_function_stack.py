@@ -2,15 +2,25 @@ from re import S
 from typing import TYPE_CHECKING
 from aws_cdk import (
     core,
+    aws_iam as iam,
     aws_stepfunctions as stepfunctions,
     aws_stepfunctions_tasks as tasks,
 )
 
+import config
 
 if TYPE_CHECKING:
     from .queue_stack import QueueStack
     from .lambda_stack import LambdaStack
 
+# Errors of the Lambda service, raised before a function runs
+LAMBDA_SERVICE_ERRORS = [
+    "Lambda.ServiceException",
+    "Lambda.AWSLambdaException",
+    "Lambda.SdkClientException",
+    "Lambda.TooManyRequestsException",
+]
+
 
 class StepFunctionStack(core.Stack):
     def __init__(
@@ -35,22 +45,48 @@ class StepFunctionStack(core.Stack):
         self.publication_workflow = self._publication_workflow(
             lambda_stack=lambda_stack,
         )
+        if config.MANIFEST_PUBLICATION:
+            self.manifest_publication_workflow = self._manifest_publication_workflow(
+                lambda_stack=lambda_stack,
+            )
 
-    def _lambda_task(self, name, lambda_function, input_path=None, output_path=None):
+    def _lambda_task(
+        self, name, lambda_function, input_path=None, output_path=None, **kwargs
+    ):
         return tasks.LambdaInvoke(
             self,
             name,
             lambda_function=lambda_function,
             input_path=input_path,
             output_path=output_path,
+            **kwargs,
         )
 
-    def _sqs_task(self, name, queue, input_path="$"):
-        return tasks.SqsSendMessage(
-            self,
+    def _enqueue_task(
+        self,
+        name,
+        lambda_stack: "LambdaStack",
+        queue,
+        objects_path="$.Payload.objects",
+        objects_per_message=1,
+        output_path=None,
+    ):
+        """
+        Sends the file objects at objects_path to the queue with batched SQS calls,
+        keeping the state's input as its output
+        """
+        return self._lambda_task(
             name,
-            queue=queue,
-            message_body=stepfunctions.TaskInput.from_json_path_at(input_path),
+            lambda_stack.enqueue_lambda,
+            payload=stepfunctions.TaskInput.from_object(
+                {
+                    "queue_url": queue.queue_url,
+                    "objects": stepfunctions.JsonPath.list_at(objects_path),
+                    "objects_per_message": objects_per_message,
+                }
+            ),
+            result_path=stepfunctions.JsonPath.DISCARD,
+            output_path=output_path,
         )
 
     def _discovery_workflow(
@@ -98,16 +134,30 @@ class StepFunctionStack(core.Stack):
             max_attempts=5,
         )
 
-        enqueue_cogify_task = self._sqs_task(
+        enqueue_cogify_task = self._enqueue_task(
             "Send to Cogify queue",
+            lambda_stack,
             queue=queue_stack.cogify_queue,
+            output_path="$.Payload",
         )
 
-        enqueue_ready_task = self._sqs_task(
+        enqueue_ready_task = self._enqueue_task(
             "Send to stac-ready queue",
+            lambda_stack,
             queue=queue_stack.stac_ready_queue,
+            objects_per_message=config.STAC_READY_OBJECTS_PER_MESSAGE,
+            output_path="$.Payload",
         )
 
+        for enqueue_task in (enqueue_cogify_task, enqueue_ready_task):
+            # The enqueue lambda resends failed messages itself, retrying it
+            # would send the others again
+            enqueue_task.add_retry(
+                errors=LAMBDA_SERVICE_ERRORS,
+                interval=core.Duration.seconds(2),
+                max_attempts=5,
+            )
+
         maybe_next_discovery = stepfunctions.Choice(self, "NextDiscovery?").otherwise(
             stepfunctions.Succeed(self, "Successful Ingest")
         )
@@ -116,29 +166,9 @@ class StepFunctionStack(core.Stack):
             stepfunctions.Choice(self, "Cogify?")
             .when(
                 stepfunctions.Condition.boolean_equals("$.Payload.cogify", True),
-                stepfunctions.Map(
-                    self,
-                    "Run concurrent queueing to cogify queue",
-                    max_concurrency=1,
-                    items_path=stepfunctions.JsonPath.string_at("$.Payload.objects"),
-                    result_path=stepfunctions.JsonPath.DISCARD,
-                    output_path="$.Payload",
-                )
-                .iterator(enqueue_cogify_task)
-                .next(maybe_next_discovery),
-            )
-            .otherwise(
-                stepfunctions.Map(
-                    self,
-                    "Run concurrent queueing to stac ready queue",
-                    max_concurrency=1,
-                    items_path=stepfunctions.JsonPath.string_at("$.Payload.objects"),
-                    result_path=stepfunctions.JsonPath.DISCARD,
-                    output_path="$.Payload",
-                )
-                .iterator(enqueue_ready_task)
-                .next(maybe_next_discovery)
+                enqueue_cogify_task.next(maybe_next_discovery),
             )
+            .otherwise(enqueue_ready_task.next(maybe_next_discovery))
         )
 
         discovery_workflow = (
@@ -176,23 +206,43 @@ class StepFunctionStack(core.Stack):
         lambda_stack: "LambdaStack",
         queue_stack: "QueueStack",
     ) -> stepfunctions.StateMachine:
+        # The whole batch of granules is converted by one invocation
         cogify_task = self._lambda_task(
             "Cogify",
             lambda_stack.cogify_lambda,
         )
+        # Granule failures are reported in the output, this retries invocations
+        # that fail as a whole, e.g. timeouts, which resume partial downloads
+        # when they land in the same container
+        cogify_task.add_retry(
+            interval=core.Duration.seconds(10),
+            max_attempts=2,
+            backoff_rate=2,
+        )
 
-        enqueue_task = self._sqs_task(
+        # A granule can produce several COGs, each queued as its own file object
+        enqueue_cogified = self._enqueue_task(
             "Send cogified to stac-ready queue",
+            lambda_stack,
             queue=queue_stack.stac_ready_queue,
-            input_path="$.Payload",
+            objects_per_message=config.STAC_READY_OBJECTS_PER_MESSAGE,
+        )
+        enqueue_cogified.add_retry(
+            errors=LAMBDA_SERVICE_ERRORS,
+            interval=core.Duration.seconds(2),
+            max_attempts=5,
         )
 
-        cogify_workflow = stepfunctions.Map(
-            self,
-            "Run concurrent cogifications",
-            max_concurrency=1,
-            items_path=stepfunctions.JsonPath.string_at("$"),
-        ).iterator(cogify_task.next(enqueue_task))
+        maybe_failed = (
+            stepfunctions.Choice(self, "Cogify failures?")
+            .when(
+                stepfunctions.Condition.is_present("$.Payload.failed[0]"),
+                stepfunctions.Fail(self, "Some granules failed to cogify"),
+            )
+            .otherwise(stepfunctions.Succeed(self, "Successful cogify"))
+        )
+
+        cogify_workflow = cogify_task.next(enqueue_cogified).next(maybe_failed)
 
         return stepfunctions.StateMachine(
             self,
@@ -201,18 +251,60 @@ class StepFunctionStack(core.Stack):
             definition=cogify_workflow,
         )
 
-    def _publication_workflow(
+    def _publish_items(
         self,
         lambda_stack: "LambdaStack",
-    ) -> stepfunctions.StateMachine:
+        concurrency: int,
+        prefix: str = "",
+        input_path: str = None,
+    ) -> stepfunctions.Chain:
+        """
+        Transfers a list of file objects, then builds and submits the STAC items of
+        the transferred ones up to `concurrency` at a time, or
+        PUBLICATION_BUILD_WORKERS at a time in fused mode. The workflow fails after
+        publishing if any object failed to transfer, listing them in `$.failed`.
+        """
         transfer_task = self._lambda_task(
-            "Data Transfer Task",
+            f"{prefix}Data Transfer Task",
             lambda_stack.data_transfer_lambda,
+            input_path=input_path,
             output_path="$.Payload",
         )
 
+        transfer_failed = stepfunctions.Condition.is_present("$.failed[0]")
+
+        if config.PUBLICATION_MODE == "fused":
+            # Items go straight from build to the ingestor, only their IDs and
+            # failures are returned
+            publish_task = self._lambda_task(
+                f"{prefix}Build and Submit STAC Task",
+                lambda_stack.publish_stac_lambda,
+                payload=stepfunctions.TaskInput.from_object(
+                    {
+                        "objects": stepfunctions.JsonPath.list_at("$.objects"),
+                        "build_workers": config.PUBLICATION_BUILD_WORKERS,
+                    }
+                ),
+                result_selector={"failed.$": "$.Payload.failed"},
+                result_path="$.published",
+            )
+            maybe_failed = (
+                stepfunctions.Choice(self, f"{prefix}Publication failures?")
+                .when(
+                    stepfunctions.Condition.or_(
+                        transfer_failed,
+                        stepfunctions.Condition.is_present("$.published.failed[0]"),
+                    ),
+                    stepfunctions.Fail(
+                        self, f"{prefix}Some items failed to transfer or publish"
+                    ),
+                )
+                .otherwise(stepfunctions.Succeed(self, f"{prefix}Published"))
+            )
+            return transfer_task.next(publish_task).next(maybe_failed)
+
         build_stac_item_task = self._lambda_task(
-            "Build STAC Task",
+            f"{prefix}Build STAC Task",
             lambda_stack.build_stac_lambda,
             output_path="$.Payload",
         )
@@ -224,19 +316,64 @@ class StepFunctionStack(core.Stack):
         )
 
         submit_stac_item_task = self._lambda_task(
-            "Submit to STAC Ingestor Task",
+            f"{prefix}Submit to STAC Ingestor Task",
             lambda_stack.submit_stac_lambda,
             input_path="$",
         )
 
         build_and_submit_stac_items = stepfunctions.Map(
             self,
-            "Submit to STAC Ingestor",
-            max_concurrency=1,
-            items_path=stepfunctions.JsonPath.string_at("$"),
+            f"{prefix}Submit to STAC Ingestor",
+            max_concurrency=concurrency,
+            items_path=stepfunctions.JsonPath.string_at("$.objects"),
+            result_path=stepfunctions.JsonPath.DISCARD,
         ).iterator(build_stac_item_task.next(submit_stac_item_task))
 
-        publish_workflow = transfer_task.next(build_and_submit_stac_items)
+        maybe_failed = (
+            stepfunctions.Choice(self, f"{prefix}Transfer failures?")
+            .when(
+                transfer_failed,
+                stepfunctions.Fail(self, f"{prefix}Some items failed to transfer"),
+            )
+            .otherwise(stepfunctions.Succeed(self, f"{prefix}Published"))
+        )
+        return transfer_task.next(build_and_submit_stac_items).next(maybe_failed)
+
+    def _by_collection(
+        self, name: str, collection_path: str, workflow: str, branch
+    ) -> stepfunctions.IChainable:
+        """
+        Runs `branch(prefix, concurrency, collection)` with the concurrency
+        configured for the workflow, or for the collection at collection_path when
+        it overrides it (collection is None in the default branch)
+        """
+        default = branch("", config.WORKFLOW_CONCURRENCY[workflow], None)
+        if not config.COLLECTION_CONCURRENCY:
+            return default
+        choice = stepfunctions.Choice(self, name)
+        for collection, concurrency in config.COLLECTION_CONCURRENCY.items():
+            choice.when(
+                stepfunctions.Condition.and_(
+                    stepfunctions.Condition.is_present(collection_path),
+                    stepfunctions.Condition.string_equals(collection_path, collection),
+                ),
+                branch(f"{collection} ", concurrency, collection),
+            )
+        return choice.otherwise(default)
+
+    def _publication_workflow(
+        self,
+        lambda_stack: "LambdaStack",
+    ) -> stepfunctions.StateMachine:
+        # Executions are started with the file objects of a single collection
+        publish_workflow = self._by_collection(
+            "Publication concurrency",
+            "$[0].collection",
+            "publication",
+            lambda prefix, concurrency, collection: self._publish_items(
+                lambda_stack, concurrency, prefix
+            ),
+        )
 
         return stepfunctions.StateMachine(
             self,
@@ -245,6 +382,119 @@ class StepFunctionStack(core.Stack):
             definition=publish_workflow,
         )
 
+    def _manifest_map(
+        self,
+        lambda_stack: "LambdaStack",
+        prefix: str,
+        concurrency: int,
+        item_concurrency: int,
+    ) -> stepfunctions.CustomState:
+        """
+        Distributed Map publishing the file objects listed, one JSON object per
+        line, in the NDJSON manifest at `$.key` of the ndjson bucket. Each child
+        execution publishes a batch of objects, `item_concurrency` items at a time,
+        with `concurrency` children at a time; results are written to the bucket.
+        """
+        processor = stepfunctions.StateGraph(
+            self._publish_items(
+                lambda_stack,
+                item_concurrency,
+                f"{prefix}Manifest ",
+                input_path="$.Items",
+            ).start_state,
+            f"{prefix}Manifest batch",
+        )
+        self.manifest_policy_statements.extend(processor.policy_statements)
+
+        return stepfunctions.CustomState(
+            self,
+            f"{prefix}Publish manifest",
+            state_json={
+                "Type": "Map",
+                "ItemReader": {
+                    "Resource": "arn:aws:states:::s3:getObject",
+                    "ReaderConfig": {"InputType": "JSONL"},
+                    "Parameters": {
+                        "Bucket": lambda_stack.ndjson_bucket.bucket_name,
+                        "Key.$": "$.key",
+                    },
+                },
+                "ItemBatcher": {"MaxItemsPerBatch": config.MANIFEST_BATCH_SIZE},
+                "ItemProcessor": {
+                    "ProcessorConfig": {
+                        "Mode": "DISTRIBUTED",
+                        "ExecutionType": "STANDARD",
+                    },
+                    **processor.to_graph_json(),
+                },
+                "MaxConcurrency": concurrency,
+                "ResultWriter": {
+                    "Resource": "arn:aws:states:::s3:putObject",
+                    "Parameters": {
+                        "Bucket": lambda_stack.ndjson_bucket.bucket_name,
+                        "Prefix": "manifest-results",
+                    },
+                },
+            },
+        )
+
+    def _manifest_publication_workflow(
+        self,
+        lambda_stack: "LambdaStack",
+    ) -> stepfunctions.StateMachine:
+        self.manifest_policy_statements = []
+        state_machine_name = f"{self.stack_name}-publication-manifest"
+
+        # Input: {"key": "manifests/xxx.ndjson", "collection": "xxx"}
+        publish_workflow = self._by_collection(
+            "Manifest publication concurrency",
+            "$.collection",
+            "publication-manifest",
+            lambda prefix, concurrency, collection: self._manifest_map(
+                lambda_stack,
+                prefix,
+                concurrency,
+                # Collections that override the concurrency also publish their
+                # items at that concurrency, as in the publication workflow
+                item_concurrency=(
+                    concurrency
+                    if collection
+                    else config.WORKFLOW_CONCURRENCY["publication"]
+                ),
+            ),
+        )
+
+        state_machine = stepfunctions.StateMachine(
+            self,
+            "publication-manifest-sf",
+            state_machine_name=state_machine_name,
+            definition=publish_workflow,
+        )
+
+        # The Distributed Map's child executions run under the parent's role
+        for statement in self.manifest_policy_statements:
+            state_machine.add_to_role_policy(statement)
+        lambda_stack.ndjson_bucket.grant_read_write(state_machine)
+        state_machine.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["states:StartExecution"],
+                resources=[
+                    f"arn:aws:states:{self.region}:{self.account}:stateMachine:"
+                    f"{state_machine_name}"
+                ],
+            )
+        )
+        state_machine.add_to_role_policy(
+            iam.PolicyStatement(
+                actions=["states:DescribeExecution", "states:StopExecution"],
+                resources=[
+                    f"arn:aws:states:{self.region}:{self.account}:execution:"
+                    f"{state_machine_name}/*"
+                ],
+            )
+        )
+        return state_machine
+
     def build_arn(self, env_vars, key):
         base_str = f"arn:aws:states:{env_vars.region}:{env_vars.account}:stateMachine:"
         return f"{base_str}{self.construct_id}-{key}"
@@ -1,13 +1,60 @@
+import json
 import os
 
-
 ENV = os.environ.get("ENV")
 
 COGNITO_APP_SECRET = os.environ["COGNITO_APP_SECRET"]
 STAC_INGESTOR_API_URL = os.environ["STAC_INGESTOR_API_URL"]
+# Optional bulk ingestion endpoint of the STAC ingestor, e.g. "/ingestions/bulk"
+STAC_INGESTOR_BULK_PATH = os.environ.get("STAC_INGESTOR_BULK_PATH", "")
 
 EARTHDATA_USERNAME = os.environ.get("EARTHDATA_USERNAME", "XXXX")
 EARTHDATA_PASSWORD = os.environ.get("EARTHDATA_PASSWORD", "XXXX")
+# Earthdata Login bearer token, which cogify prefers over the username and password
+EARTHDATA_TOKEN = os.environ.get("EARTHDATA_TOKEN", "")
+
+# Cogify converts a batch of granules in parallel, one per vCPU as long as they
+# fit in memory; more memory gives the function more vCPUs
+COGIFY_MEMORY_SIZE = int(os.environ.get("COGIFY_MEMORY_SIZE", 1024))
+
+# Data transfer streams objects through part buffers sized from its memory
+DATA_TRANSFER_MEMORY_SIZE = int(os.environ.get("DATA_TRANSFER_MEMORY_SIZE", 1024))
+
+# Granules per cogify execution, read from the cogify queue in one batch
+COGIFY_BATCH_SIZE = int(os.environ.get("COGIFY_BATCH_SIZE", 10))
+# Messages read from the stac-ready queue per proxy invocation, coalesced into
+# publication executions of up to PUBLICATION_OBJECTS_PER_EXECUTION objects
+STAC_READY_BATCH_SIZE = int(os.environ.get("STAC_READY_BATCH_SIZE", 100))
+PUBLICATION_OBJECTS_PER_EXECUTION = int(
+    os.environ.get("PUBLICATION_OBJECTS_PER_EXECUTION", 100)
+)
+
+# File objects packed into each stac-ready message; the publication workflow
+# receives up to PUBLICATION_OBJECTS_PER_EXECUTION objects per execution
+STAC_READY_OBJECTS_PER_MESSAGE = int(
+    os.environ.get("STAC_READY_OBJECTS_PER_MESSAGE", 1)
+)
+
+# Max concurrency of each workflow's Map states (0 means no limit). Collections
+# can override it, e.g. COLLECTION_CONCURRENCY='{"icesat2-boreal": 10}'
+WORKFLOW_CONCURRENCY = {
+    "publication": int(os.environ.get("PUBLICATION_CONCURRENCY", 1)),
+    "publication-manifest": int(
+        os.environ.get("MANIFEST_PUBLICATION_CONCURRENCY", 100)
+    ),
+}
+COLLECTION_CONCURRENCY = json.loads(os.environ.get("COLLECTION_CONCURRENCY", "{}"))
+
+# "fused" builds and submits each batch of STAC items in one publish-stac
+# invocation, "separate" runs build-stac then submit-stac for every item
+PUBLICATION_MODE = os.environ.get("PUBLICATION_MODE", "separate")
+# Items each publish-stac invocation builds at a time in fused mode
+PUBLICATION_BUILD_WORKERS = int(os.environ.get("PUBLICATION_BUILD_WORKERS", 8))
+
+# Deploys a publication workflow that reads NDJSON manifests of file objects
+# with a Distributed Map, publishing MANIFEST_BATCH_SIZE objects per child
+MANIFEST_PUBLICATION = os.environ.get("MANIFEST_PUBLICATION", "false") == "true"
+MANIFEST_BATCH_SIZE = int(os.environ.get("MANIFEST_BATCH_SIZE", 50))
 
 APP_NAME = "veda-data-pipelines"
 VEDA_DATA_BUCKET = "veda-data-store"
@@ -23,4 +70,7 @@ STAC_PROVIDER = "NASA_MAAP"
 
 # This should throw if it is not provided
 DATA_MANAGEMENT_ROLE_ARN = os.environ.get("DATA_MANAGEMENT_ROLE_ARN")
+# Role the data transfer reads sources with when the data management role is
+# denied a server-side copy, the function's own role when unset
+SOURCE_ROLE_ARN = os.environ.get("SOURCE_ROLE_ARN")
 CMR_API_URL = os.environ.get("CMR_API_URL")
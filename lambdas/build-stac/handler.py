@@ -1,11 +1,15 @@
+import gzip
+import hashlib
 import json
 import os
-from sys import getsizeof
 from typing import Any, Dict, TypedDict, Union
-from uuid import uuid4
 
-import smart_open
-from utils import events, stac
+import boto3
+from botocore.exceptions import ClientError
+from utils import cache, events, stac
+
+# Step Functions state payloads are limited to 256 KB
+MAX_PAYLOAD_SIZE = 256 * 1024
 
 
 class S3LinkOutput(TypedDict):
@@ -36,22 +40,58 @@ def handler(event: Dict[str, Any], context) -> Union[S3LinkOutput, StacItemOutpu
 
     """
 
-    EventType = events.CmrEvent if event.get("granule_id") else events.RegexEvent
-    parsed_event = EventType.parse_obj(event)
-    stac_item = stac.generate_stac(parsed_event).to_dict()
+    stac_item = build_stac_item(event)
 
     output: StacItemOutput = {"stac_item": stac_item}
 
     # Return STAC Item Directly
-    if getsizeof(json.dumps(output)) < (256 * 1024):
+    if len(json.dumps(output).encode("utf8")) < MAX_PAYLOAD_SIZE:
         return output
 
     # Return link to STAC Item
-    key = f"s3://{os.environ['BUCKET']}/{uuid4()}.json"
-    with smart_open.open(key, "w") as file:
-        file.write(json.dumps(stac_item))
+    return {"stac_file_url": spill_stac_item(stac_item)}
+
+
+def build_stac_item(event: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Builds the STAC Item of a file object, or returns it from the item cache
+    """
+    EventType = events.CmrEvent if event.get("granule_id") else events.RegexEvent
+    parsed_event = EventType.parse_obj(event)
+    return cache.get_or_create(
+        parsed_event,
+        lambda: stac.add_reference(
+            stac.add_file_info(stac.generate_stac(parsed_event), parsed_event),
+            parsed_event,
+        ).to_dict(),
+    )
 
-    return {"stac_file_url": key}
+
+def spill_stac_item(stac_item: Dict[str, Any]) -> str:
+    """
+    Writes a STAC Item that is too large for the state payload to S3, gzip-compressed
+    and keyed by its content hash so that retries don't write duplicates.
+    The SPILL_PREFIX (default `spill/`) can be targeted by a bucket lifecycle rule.
+    """
+    body = json.dumps(stac_item).encode("utf8")
+    bucket = os.environ["BUCKET"]
+    prefix = os.environ.get("SPILL_PREFIX", "spill").strip("/")
+    key = f"{prefix}/{hashlib.sha256(body).hexdigest()}.json.gz"
+
+    s3 = boto3.client("s3")
+    try:
+        s3.head_object(Bucket=bucket, Key=key)
+    except ClientError:
+        s3.put_object(
+            Bucket=bucket,
+            Key=key,
+            # mtime is fixed so identical items produce identical objects
+            Body=gzip.compress(body, mtime=0),
+            ContentType="application/json",
+            ContentEncoding="gzip",
+        )
+
+    return f"s3://{bucket}/{key}"
 
 
 if __name__ == "__main__":
@@ -0,0 +1,102 @@
+import os
+from unittest import mock
+from unittest.mock import MagicMock
+
+import pytest
+from botocore.exceptions import ClientError
+from utils import cache, events
+
+
+@pytest.fixture
+def cache_environment(s3_created_bucket, tmp_path):
+    with mock.patch.dict(os.environ, {"ITEM_CACHE_PREFIX": "stac-cache"}), mock.patch(
+        "utils.cache.LOCAL_CACHE_DIR", tmp_path
+    ):
+        yield s3_created_bucket
+
+
+@pytest.fixture
+def source_event(cache_environment):
+    source = cache_environment.put_object(
+        Body=b"raster", Key="data/file_2020-01-01.tif"
+    )
+    return events.RegexEvent.parse_obj(
+        {
+            "collection": "test-collection",
+            "remote_fileurl": f"s3://{source.bucket_name}/{source.key}",
+        }
+    )
+
+
+def test_cache_hit_skips_create(source_event, tmp_path):
+    """
+    Ensure that an unchanged source and event returns the cached item.
+    """
+    create = MagicMock(return_value={"id": "item"})
+
+    assert cache.get_or_create(source_event, create) == {"id": "item"}
+    assert cache.get_or_create(source_event, create) == {"id": "item"}
+    assert create.call_count == 1
+
+    # The S3 copy is used once the local copy is gone
+    for path in tmp_path.iterdir():
+        path.unlink()
+    assert cache.get_or_create(source_event, create) == {"id": "item"}
+    assert create.call_count == 1
+
+
+def test_cache_miss_on_changes(source_event, cache_environment):
+    """
+    Ensure that changes to the source object or event parameters rebuild the item.
+    """
+    create = MagicMock(return_value={"id": "item"})
+    cache.get_or_create(source_event, create)
+
+    changed_event = source_event.copy(update={"properties": {"foo": "bar"}})
+    cache.get_or_create(changed_event, create)
+    assert create.call_count == 2
+
+    cache_environment.put_object(Body=b"new raster", Key="data/file_2020-01-01.tif")
+    cache.get_or_create(source_event, create)
+    assert create.call_count == 3
+
+
+def test_cache_disabled(source_event):
+    """
+    Ensure that the cache is skipped when no prefix is configured.
+    """
+    create = MagicMock(return_value={"id": "item"})
+    with mock.patch.dict(os.environ):
+        del os.environ["ITEM_CACHE_PREFIX"]
+        cache.get_or_create(source_event, create)
+        cache.get_or_create(source_event, create)
+    assert create.call_count == 2
+
+
+def test_cache_errors_bypass_the_cache(source_event):
+    """
+    Ensure that errors other than a missing item, e.g. AccessDenied, build the item
+    instead of failing.
+    """
+    create = MagicMock(return_value={"id": "item"})
+    denied = ClientError({"Error": {"Code": "AccessDenied"}}, "GetObject")
+    session = cache.role.session()
+    s3 = session.client("s3")
+    with mock.patch.object(s3, "get_object", side_effect=denied), mock.patch.object(
+        s3, "put_object", side_effect=denied
+    ), mock.patch.object(session, "client", return_value=s3):
+        assert cache.get_or_create(source_event, create) == {"id": "item"}
+    assert create.call_count == 1
+
+
+def test_code_version_includes_handler(tmp_path):
+    """
+    Ensure that changes to the handler change the code version.
+    """
+    (tmp_path / "utils").mkdir()
+    (tmp_path / "utils" / "stac.py").write_text("# stac")
+    (tmp_path / "handler.py").write_text("# handler")
+    with mock.patch("utils.cache.UTILS_DIR", tmp_path / "utils"):
+        before = cache.code_version()
+        (tmp_path / "handler.py").write_text("# changed handler")
+        assert cache.code_version() != before
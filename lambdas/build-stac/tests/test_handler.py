@@ -1,4 +1,6 @@
 import contextlib
+import gzip
+import json
 from typing import TYPE_CHECKING, Any, Dict, Type
 from unittest.mock import MagicMock, Mock
 
@@ -99,3 +101,33 @@ def test_routing_unexpected_event(bad_event):
     """
     with pytest.raises(ValidationError):
         handler.handler(bad_event, None)
+
+
+def test_spill_large_item(s3_created_bucket):
+    """
+    Ensure that items too large for the state payload are spilled once, compressed.
+    """
+    cmr_event = {
+        "collection": "test-collection",
+        "remote_fileurl": "s3://test-bucket/delivery/BMHD_Maria_Stages/70001_BeforeMaria_Stage0_2017-07-21.tif",
+        "granule_id": "test-granule",
+    }
+    large_item = {"id": "large", "properties": {"description": "x" * 300 * 1024}}
+
+    with override_registry(
+        stac.generate_stac,
+        events.CmrEvent,
+        MagicMock(return_value=build_mock_stac_item(large_item)),
+    ):
+        first = handler.handler(cmr_event, None)
+        second = handler.handler(cmr_event, None)
+
+    assert first == second
+    assert first["stac_file_url"].startswith(f"s3://{s3_created_bucket.name}/spill/")
+    assert first["stac_file_url"].endswith(".json.gz")
+
+    spills = list(s3_created_bucket.objects.filter(Prefix="spill/"))
+    assert len(spills) == 1
+    body = spills[0].get()["Body"].read()
+    assert len(body) < 1024
+    assert json.loads(gzip.decompress(body)) == large_item
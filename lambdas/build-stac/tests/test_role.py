@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import pytest
+from utils import role
+
+
+@pytest.fixture(autouse=True)
+def clear_credentials():
+    role._credentials.clear()
+    yield
+    role._credentials.clear()
+
+
+def credentials(expires_in):
+    return {
+        "Credentials": {
+            "AccessKeyId": "key",
+            "SecretAccessKey": "secret",
+            "SessionToken": "token",
+            "Expiration": datetime.now(timezone.utc) + expires_in,
+        }
+    }
+
+
+def test_assume_role_reuses_credentials():
+    with patch.object(role, "session") as session:
+        sts = session.return_value.client.return_value
+        sts.assume_role.return_value = credentials(timedelta(hours=1))
+        first = role.assume_role("arn:aws:iam::0:role/test", "test")
+        second = role.assume_role("arn:aws:iam::0:role/test", "test")
+
+    assert first is second
+    sts.assume_role.assert_called_once()
+
+
+def test_assume_role_refreshes_expiring_credentials():
+    with patch.object(role, "session") as session:
+        sts = session.return_value.client.return_value
+        sts.assume_role.return_value = credentials(timedelta(minutes=1))
+        role.assume_role("arn:aws:iam::0:role/test", "test")
+        role.assume_role("arn:aws:iam::0:role/test", "test")
+
+    assert sts.assume_role.call_count == 2
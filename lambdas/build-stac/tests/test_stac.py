@@ -0,0 +1,95 @@
+from datetime import datetime
+from unittest.mock import patch
+
+import pystac
+from utils import events
+from utils.stac import FILE_EXTENSION, add_file_info, add_reference, generate_stac
+
+
+def test_add_file_info():
+    """
+    Ensure that the transferred file's size and checksum are added to its asset.
+    """
+    remote_fileurl = "s3://test-bucket/collection/file_2020-01-01.tif"
+    stac_item = pystac.Item(
+        id="item",
+        geometry=None,
+        bbox=None,
+        datetime=datetime(2020, 1, 1),
+        properties={},
+    )
+    stac_item.add_asset("cog_default", pystac.Asset(href=remote_fileurl))
+    stac_item.add_asset("metadata", pystac.Asset(href="https://example.com/meta"))
+    event = events.RegexEvent.parse_obj(
+        {
+            "collection": "collection",
+            "remote_fileurl": remote_fileurl,
+            "file_size": 1024,
+            "file_checksum": "d50110" + "0" * 32,
+        }
+    )
+
+    item = add_file_info(stac_item, event).to_dict()
+
+    assert item["stac_extensions"] == [FILE_EXTENSION]
+    assert item["assets"]["cog_default"]["file:size"] == 1024
+    assert item["assets"]["cog_default"]["file:checksum"] == "d50110" + "0" * 32
+    assert "file:size" not in item["assets"]["metadata"]
+
+
+def test_item_from_raster_metadata():
+    """
+    Ensure that an item is built from cogify's raster metadata without opening the file.
+    """
+    raster_metadata = {
+        "bbox": [-180.0, -85.0, 180.0, 85.0],
+        "geometry": {
+            "type": "Polygon",
+            "coordinates": [
+                [[-180.0, -85.0], [180.0, -85.0], [180.0, 85.0], [-180.0, 85.0]]
+            ],
+        },
+        "proj": {"epsg": 3857, "shape": [256, 256]},
+        "raster:bands": [{"data_type": "int16", "nodata": -32767.0}],
+    }
+    event = events.RegexEvent.parse_obj(
+        {
+            "collection": "collection",
+            "remote_fileurl": "s3://test-bucket/collection/file_2020-01-01.tif",
+            "raster_metadata": raster_metadata,
+        }
+    )
+
+    with patch("utils.stac.stac.create_stac_item") as create_stac_item:
+        item = generate_stac(event).to_dict()
+
+    create_stac_item.assert_not_called()
+    assert item["bbox"] == raster_metadata["bbox"]
+    assert item["properties"]["proj:epsg"] == 3857
+    assert item["properties"]["proj:shape"] == [256, 256]
+    assert item["properties"]["datetime"] == "2020-01-01T00:00:00Z"
+    asset = item["assets"]["cog_default"]
+    assert asset["href"] == event.remote_fileurl
+    assert asset["raster:bands"] == raster_metadata["raster:bands"]
+
+
+def test_add_reference():
+    """
+    Ensure that a granule published through a reference gets it as an asset,
+    without opening the granule.
+    """
+    event = events.RegexEvent.parse_obj(
+        {
+            "collection": "collection",
+            "remote_fileurl": "s3://test-bucket/collection/file_2020-01-01.nc",
+            "reference_url": "s3://test-bucket/collection/references/file.json",
+            "mode": "reference",
+        }
+    )
+
+    with patch("utils.stac.stac.create_stac_item") as create_stac_item:
+        item = add_reference(generate_stac(event), event).to_dict()
+
+    create_stac_item.assert_not_called()
+    assert item["assets"]["reference"]["href"] == event.reference_url
+    assert item["assets"]["reference"]["type"] == "application/json"
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+from botocore.exceptions import ClientError
+
+from . import events, role
+
+LOCAL_CACHE_DIR = Path("/tmp/stac-cache")
+UTILS_DIR = Path(__file__).parent
+# The build-stac handler, copied as build_stac.py into the publish-stac image
+HANDLER_NAMES = ("build_stac.py", "handler.py")
+
+
+def code_version() -> str:
+    """
+    Returns the version of the item-building code, either from the CODE_VERSION
+    environment variable or from a digest of the build-stac sources
+    """
+    if version := os.environ.get("CODE_VERSION"):
+        return version
+    digest = hashlib.sha256()
+    for path in sorted(UTILS_DIR.glob("*.py")):
+        digest.update(path.read_bytes())
+    for name in HANDLER_NAMES:
+        if (handler_path := UTILS_DIR.parent / name).exists():
+            digest.update(handler_path.read_bytes())
+            break
+    return digest.hexdigest()
+
+
+def source_etag(remote_fileurl: str) -> Optional[str]:
+    """
+    Fetches the ETag of the source object with a single HEAD request
+    """
+    url = urlparse(remote_fileurl)
+    if url.scheme == "s3":
+        kwargs = {}
+        if role_arn := os.environ.get("DATA_MANAGEMENT_ROLE_ARN"):
+            creds = role.assume_role(role_arn, "veda-data-pipelines_build-stac")
+            kwargs = {
+                "aws_access_key_id": creds["AccessKeyId"],
+                "aws_secret_access_key": creds["SecretAccessKey"],
+                "aws_session_token": creds["SessionToken"],
+            }
+        response = (
+            role.session()
+            .client("s3", **kwargs)
+            .head_object(Bucket=url.hostname, Key=url.path.lstrip("/"))
+        )
+        return response["ETag"]
+    if url.scheme in ("http", "https"):
+        response = requests.head(remote_fileurl, allow_redirects=True)
+        response.raise_for_status()
+        return response.headers.get("ETag")
+    return None
+
+
+def cache_key(event: events.BaseEvent, etag: str) -> str:
+    """
+    Builds a cache key from the source ETag, the normalized event and the code version
+    """
+    parameters = json.dumps(event.dict(), sort_keys=True, default=str)
+    digest = hashlib.sha256()
+    for part in (etag, parameters, code_version()):
+        digest.update(part.encode("utf8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _read(key: str, bucket: str, prefix: str) -> Optional[Dict[str, Any]]:
+    local_path = LOCAL_CACHE_DIR / f"{key}.json"
+    if local_path.exists():
+        return json.loads(local_path.read_text())
+
+    try:
+        response = (
+            role.session()
+            .client("s3")
+            .get_object(Bucket=bucket, Key=f"{prefix.strip('/')}/{key}.json")
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            print(f"Caught exception {e}, not using the item cache")
+        return None
+    stac_item = json.load(response["Body"])
+    _write_local(key, stac_item)
+    return stac_item
+
+
+def _write_local(key: str, stac_item: Dict[str, Any]):
+    LOCAL_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    (LOCAL_CACHE_DIR / f"{key}.json").write_text(json.dumps(stac_item))
+
+
+def _write(key: str, bucket: str, prefix: str, stac_item: Dict[str, Any]):
+    _write_local(key, stac_item)
+    role.session().client("s3").put_object(
+        Bucket=bucket,
+        Key=f"{prefix.strip('/')}/{key}.json",
+        Body=json.dumps(stac_item).encode("utf8"),
+        ContentType="application/json",
+    )
+
+
+def get_or_create(
+    event: events.BaseEvent, create: Callable[[], Dict[str, Any]]
+) -> Dict[str, Any]:
+    """
+    Returns the previously built STAC item for an unchanged source object and event,
+    calling `create` to build (and cache) it otherwise.
+
+    Caching is enabled by setting the ITEM_CACHE_PREFIX environment variable, which is
+    the prefix under which items are stored in the BUCKET. Items are also kept in /tmp
+    so warm containers don't need to fetch them again.
+    """
+    prefix = os.environ.get("ITEM_CACHE_PREFIX")
+    bucket = os.environ.get("BUCKET")
+    if not (prefix and bucket):
+        return create()
+
+    try:
+        etag = source_etag(event.remote_fileurl)
+    except Exception as e:
+        print(f"Caught exception {e}, not using the item cache")
+        return create()
+    if not etag:
+        return create()
+
+    key = cache_key(event, etag)
+    if stac_item := _read(key, bucket, prefix):
+        print(f"Using cached STAC item {key}")
+        return stac_item
+
+    stac_item = create()
+    try:
+        _write(key, bucket, prefix, stac_item)
+    except ClientError as e:
+        print(f"Caught exception {e}, not caching STAC item {key}")
+    return stac_item
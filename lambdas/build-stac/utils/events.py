@@ -22,6 +22,14 @@ class BaseEvent(BaseModel, frozen=True, arbitrary_types_allowed=True):
     mode: Optional[str] = None
     test_links: Optional[bool] = False
     reverse_coords: Optional[bool]
+    # Recorded by data-transfer, published with the STAC file extension
+    file_size: Optional[int] = None
+    file_checksum: Optional[str] = None
+    # Footprint, projection and raster bands described by cogify, so the
+    # item can be built without opening the file
+    raster_metadata: Optional[Dict] = None
+    # Kerchunk reference to the file's chunks, written by cogify's reference output
+    reference_url: Optional[str] = None
 
     def item_id(self: "BaseEvent") -> str:
         if self.id_regex:
@@ -1,10 +1,40 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
 import boto3
 
+# Credentials are refreshed this long before they expire
+REFRESH_MARGIN = timedelta(minutes=5)
+
+_local = threading.local()
+_lock = threading.Lock()
+_credentials = {}
+
+
+def session() -> boto3.session.Session:
+    """
+    Returns a boto3 session for the current thread, since the default session
+    isn't safe to create clients from in several threads
+    """
+    if not hasattr(_local, "session"):
+        _local.session = boto3.session.Session()
+    return _local.session
+
 
 def assume_role(role_arn, session_name):
-    sts = boto3.client("sts")
-    creds = sts.assume_role(
-        RoleArn=role_arn,
-        RoleSessionName=session_name,
-    )
-    return creds["Credentials"]
+    """
+    Assumes the role, reusing its credentials until they are about to expire, so
+    items built in the same container don't each assume it again
+    """
+    with _lock:
+        creds = _credentials.get((role_arn, session_name))
+        if creds is None or creds["Expiration"] - REFRESH_MARGIN <= datetime.now(
+            timezone.utc
+        ):
+            sts = session().client("sts")
+            creds = sts.assume_role(
+                RoleArn=role_arn,
+                RoleSessionName=session_name,
+            )["Credentials"]
+            _credentials[(role_arn, session_name)] = creds
+        return creds
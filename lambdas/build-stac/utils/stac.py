@@ -12,6 +12,7 @@ from cmr import GranuleQuery
 from pystac.utils import str_to_datetime
 from rasterio.session import AWSSession
 from rio_stac import stac
+from rio_stac.stac import PROJECTION_EXT_VERSION, RASTER_EXT_VERSION
 
 from . import events, regex, role
 
@@ -30,10 +31,25 @@ def create_item(
     asset_name=None,
     asset_roles=None,
     asset_media_type=None,
+    raster_metadata=None,
 ) -> pystac.Item:
     """
-    Function to create a stac item from a COG using rio_stac
+    Function to create a stac item from a COG using rio_stac, or from the
+    raster metadata cogify recorded for it
     """
+    if raster_metadata and mode != "cmr":
+        return item_from_raster_metadata(
+            id=id,
+            properties=properties,
+            datetime=datetime,
+            item_url=item_url,
+            collection=collection,
+            raster_metadata=raster_metadata,
+            assets=assets,
+            asset_name=asset_name,
+            asset_roles=asset_roles,
+            asset_media_type=asset_media_type,
+        )
 
     def create_item_item():
         stac_item = pystac.Item(
@@ -46,11 +62,12 @@ def create_item(
             bbox=bbox,
         )
         stac_item.links.extend(links)
-        stac_item.assets = assets
+        stac_item.assets = assets or {}
         return stac_item
 
     def create_stac_item():
-        if mode == "cmr":
+        # References point to files that rasterio doesn't need to open
+        if mode in ("cmr", "reference"):
             return create_item_item()
         try:
             # `stac.create_stac_item` tries to opon a dataset with rasterio.
@@ -101,6 +118,108 @@ def create_item(
         return create_stac_item()
 
 
+def item_from_raster_metadata(
+    id,
+    properties,
+    datetime,
+    item_url,
+    collection,
+    raster_metadata,
+    assets=None,
+    asset_name=None,
+    asset_roles=None,
+    asset_media_type=None,
+) -> pystac.Item:
+    """
+    Builds the item `stac.create_stac_item` would, from metadata computed by cogify
+    rather than by reading the COG
+    """
+    properties = {
+        **(properties or {}),
+        **{f"proj:{name}": value for name, value in raster_metadata["proj"].items()},
+    }
+    stac_item = pystac.Item(
+        id=id,
+        geometry=raster_metadata["geometry"],
+        bbox=raster_metadata["bbox"],
+        collection=collection,
+        stac_extensions=[
+            f"https://stac-extensions.github.io/projection/{PROJECTION_EXT_VERSION}/schema.json",
+            f"https://stac-extensions.github.io/raster/{RASTER_EXT_VERSION}/schema.json",
+        ],
+        datetime=datetime,
+        properties=properties,
+    )
+    if collection:
+        stac_item.add_link(
+            pystac.Link(
+                pystac.RelType.COLLECTION, collection, media_type=pystac.MediaType.JSON
+            )
+        )
+    if assets:
+        for key, asset in assets.items():
+            stac_item.add_asset(key=key, asset=asset)
+        return stac_item
+    stac_item.add_asset(
+        key=asset_name or "cog_default",
+        asset=pystac.Asset(
+            href=item_url,
+            media_type=(
+                asset_media_type
+                or "image/tiff; application=geotiff; profile=cloud-optimized"
+            ),
+            extra_fields={"raster:bands": raster_metadata["raster:bands"]},
+            roles=asset_roles or ["data", "layer"],
+        ),
+    )
+    return stac_item
+
+
+FILE_EXTENSION = "https://stac-extensions.github.io/file/v2.1.0/schema.json"
+
+
+def add_file_info(stac_item: pystac.Item, item: events.BaseEvent) -> pystac.Item:
+    """
+    Adds the file size and checksum recorded during transfer to the asset of the
+    event's file, using the STAC file extension
+    """
+    file_fields = {}
+    if item.file_size is not None:
+        file_fields["file:size"] = item.file_size
+    if item.file_checksum:
+        file_fields["file:checksum"] = item.file_checksum
+    if not file_fields:
+        return stac_item
+
+    for asset in (stac_item.assets or {}).values():
+        if asset.href == item.remote_fileurl:
+            asset.extra_fields.update(file_fields)
+            if FILE_EXTENSION not in stac_item.stac_extensions:
+                stac_item.stac_extensions.append(FILE_EXTENSION)
+    return stac_item
+
+
+REFERENCE_MEDIA_TYPE = "application/json"
+
+
+def add_reference(stac_item: pystac.Item, item: events.BaseEvent) -> pystac.Item:
+    """
+    Adds the kerchunk reference written by cogify as an asset, through which the
+    file's data can be opened lazily as Zarr
+    """
+    if item.reference_url:
+        stac_item.add_asset(
+            "reference",
+            pystac.Asset(
+                href=item.reference_url,
+                media_type=REFERENCE_MEDIA_TYPE,
+                roles=["references", "index"],
+                title="Kerchunk reference",
+            ),
+        )
+    return stac_item
+
+
 @singledispatch
 def generate_stac(item) -> pystac.Item:
     """
@@ -135,12 +254,15 @@ def generate_stac_regexevent(item: events.RegexEvent) -> pystac.Item:
     return create_item(
         id=item.item_id(),
         properties=properties,
+        links=[],
+        mode=item.mode,
         datetime=single_datetime,
         item_url=item.remote_fileurl,
         collection=item.collection,
         asset_name=item.asset_name,
         asset_roles=item.asset_roles,
         asset_media_type=item.asset_media_type,
+        raster_metadata=item.raster_metadata,
     )
 
 
@@ -342,4 +464,5 @@ def generate_stac_cmrevent(item: events.CmrEvent) -> pystac.Item:
         assets=assets,
         bbox=bbox,
         geometry=geometry,
+        raster_metadata=item.raster_metadata,
     )
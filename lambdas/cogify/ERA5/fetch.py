@@ -1,17 +1,197 @@
-import cdsapi
-
-c = cdsapi.Client()
-
-c.retrieve(
-    "reanalysis-era5-single-levels",
-    {
-        "product_type": "reanalysis",
-        "format": "netcdf",
-        "variable": "cloud_base_height",
-        "year": "2021",
-        "month": "08",
-        "day": ["01"],
-        "time": ["00:00"],
-    },
-    "download.nc",
-)
+"""
+Fetches ERA5 fields from the Climate Data Store for a time range.
+
+The range is planned as one request per month (the layout the CDS serves
+fastest), with the variables split across requests so none exceeds the CDS
+field limit. Requests are submitted concurrently, and each completed request is
+cached under the hash of its parameters, so a rerun only fetches what's missing.
+
+    python3 ERA5/fetch.py --start 2021-06-01 --end 2021-08-31 \
+        --variables cloud_base_height,total_precipitation --directory era5
+"""
+
+import argparse
+import calendar
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+DATASET = "reanalysis-era5-single-levels"
+# Fields (variables x days x times) the CDS accepts in one request
+MAX_FIELDS = int(os.environ.get("ERA5_MAX_FIELDS", 120_000))
+CONCURRENCY = int(os.environ.get("ERA5_CONCURRENCY", 4))
+ALL_TIMES = [f"{hour:02d}:00" for hour in range(24)]
+
+
+@dataclass(frozen=True)
+class Chunk:
+    """One CDS request: some variables for some days of a month"""
+
+    year: int
+    month: int
+    days: Tuple[int, ...]
+    times: Tuple[str, ...]
+    variables: Tuple[str, ...]
+    dataset: str = DATASET
+
+    @property
+    def fields(self) -> int:
+        return len(self.variables) * len(self.days) * len(self.times)
+
+    def request(self) -> Dict[str, Any]:
+        return {
+            "product_type": "reanalysis",
+            "format": "netcdf",
+            "variable": list(self.variables),
+            "year": f"{self.year}",
+            "month": f"{self.month:02d}",
+            "day": [f"{day:02d}" for day in self.days],
+            "time": list(self.times),
+        }
+
+    def key(self) -> str:
+        """Hash of the request, naming its cached download"""
+        request = json.dumps([self.dataset, self.request()], sort_keys=True)
+        return hashlib.sha256(request.encode("utf8")).hexdigest()[:32]
+
+
+def months(start: date, end: date) -> List[Tuple[int, int, Tuple[int, ...]]]:
+    """Splits [start, end] into (year, month, days)"""
+    spans = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        first = start.day if (year, month) == (start.year, start.month) else 1
+        last = (
+            end.day
+            if (year, month) == (end.year, end.month)
+            else calendar.monthrange(year, month)[1]
+        )
+        spans.append((year, month, tuple(range(first, last + 1))))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return spans
+
+
+def plan(
+    start: date,
+    end: date,
+    variables: List[str],
+    times: Optional[List[str]] = None,
+    max_fields: int = MAX_FIELDS,
+    dataset: str = DATASET,
+) -> List[Chunk]:
+    """
+    Plans the requests for the variables at the times of day from start to end
+    (inclusive): one per month and group of variables that fits in max_fields,
+    splitting the days of a month only when a single variable doesn't fit
+    """
+    if end < start:
+        raise ValueError(f"End date {end} is before start date {start}")
+    times = tuple(times or ALL_TIMES)
+    chunks = []
+    for year, month, days in months(start, end):
+        per_variable = len(days) * len(times)
+        if per_variable > max_fields:
+            days_per_request = max(1, max_fields // len(times))
+            day_groups = [
+                days[i : i + days_per_request]
+                for i in range(0, len(days), days_per_request)
+            ]
+            variable_groups = [(variable,) for variable in variables]
+        else:
+            day_groups = [days]
+            variables_per_request = max_fields // per_variable
+            variable_groups = [
+                tuple(variables[i : i + variables_per_request])
+                for i in range(0, len(variables), variables_per_request)
+            ]
+        chunks.extend(
+            Chunk(year, month, day_group, times, variable_group, dataset)
+            for variable_group in variable_groups
+            for day_group in day_groups
+        )
+    return chunks
+
+
+def cached_filename(chunk: Chunk, directory: str) -> str:
+    return os.path.join(directory, f"{chunk.key()}.nc")
+
+
+def fetch_chunk(client, chunk: Chunk, directory: str) -> str:
+    """
+    Retrieves the chunk unless it's cached. Downloads go to a partial file that
+    is only renamed once complete, so an interrupted request is fetched again.
+    The parameters are written alongside before the rename, so every cached
+    file has them.
+    """
+    filename = cached_filename(chunk, directory)
+    if os.path.exists(filename):
+        print(f"{filename} already fetched")
+        return filename
+    partial = f"{filename}.partial"
+    client.retrieve(chunk.dataset, chunk.request(), partial)
+    with open(f"{filename}.json", "w") as f:
+        json.dump({"dataset": chunk.dataset, "request": chunk.request()}, f)
+    os.replace(partial, filename)
+    return filename
+
+
+def fetch(
+    client, chunks: List[Chunk], directory: str, concurrency: int = CONCURRENCY
+) -> List[str]:
+    """
+    Fetches the chunks with up to `concurrency` requests queued at the CDS,
+    returning their filenames in order. Any failed chunk is raised after the
+    others have finished, so a rerun resumes from the failures.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [
+            executor.submit(fetch_chunk, client, chunk, directory) for chunk in chunks
+        ]
+    errors = [future.exception() for future in futures if future.exception()]
+    for error in errors:
+        print(f"Failed to fetch an ERA5 chunk: {error!r}")
+    if errors:
+        raise errors[0]
+    return [future.result() for future in futures]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--start", type=date.fromisoformat, required=True)
+    parser.add_argument("--end", type=date.fromisoformat, required=True)
+    parser.add_argument(
+        "--variables",
+        default="cloud_base_height",
+        help="Comma-separated CDS variable names",
+    )
+    parser.add_argument(
+        "--times",
+        default=",".join(ALL_TIMES),
+        help="Comma-separated times of day, e.g. 00:00,12:00",
+    )
+    parser.add_argument("--directory", default="era5")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--max-fields", type=int, default=MAX_FIELDS)
+    args = parser.parse_args(argv)
+
+    import cdsapi
+
+    chunks = plan(
+        args.start,
+        args.end,
+        args.variables.split(","),
+        args.times.split(","),
+        max_fields=args.max_fields,
+    )
+    print(f"Fetching {len(chunks)} requests to {args.directory}")
+    for filename in fetch(cdsapi.Client(), chunks, args.directory, args.concurrency):
+        print(filename)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Synthetic granules shaped like the collections in example.ini
+"""
+
+import os
+from typing import Callable, Dict
+
+import numpy as np
+from netCDF4 import Dataset
+
+
+def _variable(dataset: Dataset, path: str, dimensions, dtype="f4", **kwargs):
+    """Creates a variable at a slash-separated path, creating its groups"""
+    *groups, name = path.split("/")
+    group = dataset
+    for group_name in groups:
+        group = group.groups.get(group_name) or group.createGroup(group_name)
+    for dimension, size in dimensions:
+        if dimension not in dataset.dimensions:
+            dataset.createDimension(dimension, size)
+    return group.createVariable(
+        name, dtype, [dimension for dimension, _ in dimensions], zlib=True, **kwargs
+    )
+
+
+def _field(shape, rng: np.random.Generator, dtype="f4"):
+    """Smooth field with noise, so it compresses like real data"""
+    y, x = np.meshgrid(
+        np.linspace(0, 4 * np.pi, shape[0]),
+        np.linspace(0, 4 * np.pi, shape[1]),
+        indexing="ij",
+    )
+    field = np.sin(y) * np.cos(x) + rng.normal(0, 0.05, shape)
+    return field.astype(dtype)
+
+
+def gpm_imerg(filename: str, scale: float, rng: np.random.Generator):
+    lon, lat = int(3600 * scale), int(1800 * scale)
+    with Dataset(filename, "w") as dataset:
+        grid = dataset.createGroup("Grid")
+        for dimension, size in (("time", 1), ("lon", lon), ("lat", lat)):
+            grid.createDimension(dimension, size)
+        precipitation = grid.createVariable(
+            "precipitation",
+            "f4",
+            ("time", "lon", "lat"),
+            zlib=True,
+            chunksizes=(1, min(lon, 145), min(lat, 1800)),
+            fill_value=-9999.9,
+        )
+        data = np.abs(_field((lat, lon), rng)).T[np.newaxis]
+        data[:, : lon // 10, : lat // 10] = -9999.9
+        precipitation[:] = data
+
+
+def _hdfeos(path: str) -> Callable[[str, float, np.random.Generator], None]:
+    def create(filename: str, scale: float, rng: np.random.Generator):
+        height, width = int(720 * scale), int(1440 * scale)
+        with Dataset(filename, "w") as dataset:
+            variable = _variable(
+                dataset,
+                path,
+                (("YDim", height), ("XDim", width)),
+                fill_value=-1.2676506e30,
+            )
+            variable[:] = _field((height, width), rng) * 1e15
+
+    return create
+
+
+def nisar(filename: str, scale: float, rng: np.random.Generator):
+    # A NISAR-sized GCOV grid, in metres
+    size = int(16704 * scale)
+    with Dataset(filename, "w") as dataset:
+        hhhh = _variable(
+            dataset,
+            "science/LSAR/GCOV/grids/frequencyA/HHHH",
+            (("y", size), ("x", size)),
+            chunksizes=(min(size, 512), min(size, 512)),
+        )
+        for start in range(0, size, 1024):
+            stop = min(start + 1024, size)
+            hhhh[start:stop] = np.abs(_field((stop - start, size), rng))
+        x = _variable(
+            dataset, "science/LSAR/GCOV/metadata/radarGrid/xCoordinates", (("x", size),)
+        )
+        x[:] = np.linspace(200000, 200000 + size * 20, size)
+        y = _variable(
+            dataset, "science/LSAR/GCOV/metadata/radarGrid/yCoordinates", (("y", size),)
+        )
+        y[:] = np.linspace(9000000, 9000000 - size * 20, size)
+
+
+def era5(filename: str, scale: float, rng: np.random.Generator):
+    lat, lon = int(721 * scale), int(1440 * scale)
+    with Dataset(filename, "w") as dataset:
+        for dimension, size in (("time", 4), ("latitude", lat), ("longitude", lon)):
+            dataset.createDimension(dimension, size)
+        time = dataset.createVariable("time", "i4", ("time",))
+        time.units = "hours since 1900-01-01 00:00:00.0"
+        time[:] = np.arange(4) * 6 + 1051896
+        cbh = dataset.createVariable(
+            "cbh",
+            "i2",
+            ("time", "latitude", "longitude"),
+            zlib=True,
+            fill_value=-32767,
+        )
+        cbh.scale_factor = 0.5
+        cbh.add_offset = 10000.0
+        cbh.set_auto_maskandscale(False)
+        for step in range(4):
+            cbh[step] = (_field((lat, lon), rng) * 10000).astype("i2")
+
+
+FIXTURES: Dict[str, Callable[[str, float, np.random.Generator], None]] = {
+    "GPM_3IMERGM": gpm_imerg,
+    "ERA5": era5,
+    "NISAR": nisar,
+    "OMNO2d": _hdfeos(
+        "HDFEOS/GRIDS/ColumnAmountNO2/Data Fields/ColumnAmountNO2TropCloudScreened"
+    ),
+    "OMDOAO3e": _hdfeos("HDFEOS/GRIDS/ColumnAmountO3/Data Fields/ColumnAmountO3"),
+}
+
+
+def create_fixture(section: str, directory: str, scale: float = 1.0) -> str:
+    """
+    Creates (once per scale) the synthetic granule of an example.ini section,
+    returning its path
+    """
+    filename = os.path.join(directory, f"{section}_{scale:g}.nc")
+    if not os.path.exists(filename):
+        partial = f"{filename}.partial"
+        FIXTURES[section](partial, scale, np.random.default_rng(0))
+        os.rename(partial, filename)
+    return filename
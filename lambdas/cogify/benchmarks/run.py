@@ -0,0 +1,169 @@
+"""
+Benchmarks `to_cog` offline on synthetic granules, recording wall time, peak RSS
+and output size for each example.ini section and COG profile.
+
+Run from the cogify directory:
+
+    python -m benchmarks.run --scale 0.5 --output results.json
+    python -m benchmarks.run --scale 0.5 --baseline results.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from benchmarks.fixtures import FIXTURES, create_fixture
+
+DEFAULT_PROFILES = ["deflate", "zstd"]
+# Changes smaller than these are noise, whatever the relative change
+NOISE_FLOORS = {"seconds": 0.5, "peak_rss_mb": 16.0, "output_mb": 0.1}
+
+
+def _run_case(connection, section: str, filename: str, profile: str):
+    """Converts the granule in a fresh process, so that its peak RSS is its own"""
+    import handler
+
+    config = {
+        **handler.config._sections[section],
+        "filename": filename,
+        "collection": section,
+        "profile": profile,
+    }
+    try:
+        start = time.perf_counter()
+        outputs = handler.to_cog(upload=False, **config)
+        seconds = time.perf_counter() - start
+        connection.send(
+            {
+                "seconds": seconds,
+                # Kilobytes on Linux
+                "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                / 1024,
+                "output_mb": sum(os.path.getsize(o["filename"]) for o in outputs)
+                / 1024**2,
+                "outputs": len(outputs),
+            }
+        )
+    except Exception as e:
+        connection.send({"error": repr(e)})
+    finally:
+        connection.close()
+
+
+def run_case(section: str, filename: str, profile: str) -> Dict[str, Any]:
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(
+        target=_run_case, args=(sender, section, filename, profile)
+    )
+    process.start()
+    sender.close()
+    try:
+        result = receiver.recv()
+    except EOFError:
+        result = {"error": "Process exited unexpectedly"}
+    process.join()
+    return result
+
+
+def run(
+    sections: List[str], profiles: List[str], scale: float, directory: str
+) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    for section in sections:
+        filename = create_fixture(section, directory, scale)
+        for profile in profiles:
+            case = f"{section}/{profile}"
+            results[case] = run_case(section, filename, profile)
+            print(case, json.dumps(results[case]), flush=True)
+    return results
+
+
+def compare(
+    results: Dict[str, Dict[str, Any]],
+    baseline: Dict[str, Dict[str, Any]],
+    tolerance: float,
+) -> List[str]:
+    """
+    Returns the regressions: cases that failed, or got slower, used more memory or
+    wrote larger outputs than the baseline by more than the tolerance
+    """
+    regressions = []
+    print(f"{'case':<28}{'metric':<14}{'baseline':>12}{'current':>12}{'change':>10}")
+    for case, result in results.items():
+        if "error" in result:
+            regressions.append(f"{case} failed: {result['error']}")
+            continue
+        if case not in baseline:
+            continue
+        for metric, floor in NOISE_FLOORS.items():
+            before, after = baseline[case].get(metric), result[metric]
+            if not before:
+                continue
+            change = after / before - 1
+            print(
+                f"{case:<28}{metric:<14}{before:>12.2f}{after:>12.2f}{change:>+10.1%}"
+            )
+            if change > tolerance and after - before > floor:
+                regressions.append(f"{case} {metric} increased by {change:.1%}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--sections",
+        default=",".join(FIXTURES),
+        help="Comma-separated example.ini sections (default: all)",
+    )
+    parser.add_argument(
+        "--profiles",
+        default=",".join(DEFAULT_PROFILES),
+        help="Comma-separated rio-cogeo profiles",
+    )
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Scale of the synthetic grids relative to the real granules",
+    )
+    parser.add_argument(
+        "--fixtures",
+        default=os.path.join(tempfile.gettempdir(), "cogify-benchmarks"),
+        help="Directory where synthetic granules are created and reused",
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare the results to this JSON file")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative increase over the baseline reported as a regression",
+    )
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.fixtures, exist_ok=True)
+    results = run(
+        args.sections.split(","), args.profiles.split(","), args.scale, args.fixtures
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    failures = compare(results, baseline, args.tolerance)
+    for failure in failures:
+        print(failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+EARTHDATA_HOST = "urs.earthdata.nasa.gov"
+EARTHDATA_TOKEN_URL = f"https://{EARTHDATA_HOST}/api/users/find_or_create_token"
+# Downloads are split into ranges of this size, fetched concurrently
+PART_SIZE = int(os.environ.get("DOWNLOAD_PART_SIZE", 16 * 1024**2))
+WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", 8))
+PART_ATTEMPTS = 4
+# Responses of servers (e.g. presigned S3 URLs) that don't allow HEAD requests
+HEAD_UNSUPPORTED_CODES = (403, 405)
+CHUNK_SIZE = 1024**2
+
+_session = None
+_session_lock = threading.Lock()
+_token = None
+
+
+class EarthdataSession(requests.Session):
+    """
+    Session that keeps its credentials when redirected to and from Earthdata Login,
+    which requests would otherwise drop when the host changes
+    """
+
+    def rebuild_auth(self, prepared_request, response):
+        headers = prepared_request.headers
+        original = urlparse(response.request.url).hostname
+        redirect = urlparse(prepared_request.url).hostname
+        if (
+            "Authorization" in headers
+            and original != redirect
+            and EARTHDATA_HOST not in (original, redirect)
+        ):
+            del headers["Authorization"]
+
+
+def earthdata_session() -> requests.Session:
+    """
+    Returns the container's session, authenticated with EARTHDATA_TOKEN or
+    EARTHDATA_USERNAME/EARTHDATA_PASSWORD, so the login cookies and connections
+    are reused across downloads and invocations
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = EarthdataSession()
+            if token := os.environ.get("EARTHDATA_TOKEN"):
+                session.headers["Authorization"] = f"Bearer {token}"
+            else:
+                username = os.environ.get("EARTHDATA_USERNAME")
+                password = os.environ.get("EARTHDATA_PASSWORD")
+                if username and password:
+                    session.auth = (username, password)
+            retry = Retry(
+                total=5,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=("HEAD", "GET"),
+            )
+            adapter = HTTPAdapter(
+                max_retries=retry, pool_connections=WORKERS, pool_maxsize=WORKERS
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def earthdata_token() -> Optional[str]:
+    """
+    Returns EARTHDATA_TOKEN, or a token for EARTHDATA_USERNAME/EARTHDATA_PASSWORD
+    requested once per container. Data servers accept the token directly, while
+    basic auth only works through the Earthdata Login redirects.
+    """
+    global _token
+    if token := os.environ.get("EARTHDATA_TOKEN"):
+        return token
+    username = os.environ.get("EARTHDATA_USERNAME")
+    password = os.environ.get("EARTHDATA_PASSWORD")
+    if not (username and password):
+        return None
+    with _session_lock:
+        if _token is None:
+            try:
+                response = requests.post(
+                    EARTHDATA_TOKEN_URL, auth=(username, password), timeout=30
+                )
+                response.raise_for_status()
+                _token = response.json()["access_token"]
+            except (requests.RequestException, KeyError, ValueError) as e:
+                print(f"Could not get an Earthdata token: {e!r}")
+                return None
+        return _token
+
+
+def probe(session: requests.Session, url: str) -> Tuple[Optional[int], bool]:
+    """
+    Returns the size of the file and whether the server accepts range requests,
+    asking for the first byte when the server doesn't allow HEAD requests
+    """
+    response = session.head(url, allow_redirects=True)
+    if response.status_code not in HEAD_UNSUPPORTED_CODES:
+        response.raise_for_status()
+        size = response.headers.get("Content-Length")
+        ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        return (int(size) if size else None), ranges
+
+    with session.get(url, headers={"Range": "bytes=0-0"}, stream=True) as response:
+        response.raise_for_status()
+        if response.status_code == 206:
+            # Content-Range: bytes 0-0/<size>, the size may be "*" if unknown
+            size = response.headers.get("Content-Range", "").rpartition("/")[2]
+            return (int(size) if size.isdigit() else None), True
+        size = response.headers.get("Content-Length")
+        return (int(size) if size else None), False
+
+
+def stream_download(session: requests.Session, url: str, filename: str):
+    """Downloads the file with a single streamed GET"""
+    with session.get(url, stream=True) as response:
+        response.raise_for_status()
+        with open(filename, "wb") as f:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+
+
+def _download_part(
+    session: requests.Session, url: str, filename: str, start: int, end: int
+):
+    """
+    Writes bytes [start, end] of the file in place, resuming from the last byte
+    written when the connection fails
+    """
+    position = start
+    for attempt in range(PART_ATTEMPTS):
+        try:
+            with session.get(
+                url, headers={"Range": f"bytes={position}-{end}"}, stream=True
+            ) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise requests.HTTPError(
+                        f"Expected a partial response, got {response.status_code}"
+                    )
+                with open(filename, "r+b") as f:
+                    f.seek(position)
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                        position += len(chunk)
+            if position > end:
+                return
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            # Raised when the connection drops while reading the body
+            requests.exceptions.ChunkedEncodingError,
+        ) as e:
+            if attempt + 1 == PART_ATTEMPTS:
+                raise
+            print(f"Resuming bytes {position}-{end} of {url} after {e!r}")
+    raise IOError(f"Incomplete download of bytes {start}-{end} of {url}")
+
+
+def parts(size: int) -> List[Tuple[int, int]]:
+    return [
+        (start, min(start + PART_SIZE, size) - 1) for start in range(0, size, PART_SIZE)
+    ]
+
+
+def ranged_download(session: requests.Session, url: str, filename: str, size: int):
+    """
+    Downloads the file as concurrent byte ranges into a preallocated file.
+
+    Completed ranges are recorded next to the file, so a retried download
+    (in the same container) only fetches the ranges that are missing.
+    """
+    state_filename = f"{filename}.parts"
+    done = set()
+    if os.path.exists(state_filename) and os.path.exists(filename):
+        with open(state_filename) as f:
+            state = json.load(f)
+        if state == dict(state, url=url, size=size, part_size=PART_SIZE):
+            done = set(state["done"])
+    if not done:
+        with open(filename, "wb") as f:
+            f.truncate(size)
+
+    lock = threading.Lock()
+
+    def save_state():
+        with open(state_filename, "w") as f:
+            json.dump(
+                {
+                    "url": url,
+                    "size": size,
+                    "part_size": PART_SIZE,
+                    "done": sorted(done),
+                },
+                f,
+            )
+
+    def fetch(start: int, end: int):
+        _download_part(session, url, filename, start, end)
+        with lock:
+            done.add(start)
+            save_state()
+
+    save_state()
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        futures = [
+            executor.submit(fetch, start, end)
+            for start, end in parts(size)
+            if start not in done
+        ]
+        for future in futures:
+            future.result()
+    os.remove(state_filename)
+
+
+def download(url: str, filename: str):
+    """
+    Downloads a file over HTTP(S) with concurrent range requests when the server
+    supports them, and a single stream otherwise
+    """
+    session = earthdata_session()
+    size, ranges = probe(session, url)
+    if (
+        size
+        and os.path.exists(filename)
+        and not os.path.exists(f"{filename}.parts")
+        and os.path.getsize(filename) == size
+    ):
+        print(f"{filename} file already downloaded")
+        return
+    if size and ranges:
+        ranged_download(session, url, filename, size)
+    else:
+        stream_download(session, url, filename)
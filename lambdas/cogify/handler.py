@@ -1,34 +1,122 @@
 import configparser
+import multiprocessing
+import multiprocessing.connection
 import os
-import requests
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+import aiohttp
 import boto3
+import download
+import fsspec
+import metadata
+import reference
+import h5netcdf.legacyapi
 
 import numpy as np
 
 from affine import Affine
-from netCDF4 import Dataset
+import rasterio
+from netCDF4 import Dataset, num2date
 from rasterio.crs import CRS
-from rasterio.io import MemoryFile
+from rasterio.enums import Resampling
+from rasterio.transform import from_bounds
+from rasterio.vrt import WarpedVRT
 from rasterio.warp import calculate_default_transform
 from rio_cogeo.cogeo import cog_translate
 from rio_cogeo.profiles import cog_profiles
 
-
 config = configparser.ConfigParser()
 config.read("example.ini")
 s3 = boto3.client(
     "s3",
 )
 
-# Set COG inputs
-output_profile = cog_profiles.get(
-    "deflate"
-)  # if the files aren't uint8, this will need to be changed
-output_profile["blockxsize"] = 256
-output_profile["blockysize"] = 256
 output_bucket = config["DEFAULT"]["output_bucket"]
 output_dir = config["DEFAULT"]["output_dir"]
+# Approximate size of the source window held in memory while writing the COG
+WINDOW_BYTES = int(os.environ.get("WINDOW_BYTES", 64 * 1024**2))
+# Remote granules are read with range requests of this size, keeping the most
+# recently used blocks in memory
+REMOTE_BLOCK_SIZE = int(os.environ.get("REMOTE_BLOCK_SIZE", 4 * 1024**2))
+REMOTE_CACHE_BLOCKS = int(os.environ.get("REMOTE_CACHE_BLOCKS", 32))
+# GDAL warper working memory (in MB) per output
+WARP_MEMORY_LIMIT = int(os.environ.get("WARP_MEMORY_LIMIT", 256))
+# GDAL block cache (in MB) of each process, GDAL's default is 5% of the memory
+GDAL_CACHE_MB = int(os.environ.get("GDAL_CACHE_MB", 64))
+os.environ.setdefault("GDAL_CACHEMAX", str(GDAL_CACHE_MB))
+# Memory (in MB) of a process converting a granule, besides its outputs: the
+# interpreter and libraries, GDAL's block cache and the cached remote blocks
+PROCESS_MEMORY_MB = (
+    200 + GDAL_CACHE_MB + REMOTE_BLOCK_SIZE * REMOTE_CACHE_BLOCKS // 1024**2
+)
+# Memory (in MB) of an output being written: the window as it's read, converted
+# and filled, and the warper's working memory
+OUTPUT_MEMORY_MB = 3 * WINDOW_BYTES // 1024**2 + WARP_MEMORY_LIMIT
+MEMORY_MB = int(os.environ.get("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", 1024))
+CPUS = os.cpu_count() or 1
+
+
+def default_processes(memory_mb, cpus):
+    """Granules converted at the same time: one per vCPU, as many as fit in memory"""
+    return max(1, min(cpus, memory_mb // (PROCESS_MEMORY_MB + OUTPUT_MEMORY_MB)))
+
+
+def default_workers(memory_mb, cpus, processes):
+    """Outputs each process writes at the same time, sharing its memory and vCPUs"""
+    free_mb = memory_mb // processes - PROCESS_MEMORY_MB
+    return max(1, min(cpus // processes, free_mb // OUTPUT_MEMORY_MB))
+
+
+# Granules of a batch converted at the same time
+COGIFY_PROCESSES = int(
+    os.environ.get("COGIFY_PROCESSES", default_processes(MEMORY_MB, CPUS))
+)
+# Outputs of a granule written at the same time
+COG_WORKERS = int(
+    os.environ.get("COG_WORKERS", default_workers(MEMORY_MB, CPUS, COGIFY_PROCESSES))
+)
+# GDAL threads per output, splitting the vCPUs between all the outputs in progress
+GDAL_THREADS = os.environ.get(
+    "GDAL_THREADS", str(max(1, CPUS // (COGIFY_PROCESSES * COG_WORKERS)))
+)
+WARP_THREADS = os.environ.get("WARP_THREADS", GDAL_THREADS)
+WEB_MERCATOR = CRS.from_epsg(3857)
+# Web Mercator is undefined at the poles
+MAX_MERCATOR_LATITUDE = 85.0511287798066
+# References are written here when not uploading
+LOCAL_REFERENCE_DIR = "/tmp"
+
+
+def output_dtype(variable, **config):
+    """
+    Returns the dtype of the COG: the configured `dtype`, float32 for packed
+    (scaled) variables since they are unpacked on read, and the source dtype otherwise
+    """
+    if dtype := config.get("dtype"):
+        return np.dtype(dtype)
+    if hasattr(variable, "scale_factor") or hasattr(variable, "add_offset"):
+        return np.dtype(np.float32)
+    # Doubles are rarely needed for display and analysis, and double the size
+    if variable.dtype == np.float64:
+        return np.dtype(np.float32)
+    return np.dtype(variable.dtype)
+
+
+def cog_profile(band_dtype, **config):
+    """
+    Builds the COG creation profile from the collection's `profile`, `blocksize`
+    and the output dtype, which decides the predictor
+    """
+    profile = cog_profiles.get(config.get("profile", "deflate"))
+    blocksize = int(config.get("blocksize", 256))
+    profile.update(blockxsize=blocksize, blockysize=blocksize)
+    if profile.get("compress", "").upper() in ("DEFLATE", "LZW", "ZSTD"):
+        # Horizontal differencing for integers, floating point predictor otherwise
+        profile["predictor"] = 3 if np.issubdtype(band_dtype, np.floating) else 2
+    return profile
 
 
 def upload_file(outfilename, collection):
@@ -46,21 +134,15 @@ def upload_file(outfilename, collection):
         raise
 
 
-def download_file(file_uri: str):
+def local_path(file_uri: str):
     filename = os.path.splitext(os.path.basename(file_uri))[0]
-    filename = f"/tmp/{filename}"
+    return f"/tmp/{filename}"
+
+
+def download_file(file_uri: str):
+    filename = local_path(file_uri)
     if "http" in file_uri:
-        # This isn't working for GPMIMERG, need to use .netrc
-        username = os.environ.get("EARTHDATA_USERNAME")
-        password = os.environ.get("EARTHDATA_PASSWORD")
-        with requests.Session() as session:
-            session.auth = (username, password)
-            request = session.request("get", file_uri)
-            response = session.get(request.url, auth=(username, password))
-            print("RESPONSE IS")
-            print(response.status_code)
-            with open(filename, "wb") as f:
-                f.write(response.content)
+        download.download(file_uri, filename)
     elif "s3://" in file_uri:
         path_parts = file_uri.split("://")[1].split("/")
         bucket = path_parts[0]
@@ -71,34 +153,238 @@ def download_file(file_uri: str):
     return filename
 
 
-def to_cog(upload, **config):
-    """HDF5 to COG."""
-    # Open existing dataset
+def is_remote(file_uri: str):
+    return file_uri.startswith(("s3://", "http://", "https://"))
+
+
+def storage_options(file_uri: str):
+    """
+    Returns the fsspec options needed to authenticate against the source. aiohttp
+    drops credentials on the redirects through Earthdata Login, so HTTPS sources
+    are read with a bearer token.
+    """
+    if file_uri.startswith("http"):
+        if token := download.earthdata_token():
+            return {"headers": {"Authorization": f"Bearer {token}"}}
+    return {}
+
+
+def open_remote(file_uri: str):
+    """
+    Opens an HDF5-based granule (NetCDF4, HDF-EOS5) through a range-request file
+    object, so only the blocks holding the variables that are read get transferred
+    """
+    fileobj = fsspec.open(
+        file_uri,
+        "rb",
+        block_size=REMOTE_BLOCK_SIZE,
+        cache_type="blockcache",
+        cache_options={"maxblocks": REMOTE_CACHE_BLOCKS},
+        **storage_options(file_uri),
+    ).open()
+    return h5netcdf.legacyapi.Dataset(fileobj, "r", phony_dims="access")
+
+
+def open_dataset(file_uri: str, remote_read: bool = True):
+    """
+    Opens the granule remotely when possible, falling back to downloading it
+    (e.g. for NetCDF3 files, which aren't HDF5)
+    """
+    if not is_remote(file_uri):
+        return Dataset(file_uri, "r")
+    if remote_read:
+        try:
+            return open_remote(file_uri)
+        except (OSError, ValueError, aiohttp.ClientError) as e:
+            print(f"Could not open {file_uri} remotely ({e!r}), downloading it")
+    return Dataset(download_file(file_uri), "r")
+
+
+def declared_nodata(variable):
+    """
+    Returns the fill value the variable declares with `_FillValue` or
+    `missing_value`, or None when it declares neither
+    """
+    for attribute in ("_FillValue", "missing_value"):
+        value = getattr(variable, attribute, None)
+        if value is not None:
+            # missing_value may list several values
+            return np.ravel(value)[0].item()
+    return None
+
+
+def decode(block, variable):
+    """
+    Masks fill values and unpacks scaled values, which netCDF4 does on read
+    but h5netcdf doesn't
+    """
+    if np.ma.isMaskedArray(block):
+        return block
+    fill_value = declared_nodata(variable)
+    if fill_value is not None:
+        block = np.ma.masked_equal(block, fill_value)
+    scale_factor = getattr(variable, "scale_factor", None)
+    add_offset = getattr(variable, "add_offset", None)
+    if scale_factor is not None:
+        block = block * scale_factor
+    if add_offset is not None:
+        block = block + add_offset
+    return block
+
+
+def time_axis(variable, collection, time_dimension=None):
+    """
+    Returns the axis of the variable holding the time steps, if any. Variables
+    without the time dimension are a single time step.
+    """
+    if time_dimension:
+        dimensions = list(variable.dimensions)
+        return (
+            dimensions.index(time_dimension) if time_dimension in dimensions else None
+        )
+    # IMERG only has the one (monthly) time step
+    if collection == "GPM_3IMERGM":
+        return 0
+    return None
+
+
+def spatial_axes(variable, axis=None):
+    return [a for a in range(len(variable.shape)) if a != axis][:2]
+
+
+def source_shape(variable, collection, axis=None):
+    """Returns the (height, width) of the raster held by the source variable"""
+    row_axis, col_axis = spatial_axes(variable, axis)
+    # This may be just what we need for IMERG
+    if collection == "GPM_3IMERGM":
+        return variable.shape[col_axis], variable.shape[row_axis]
+    return variable.shape[row_axis], variable.shape[col_axis]
+
+
+def read_rows(variable, collection, start, stop, axis=None, time_index=0):
+    """Reads rows [start, stop) of the raster at a time step, only loading that window"""
+    key = [slice(None)] * len(variable.shape)
+    if axis is not None:
+        key[axis] = time_index
+    row_axis, col_axis = spatial_axes(variable, axis)
+    if collection == "GPM_3IMERGM":
+        key[col_axis] = slice(start, stop)
+        return np.transpose(decode(variable[tuple(key)], variable))
+    if collection == "OMDOAO3e":
+        height = variable.shape[row_axis]
+        key[row_axis] = slice(height - stop, height - start)
+        return np.flipud(decode(variable[tuple(key)], variable))
+    key[row_axis] = slice(start, stop)
+    return decode(variable[tuple(key)], variable)
+
+
+def split_list(value):
+    """Splits a config value listing several names, by commas or lines"""
+    return [name.strip() for name in re.split(r"[,\n]", value) if name.strip()]
+
+
+def output_suffix(variable_name):
+    """
+    File name suffix of a variable, from its full path so that variables of
+    the same name in different groups don't overwrite each other
+    """
+    return "_" + re.sub(r"[/\s]+", "_", variable_name.strip("/"))
+
+
+def variable_names(config):
+    """`variable_name` can list several variables"""
+    return split_list(config["variable_name"])
+
+
+def time_dates(src, group, time_dimension):
+    """Returns the dates of the time coordinate, which needs units"""
+    path = f"{group}/{time_dimension}" if group else time_dimension
+    times = src[path]
+    return num2date(times[:], times.units, getattr(times, "calendar", "standard"))
+
+
+def time_labels(src, group, time_dimension, count):
+    """
+    Labels the time steps with their dates when the time coordinate has units,
+    and with their index otherwise
+    """
+    try:
+        dates = time_dates(src, group, time_dimension)
+        return [date.strftime("%Y%m%dT%H%M%S") for date in dates]
+    except (AttributeError, IndexError, KeyError, ValueError):
+        return [str(index) for index in range(count)]
+
+
+def time_range(refs, **config):
+    """
+    Returns the start and end datetimes of the granule's time coordinate, read
+    through its reference, which date the combined references, or an empty dict
+    when they are unknown
+    """
     filename = str(config["filename"])
-    variable_name = config["variable_name"]
+    group, time_dimension = config.get("group"), config["time_dimension"]
+    path = f"{group}/{time_dimension}" if group else time_dimension
+    try:
+        values, attributes = reference.read_array(refs, path, storage_options(filename))
+        dates = sorted(
+            num2date(
+                values, attributes["units"], attributes.get("calendar", "standard")
+            )
+        )
+        return {
+            "start_datetime": dates[0].strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "end_datetime": dates[-1].strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+    except (AttributeError, IndexError, KeyError, OSError, ValueError) as e:
+        print(f"No time range for {filename}: {e!r}")
+        return {}
+
+
+def warp_target(src_crs, dst_crs, width, height, left, bottom, right, top):
+    """
+    Returns the transform, width and height of the reprojected raster, leaving out
+    latitudes beyond the bounds of Web Mercator
+    """
+    if src_crs.is_geographic and dst_crs == WEB_MERCATOR:
+        clipped_bottom = max(bottom, -MAX_MERCATOR_LATITUDE)
+        clipped_top = min(top, MAX_MERCATOR_LATITUDE)
+        height = max(1, round(height * (clipped_top - clipped_bottom) / (top - bottom)))
+        bottom, top = clipped_bottom, clipped_top
+    return calculate_default_transform(
+        src_crs, dst_crs, width, height, left=left, bottom=bottom, right=right, top=top
+    )
+
+
+def window_rows(width, dtype, block_size=256):
+    """Number of rows per window, a multiple of the block size within WINDOW_BYTES"""
+    rows = WINDOW_BYTES // (width * np.dtype(dtype).itemsize)
+    return max(block_size, rows - rows % block_size)
+
+
+def write_cog(
+    src, read_lock, variable_name, axis, time_index, outfilename, upload, **config
+):
+    """Writes one variable at one time step of the open granule to a COG"""
     x_variable, y_variable = config.get("x_variable"), config.get("y_variable")
     group = config.get("group")
-    src = Dataset(filename, "r")
 
-    if group is None:
-        variable = src[variable_name][:]
-        nodata_value = variable.fill_value
-    else:
-        variable = src.groups[group][variable_name]
-        nodata_value = variable._FillValue
-    # This may be just what we need for IMERG
-    if config["collection"] == "GPM_3IMERGM":
-        variable = np.transpose(variable[0])
-    if config["collection"] == "OMDOAO3e":
-        variable = np.flipud(variable)
+    # Variables are read lazily, window by window
+    with read_lock:
+        if group is None:
+            variable = src[variable_name]
+        else:
+            variable = src.groups[group][variable_name]
+        # Sources that don't declare a fill value are written without nodata
+        nodata_value = declared_nodata(variable)
 
     # This implies a global spatial extent, which is not always the case
-    src_height, src_width = variable.shape[0], variable.shape[1]
+    src_height, src_width = source_shape(variable, config["collection"], axis)
     if x_variable and y_variable:
-        xmin = src[x_variable][:].min()
-        xmax = src[x_variable][:].max()
-        ymin = src[y_variable][:].min()
-        ymax = src[y_variable][:].max()
+        with read_lock:
+            xmin = src[x_variable][:].min()
+            xmax = src[x_variable][:].max()
+            ymin = src[y_variable][:].min()
+            ymax = src[y_variable][:].max()
     else:
         xmin, ymin, xmax, ymax = [-180, -90, 180, 90]
 
@@ -108,57 +394,98 @@ def to_cog(upload, **config):
     else:
         src_crs = CRS.from_epsg(4326)
 
-    dst_crs = CRS.from_epsg(3857)
-
-    # calculate dst transform
-    dst_transform, dst_width, dst_height = calculate_default_transform(
-        src_crs,
-        dst_crs,
-        src_width,
-        src_height,
-        left=xmin,
-        bottom=ymin,
-        right=xmax,
-        top=ymax,
-    )
-
+    src_transform = from_bounds(xmin, ymin, xmax, ymax, src_width, src_height)
     # https://github.com/NASA-IMPACT/cloud-optimized-data-pipelines/blob/rwegener2-envi-to-cog/docker/omno2-to-cog/OMNO2d.003/handler.py
     affine_transformation = config.get("affine_transformation")
     if affine_transformation:
         xres = (xmax - xmin) / float(src_width)
         yres = (ymax - ymin) / float(src_height)
         geotransform = eval(affine_transformation)
-        dst_transform = Affine.from_gdal(*geotransform)
+        src_transform = Affine.from_gdal(*geotransform)
 
     # Save output as COG
+    dtype = output_dtype(variable, **config)
+    profile = cog_profile(dtype, **config)
     output_profile = dict(
         driver="GTiff",
-        dtype=variable.dtype,
+        dtype=dtype,
         count=1,
-        transform=dst_transform,
+        transform=src_transform,
         crs=src_crs,
         height=src_height,
         width=src_width,
         nodata=nodata_value,
         tiled=True,
         compress="deflate",
-        blockxsize=256,
-        blockysize=256,
+        blockxsize=profile["blockxsize"],
+        blockysize=profile["blockysize"],
     )
     print("profile h/w: ", output_profile["height"], output_profile["width"])
-    outfilename = f"{filename}.tif"
-    with MemoryFile() as memfile:
-        with memfile.open(**output_profile) as mem:
-            data = variable.astype(np.float32)
-            mem.write(data, indexes=1)
-        cog_translate(
-            memfile,
-            outfilename,
-            output_profile,
-            config=dict(GDAL_NUM_THREADS="ALL_CPUS", GDAL_TIFF_OVR_BLOCKSIZE="128"),
-        )
+    # Stream the variable into a tiled GeoTIFF on disk so that peak memory is
+    # bounded by the window size rather than the raster size
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpfilename = os.path.join(tmpdir, "source.tif")
+        rows = window_rows(src_width, dtype, profile["blockysize"])
+        with rasterio.open(
+            tmpfilename, "w", BIGTIFF="IF_SAFER", **output_profile
+        ) as tmp:
+            for start in range(0, src_height, rows):
+                stop = min(start + rows, src_height)
+                # The netCDF and HDF5 libraries aren't thread safe
+                with read_lock:
+                    block = read_rows(
+                        variable, config["collection"], start, stop, axis, time_index
+                    )
+                block = np.ma.asarray(block).astype(dtype)
+                if nodata_value is None:
+                    # Every value is data, including netCDF4's default fill values
+                    block = np.ma.getdata(block)
+                tmp.write(
+                    np.ma.filled(block, nodata_value),
+                    indexes=1,
+                    window=((start, stop), (0, src_width)),
+                )
+        dst_crs = CRS.from_user_input(config.get("dst_crs", "EPSG:3857"))
+        with rasterio.open(tmpfilename) as source:
+            if source.crs != dst_crs:
+                # GDAL warps the blocks read by cog_translate, one window at a time
+                left, bottom, right, top = source.bounds
+                dst_transform, dst_width, dst_height = warp_target(
+                    source.crs, dst_crs, *source.shape[::-1], left, bottom, right, top
+                )
+                source = WarpedVRT(
+                    source,
+                    crs=dst_crs,
+                    transform=dst_transform,
+                    width=dst_width,
+                    height=dst_height,
+                    resampling=Resampling[config.get("resampling", "nearest")],
+                    warp_mem_limit=WARP_MEMORY_LIMIT,
+                    warp_extras={"NUM_THREADS": WARP_THREADS},
+                )
+            with source:
+                cog_translate(
+                    source,
+                    outfilename,
+                    profile,
+                    in_memory=False,
+                    overview_resampling=config.get("overview_resampling", "nearest"),
+                    config=dict(
+                        GDAL_NUM_THREADS=GDAL_THREADS,
+                        GDAL_TIFF_OVR_BLOCKSIZE=config.get("overview_blocksize", "128"),
+                        CPL_TMPDIR=tmpdir,
+                    ),
+                )
+        # Lets build-stac describe the COG without reading it. The statistics
+        # are those of the reprojected pixels, read back window by window.
+        with rasterio.open(outfilename) as cog:
+            statistics = metadata.band_statistics(
+                cog, window_rows(cog.width, dtype, profile["blockysize"])
+            )
+            raster_metadata = metadata.raster_metadata(cog, statistics)
     return_obj = {
         "filename": outfilename,
+        "raster_metadata": raster_metadata,
     }
     if upload:
         s3location = upload_file(outfilename, config["collection"])
@@ -167,20 +494,238 @@ def to_cog(upload, **config):
     return return_obj
 
 
-def handler(event, context):
+def to_cog(upload, **config):
+    """
+    HDF5 to COG.
+
+    Opens the granule once and writes a COG for each of its configured variables
+    and, when `time_dimension` is set, each of their time steps.
+    """
+    filename = str(config["filename"])
+    group = config.get("group")
+    src = open_dataset(
+        filename, config.get("remote_read", "true").lower() in ("true", "1", "yes")
+    )
+    basename = local_path(filename) if is_remote(filename) else filename
+
+    names = variable_names(config)
+    outputs = []
+    for variable_name in names:
+        variable = (
+            src[variable_name] if group is None else src.groups[group][variable_name]
+        )
+        axis = time_axis(variable, config["collection"], config.get("time_dimension"))
+        suffix = output_suffix(variable_name) if len(names) > 1 else ""
+        if config.get("time_dimension") and axis is not None:
+            count = variable.shape[axis]
+            labels = time_labels(src, group, config["time_dimension"], count)
+            for time_index in range(count):
+                outfilename = f"{basename}{suffix}"
+                if count > 1:
+                    outfilename += f"_{labels[time_index]}"
+                outputs.append((variable_name, axis, time_index, f"{outfilename}.tif"))
+        else:
+            outputs.append((variable_name, axis, 0, f"{basename}{suffix}.tif"))
+
+    read_lock = threading.Lock()
+    output_config = {k: v for k, v in config.items() if k != "variable_name"}
+    try:
+        with ThreadPoolExecutor(max_workers=COG_WORKERS) as executor:
+            futures = [
+                executor.submit(
+                    write_cog, src, read_lock, *output, upload=upload, **output_config
+                )
+                for output in outputs
+            ]
+            return [future.result() for future in futures]
+    finally:
+        src.close()
+
+
+def reference_location(upload, collection, name):
+    """Where a reference is written: the output bucket, or /tmp when not uploading"""
+    if upload:
+        return f"s3://{output_bucket}/{collection}/references/{name}.json"
+    return os.path.join(LOCAL_REFERENCE_DIR, f"{name}.json")
+
+
+def to_reference(upload, **config):
+    """
+    NetCDF4 / HDF5 to a kerchunk reference, which points to the chunks of the
+    granule so that it can be read as Zarr without copying the data
+    """
+    filename = str(config["filename"])
+    refs = reference.granule_reference(filename, storage_options(filename))
+    name = os.path.basename(local_path(filename))
+    reference_url = reference.write_reference(
+        reference_location(upload, config["collection"], name), refs
+    )
+    print(f"Reference written to: {reference_url}")
+    # The data stays where it is, published through the reference
+    file_object = {
+        "remote_fileurl": filename,
+        "reference_url": reference_url,
+        "mode": "reference",
+    }
+    if config.get("concat_dims") and config.get("time_dimension"):
+        file_object.update(time_range(refs, **config))
+    return file_object
+
+
+def combine_references(results, upload):
+    """
+    Combines the references of a batch's granules into one per collection, for
+    collections with `concat_dims`, e.g. into a time series. The combined
+    references are file objects published like the granules' references,
+    spanning the time range of the granules.
+
+    Only the granules of the batch are combined, so a collection ingested in
+    several batches has a combined reference for each of them.
+    """
+    combined = []
+    by_collection = {}
+    for result in results:
+        for file_object in result.get("objects", []):
+            if "reference_url" in file_object:
+                by_collection.setdefault(file_object["collection"], []).append(
+                    file_object
+                )
+    for collection, file_objects in by_collection.items():
+        collection_config = config._sections[collection]
+        if not collection_config.get("concat_dims") or len(file_objects) < 2:
+            continue
+        if not all("start_datetime" in o for o in file_objects):
+            print(f"Not combining the references of {collection}, undated granules")
+            continue
+        refs = reference.combine_references(
+            [reference.read_reference(o["reference_url"]) for o in file_objects],
+            concat_dims=variable_names(
+                {"variable_name": collection_config["concat_dims"]}
+            ),
+            identical_dims=variable_names(
+                {"variable_name": collection_config.get("identical_dims", "")}
+            ),
+        )
+        granules = [o["remote_fileurl"] for o in file_objects]
+        name = reference.combined_name(granules)
+        reference_url = reference.write_reference(
+            reference_location(upload, collection, name), refs
+        )
+        combined.append(
+            {
+                "collection": collection,
+                "remote_fileurl": reference_url,
+                "reference_url": reference_url,
+                "mode": "reference",
+                "start_datetime": min(o["start_datetime"] for o in file_objects),
+                "end_datetime": max(o["end_datetime"] for o in file_objects),
+                "granules": granules,
+            }
+        )
+    return combined
+
+
+def cogify_granule(event):
     filename = event["href"]
     collection = event["collection"]
-    to_cog_config = config._sections[collection]
-    downloaded_filename = download_file(file_uri=filename)
-    to_cog_config["filename"] = downloaded_filename
+    to_cog_config = dict(config._sections[collection])
+    # Remote granules are opened (or downloaded) by to_cog
+    to_cog_config["filename"] = filename
     to_cog_config["collection"] = collection
 
-    return_obj = {"granule_id": event["granule_id"], "collection": event["collection"]}
+    file_object = {"granule_id": event["granule_id"], "collection": collection}
 
-    output_locations = to_cog(upload=event.get("upload", False), **to_cog_config)
+    if to_cog_config.get("output") == "reference":
+        output_locations = [
+            to_reference(upload=event.get("upload", False), **to_cog_config)
+        ]
+    else:
+        # One file object per COG, each sent to the stac-ready queue
+        output_locations = to_cog(upload=event.get("upload", False), **to_cog_config)
+
+    return {
+        **file_object,
+        "objects": [{**file_object, **output} for output in output_locations],
+    }
 
-    return_obj = {**return_obj, **output_locations}
 
+def granule_info(event):
+    return {
+        "granule_id": event.get("granule_id"),
+        "collection": event.get("collection"),
+    }
+
+
+def _cogify_in_process(connection, event):
+    try:
+        connection.send(cogify_granule(event))
+    except Exception as e:
+        print(f"Failed to cogify {event.get('granule_id')}: {e!r}")
+        connection.send({**granule_info(event), "error": repr(e)})
+    finally:
+        connection.close()
+
+
+def cogify_batch(events, processes=COGIFY_PROCESSES):
+    """
+    Cogifies each granule in its own process, `processes` at a time, and returns
+    their results in order. Lambda has no /dev/shm, which the queues of
+    ProcessPoolExecutor need, so results come back through pipes.
+    """
+    results = [None] * len(events)
+    running = {}
+    pending = list(enumerate(events))
+    while pending or running:
+        while pending and len(running) < processes:
+            index, event = pending.pop(0)
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(
+                target=_cogify_in_process, args=(sender, event)
+            )
+            process.start()
+            sender.close()
+            running[receiver] = (index, process)
+        for receiver in multiprocessing.connection.wait(list(running)):
+            index, process = running.pop(receiver)
+            try:
+                results[index] = receiver.recv()
+            except EOFError:
+                # The process died without reporting, e.g. when running out of memory
+                results[index] = {
+                    **granule_info(events[index]),
+                    "error": "Process exited unexpectedly",
+                }
+            process.join()
+            if process.exitcode and "error" not in results[index]:
+                results[index]["error"] = f"Process exited with {process.exitcode}"
+    return results
+
+
+def handler(event, context):
+    """
+    Cogifies a granule, or a batch (list) of granules in parallel processes.
+    For a batch, the file objects of all the granules are returned together
+    with the granules that failed.
+    """
+    if not isinstance(event, list):
+        return_obj = cogify_granule(event)
+        print(f"Returning data: {return_obj}")
+        return return_obj
+
+    results = cogify_batch(event)
+    return_obj = {
+        "objects": [
+            file_object
+            for result in results
+            if "error" not in result
+            for file_object in result["objects"]
+        ],
+        "failed": [result for result in results if "error" in result],
+    }
+    # Combined references are sent to the stac-ready queue with the granules
+    return_obj["objects"].extend(
+        combine_references(results, any(e.get("upload", False) for e in event))
+    )
     print(f"Returning data: {return_obj}")
     return return_obj
 
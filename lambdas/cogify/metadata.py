@@ -0,0 +1,136 @@
+from typing import Any, Dict, List
+
+import numpy as np
+from rasterio.features import bounds as feature_bounds
+from rasterio.windows import Window
+from rasterio.warp import transform_geom
+
+# Values kept to build the histogram, sampled evenly across the raster
+HISTOGRAM_SAMPLE_SIZE = 1_000_000
+HISTOGRAM_BINS = 10
+# Values converted to float64 at a time when summing their squares
+SUM_CHUNK_SIZE = 1024**2
+
+
+def bbox_to_geom(bbox) -> Dict[str, Any]:
+    left, bottom, right, top = bbox
+    return {
+        "type": "Polygon",
+        "coordinates": [
+            [[left, bottom], [right, bottom], [right, top], [left, top], [left, bottom]]
+        ],
+    }
+
+
+class BandStatistics:
+    """
+    Accumulates the statistics and histogram of a band window by window, so
+    that the whole band is never held in memory.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.count = 0
+        self.valid = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.step = max(1, size // HISTOGRAM_SAMPLE_SIZE)
+        self.samples: List[np.ndarray] = []
+
+    def update(self, block: np.ma.MaskedArray):
+        self.count += block.size
+        data = np.ma.getdata(block)
+        valid = ~np.ma.getmaskarray(block)
+        if np.issubdtype(data.dtype, np.floating):
+            valid &= np.isfinite(data)
+        # The only copy of the window, of its valid values
+        values = data[valid]
+        if not values.size:
+            return
+        self.valid += values.size
+        self.total += values.sum(dtype=np.float64).item()
+        for start in range(0, values.size, SUM_CHUNK_SIZE):
+            chunk = values[start : start + SUM_CHUNK_SIZE].astype(np.float64)
+            self.total_squares += np.dot(chunk, chunk).item()
+        minimum, maximum = values.min().item(), values.max().item()
+        self.minimum = minimum if self.minimum is None else min(self.minimum, minimum)
+        self.maximum = maximum if self.maximum is None else max(self.maximum, maximum)
+        # A copy, so that the sample doesn't keep the window alive
+        self.samples.append(values[:: self.step].copy())
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the statistics and histogram as raster extension band fields"""
+        if not self.valid:
+            return {"statistics": {"valid_percent": 0.0}}
+        mean = self.total / self.valid
+        variance = max(0.0, self.total_squares / self.valid - mean**2)
+        buckets, edges = np.histogram(np.concatenate(self.samples), HISTOGRAM_BINS)
+        return {
+            "statistics": {
+                "mean": mean,
+                "minimum": self.minimum,
+                "maximum": self.maximum,
+                "stddev": variance**0.5,
+                "valid_percent": self.valid / float(self.count) * 100,
+            },
+            "histogram": {
+                "count": len(edges),
+                "min": float(edges.min()),
+                "max": float(edges.max()),
+                "buckets": buckets.tolist(),
+            },
+        }
+
+
+def band_statistics(dataset, rows: int) -> BandStatistics:
+    """Gathers the statistics of the dataset's first band, `rows` rows at a time"""
+    statistics = BandStatistics(dataset.width * dataset.height)
+    for start in range(0, dataset.height, rows):
+        window = Window(0, start, dataset.width, min(rows, dataset.height - start))
+        statistics.update(dataset.read(1, window=window, masked=True))
+    return statistics
+
+
+def nodata_value(nodata):
+    """JSON-compatible nodata, following the raster extension"""
+    if nodata is None:
+        return None
+    if np.isnan(nodata):
+        return "nan"
+    if np.isposinf(nodata):
+        return "inf"
+    if np.isneginf(nodata):
+        return "-inf"
+    return float(nodata)
+
+
+def raster_metadata(dataset, statistics: BandStatistics) -> Dict[str, Any]:
+    """
+    Describes the COG written from the dataset in the shape build-stac publishes
+    it: the footprint in EPSG:4326, the projection extension properties and the
+    raster extension bands
+    """
+    footprint = transform_geom(dataset.crs, "epsg:4326", bbox_to_geom(dataset.bounds))
+    band = {
+        "data_type": dataset.dtypes[0],
+        "scale": 1.0,
+        "offset": 0.0,
+        "sampling": "area",
+        **statistics.to_dict(),
+    }
+    if (nodata := nodata_value(dataset.nodata)) is not None:
+        band["nodata"] = nodata
+    return {
+        "bbox": list(feature_bounds(footprint)),
+        "geometry": footprint,
+        "proj": {
+            "epsg": dataset.crs.to_epsg() or None,
+            "geometry": bbox_to_geom(dataset.bounds),
+            "bbox": list(dataset.bounds),
+            "shape": [dataset.height, dataset.width],
+            "transform": list(dataset.transform),
+        },
+        "raster:bands": [band],
+    }
@@ -0,0 +1,73 @@
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+import fsspec
+import numpy as np
+import zarr
+from kerchunk.combine import MultiZarrToZarr
+from kerchunk.hdf import SingleHdf5ToZarr
+
+# Chunks smaller than this are stored in the reference itself
+INLINE_THRESHOLD = 300
+
+
+def granule_reference(
+    file_uri: str, storage_options: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Scans the chunk layout of an HDF5-based granule (NetCDF4, HDF-EOS5) and returns
+    kerchunk references to the byte ranges of its chunks, which stay in place
+    """
+    with fsspec.open(file_uri, "rb", **(storage_options or {})) as f:
+        return SingleHdf5ToZarr(
+            f, file_uri, inline_threshold=INLINE_THRESHOLD
+        ).translate()
+
+
+def combine_references(
+    references: List[Dict[str, Any]],
+    concat_dims: List[str],
+    identical_dims: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Combines the references of several granules into one reference, e.g. a time
+    series along `concat_dims`, that opens as a single lazy dataset
+    """
+    return MultiZarrToZarr(
+        references, concat_dims=concat_dims, identical_dims=identical_dims or []
+    ).translate()
+
+
+def read_array(
+    reference: Dict[str, Any],
+    path: str,
+    storage_options: Optional[Dict[str, Any]] = None,
+) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """
+    Reads an array of the referenced granule, e.g. a coordinate, and its
+    attributes, only fetching the chunks of that array
+    """
+    fs = fsspec.filesystem(
+        "reference", fo=reference, remote_options=storage_options or {}
+    )
+    array = zarr.open_group(fs.get_mapper(""), mode="r")[path]
+    return array[:], dict(array.attrs)
+
+
+def combined_name(file_uris: List[str]) -> str:
+    """Names a combined reference after the granules it covers"""
+    digest = hashlib.sha256("\n".join(sorted(file_uris)).encode("utf8"))
+    return f"combined-{digest.hexdigest()[:16]}"
+
+
+def write_reference(url: str, reference: Dict[str, Any]) -> str:
+    """Writes the reference JSON to a local path or S3 URL"""
+    with fsspec.open(url, "w") as f:
+        json.dump(reference, f)
+    return url
+
+
+def read_reference(url: str) -> Dict[str, Any]:
+    with fsspec.open(url, "r") as f:
+        return json.load(f)
@@ -0,0 +1,115 @@
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+import rasterio
+from netCDF4 import Dataset
+
+import handler
+
+WEB_MERCATOR_EXTENT = 20037508.342789244
+
+
+def write_granule(path, data, dimensions, dtype=None, **attributes):
+    """Writes a granule holding `data` as the variable "data" """
+    filename = str(path / "granule.nc")
+    with Dataset(filename, "w") as dataset:
+        for name, size in zip(dimensions, data.shape):
+            dataset.createDimension(name, size)
+        variable = dataset.createVariable(
+            "data",
+            dtype or data.dtype,
+            dimensions,
+            fill_value=attributes.pop("_FillValue", False),
+        )
+        variable.setncatts(attributes)
+        variable.set_auto_maskandscale(False)
+        variable[:] = data
+    return filename
+
+
+def cogify(filename, **config):
+    (output,) = handler.to_cog(False, filename=filename, variable_name="data", **config)
+    return output["filename"]
+
+
+@pytest.mark.parametrize(
+    "collection, dimensions, expected",
+    [
+        ("test", ("lat", "lon"), lambda data: data),
+        # Stored south up
+        ("OMDOAO3e", ("lat", "lon"), np.flipud),
+        # Stored (time, lon, lat)
+        ("GPM_3IMERGM", ("time", "lon", "lat"), lambda data: data[0].T),
+    ],
+)
+def test_windowed_output_matches_whole_array(
+    tmp_path, collection, dimensions, expected
+):
+    """
+    Ensure that the COG written window by window holds the same pixels as the
+    whole variable read at once, in the collection's orientation.
+    """
+    shape = (1, 72, 40) if len(dimensions) == 3 else (40, 72)
+    data = np.random.default_rng(0).random(shape, dtype=np.float32)
+    filename = write_granule(tmp_path, data, dimensions)
+
+    # Windows of 16 rows
+    with patch("handler.WINDOW_BYTES", 16 * 72 * 4):
+        outfilename = cogify(
+            filename, collection=collection, blocksize=16, dst_crs="EPSG:4326"
+        )
+
+    with rasterio.open(outfilename) as cog:
+        assert cog.shape == (40, 72)
+        np.testing.assert_array_equal(cog.read(1), expected(data))
+
+
+@pytest.mark.parametrize(
+    "source_dtype, attributes, config, dtype, predictor",
+    [
+        ("i2", {}, {}, "int16", "2"),
+        ("u1", {}, {"profile": "zstd"}, "uint8", "2"),
+        ("f8", {}, {}, "float32", "3"),
+        # Packed values are unpacked
+        ("i2", {"scale_factor": 0.5}, {}, "float32", "3"),
+        ("f4", {}, {"dtype": "uint8"}, "uint8", "2"),
+    ],
+)
+def test_dtype_and_profile(
+    tmp_path, source_dtype, attributes, config, dtype, predictor
+):
+    data = np.arange(18 * 36).reshape(18, 36) % 100
+    filename = write_granule(
+        tmp_path, data.astype(source_dtype), ("lat", "lon"), **attributes
+    )
+
+    outfilename = cogify(
+        filename, collection="test", dst_crs="EPSG:4326", blocksize=32, **config
+    )
+
+    with rasterio.open(outfilename) as cog:
+        structure = cog.tags(ns="IMAGE_STRUCTURE")
+        assert cog.dtypes == (dtype,)
+        assert structure["PREDICTOR"] == predictor
+        assert structure["COMPRESSION"] == config.get("profile", "deflate").upper()
+        assert cog.block_shapes == [(32, 32)]
+        assert cog.nodata is None
+
+
+def test_output_is_reprojected_to_web_mercator(tmp_path):
+    data = np.ones((180, 360), dtype=np.float32)
+    filename = write_granule(tmp_path, data, ("lat", "lon"), _FillValue=-1.0)
+
+    outfilename = cogify(filename, collection="test")
+
+    with rasterio.open(outfilename) as cog:
+        assert cog.crs == handler.WEB_MERCATOR
+        # Latitudes beyond the bounds of Web Mercator are left out
+        assert cog.bounds.left == pytest.approx(-WEB_MERCATOR_EXTENT)
+        assert cog.bounds.right == pytest.approx(WEB_MERCATOR_EXTENT, rel=1e-2)
+        assert cog.bounds.top == pytest.approx(WEB_MERCATOR_EXTENT, rel=1e-2)
+        assert cog.bounds.bottom == pytest.approx(-WEB_MERCATOR_EXTENT, rel=1e-2)
+        assert cog.nodata == -1.0
+        band = cog.read(1, masked=True)
+        assert band.count() and (band.compressed() == 1).all()
@@ -0,0 +1,146 @@
+import json
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+import requests
+
+import download
+
+URL = "https://example.com/granule.nc"
+
+
+def response(status_code, headers):
+    response = MagicMock(status_code=status_code, headers=headers)
+    response.__enter__.return_value = response
+    if status_code >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(str(status_code))
+    return response
+
+
+def test_probe_uses_head():
+    session = MagicMock()
+    session.head.return_value = response(
+        200, {"Content-Length": "1024", "Accept-Ranges": "bytes"}
+    )
+
+    assert download.probe(session, URL) == (1024, True)
+    assert not session.get.called
+
+
+@pytest.mark.parametrize("status_code", [403, 405])
+def test_probe_falls_back_to_a_ranged_get(status_code):
+    session = MagicMock()
+    session.head.return_value = response(status_code, {})
+    session.get.return_value = response(206, {"Content-Range": "bytes 0-0/1024"})
+
+    assert download.probe(session, URL) == (1024, True)
+    assert session.get.call_args.kwargs["headers"] == {"Range": "bytes=0-0"}
+
+
+def test_probe_without_range_support():
+    session = MagicMock()
+    session.head.return_value = response(405, {})
+    session.get.return_value = response(200, {"Content-Length": "1024"})
+
+    assert download.probe(session, URL) == (1024, False)
+
+
+def test_probe_raises_other_errors():
+    session = MagicMock()
+    session.head.return_value = response(404, {})
+
+    with pytest.raises(requests.HTTPError):
+        download.probe(session, URL)
+
+
+class RangeSession:
+    """
+    Serves byte ranges of `data`, failing the requests for which `fail(start)`
+    returns an exception, after the first chunk of the body
+    """
+
+    def __init__(self, data, fail=lambda start: None):
+        self.data = data
+        self.fail = fail
+        self.ranges = []
+
+    def get(self, url, headers, stream):
+        start, end = map(int, headers["Range"][len("bytes=") :].split("-"))
+        self.ranges.append((start, end))
+        body = self.data[start : end + 1]
+        error = self.fail(start)
+
+        def iter_content(chunk_size):
+            for offset in range(0, len(body), chunk_size):
+                yield body[offset : offset + chunk_size]
+                if error:
+                    raise error
+
+        result = response(206, {})
+        result.iter_content = iter_content
+        return result
+
+
+@pytest.fixture
+def small_parts():
+    with patch("download.PART_SIZE", 4), patch("download.CHUNK_SIZE", 2), patch(
+        "download.WORKERS", 1
+    ):
+        yield
+
+
+def test_ranged_download(tmp_path, small_parts):
+    data = bytes(range(10))
+    filename = str(tmp_path / "granule.nc")
+    session = RangeSession(data)
+
+    download.ranged_download(session, URL, filename, len(data))
+
+    with open(filename, "rb") as f:
+        assert f.read() == data
+    assert sorted(session.ranges) == [(0, 3), (4, 7), (8, 9)]
+    assert not os.path.exists(f"{filename}.parts")
+
+
+def test_rerun_skips_finished_ranges(tmp_path, small_parts):
+    data = bytes(range(10))
+    filename = str(tmp_path / "granule.nc")
+    failing = RangeSession(
+        data, fail=lambda start: requests.HTTPError("500") if start == 4 else None
+    )
+
+    with pytest.raises(requests.HTTPError):
+        download.ranged_download(failing, URL, filename, len(data))
+
+    # The file is preallocated and the finished ranges are recorded
+    assert os.path.getsize(filename) == len(data)
+    with open(f"{filename}.parts") as f:
+        assert json.load(f)["done"] == [0, 8]
+
+    session = RangeSession(data)
+    download.ranged_download(session, URL, filename, len(data))
+
+    assert session.ranges == [(4, 7)]
+    with open(filename, "rb") as f:
+        assert f.read() == data
+
+
+def test_part_resumes_after_a_dropped_connection(tmp_path, small_parts):
+    data = bytes(range(10))
+    filename = str(tmp_path / "granule.nc")
+    dropped = []
+
+    def drop_once(start):
+        if not dropped:
+            dropped.append(start)
+            return requests.exceptions.ChunkedEncodingError("Connection broken")
+
+    session = RangeSession(data, fail=drop_once)
+
+    download.ranged_download(session, URL, filename, len(data))
+
+    # The first part is resumed after the chunk it received
+    assert session.ranges[:2] == [(0, 3), (2, 3)]
+    with open(filename, "rb") as f:
+        assert f.read() == data
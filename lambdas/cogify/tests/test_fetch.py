@@ -0,0 +1,88 @@
+import json
+import os
+import threading
+from datetime import date
+
+import pytest
+
+from ERA5 import fetch
+
+
+class StubClient:
+    """Stands in for cdsapi.Client, writing the request as the download"""
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def retrieve(self, dataset, request, target):
+        with self.lock:
+            self.requests.append(request)
+        with open(target, "w") as f:
+            f.write("partial")
+        if (request["month"], tuple(request["variable"])) in self.fail:
+            raise RuntimeError("Request failed")
+        with open(target, "w") as f:
+            json.dump(request, f)
+
+
+def test_plan_splits_months_and_variables():
+    chunks = fetch.plan(
+        date(2021, 1, 30), date(2021, 2, 2), ["a", "b", "c"], max_fields=24 * 2 * 2
+    )
+
+    # Two variables of two days fit in a request
+    assert [(c.month, c.days, c.variables) for c in chunks] == [
+        (1, (30, 31), ("a", "b")),
+        (1, (30, 31), ("c",)),
+        (2, (1, 2), ("a", "b")),
+        (2, (1, 2), ("c",)),
+    ]
+    assert all(chunk.fields <= 24 * 2 * 2 for chunk in chunks)
+
+
+def test_plan_splits_the_days_of_a_variable():
+    chunks = fetch.plan(date(2021, 6, 1), date(2021, 6, 30), ["a"], max_fields=24 * 7)
+
+    assert [len(chunk.days) for chunk in chunks] == [7, 7, 7, 7, 2]
+    assert [day for chunk in chunks for day in chunk.days] == list(range(1, 31))
+
+
+def test_plan_rejects_reversed_ranges():
+    with pytest.raises(ValueError):
+        fetch.plan(date(2021, 2, 1), date(2021, 1, 1), ["a"])
+
+
+def test_cached_chunks_are_skipped(tmp_path):
+    chunks = fetch.plan(date(2021, 1, 1), date(2021, 2, 28), ["a"])
+    client = StubClient()
+
+    filenames = fetch.fetch(client, chunks, str(tmp_path))
+    assert len(client.requests) == 2
+    for chunk, filename in zip(chunks, filenames):
+        with open(f"{filename}.json") as f:
+            assert json.load(f) == {
+                "dataset": chunk.dataset,
+                "request": chunk.request(),
+            }
+
+    assert fetch.fetch(client, chunks, str(tmp_path)) == filenames
+    assert len(client.requests) == 2
+
+
+def test_rerun_resumes_from_failed_chunks(tmp_path):
+    chunks = fetch.plan(date(2021, 1, 1), date(2021, 3, 31), ["a"])
+
+    with pytest.raises(RuntimeError):
+        fetch.fetch(StubClient(fail={("02", ("a",))}), chunks, str(tmp_path))
+    # The failed download is left partial, never in the cache
+    failed = fetch.cached_filename(chunks[1], str(tmp_path))
+    assert not os.path.exists(failed)
+    assert not os.path.exists(f"{failed}.json")
+
+    client = StubClient()
+    filenames = fetch.fetch(client, chunks, str(tmp_path))
+
+    assert [request["month"] for request in client.requests] == ["02"]
+    assert all(os.path.exists(filename) for filename in filenames)
@@ -0,0 +1,181 @@
+from unittest.mock import patch
+
+import aiohttp
+import numpy as np
+import pytest
+from netCDF4 import Dataset
+
+import download
+import handler
+
+GRANULE_URL = "https://example.com/granule.nc"
+
+
+@pytest.fixture
+def netcdf3_granule(tmp_path):
+    filename = str(tmp_path / "granule.nc")
+    with Dataset(filename, "w", format="NETCDF3_CLASSIC") as dataset:
+        dataset.createDimension("lat", 2)
+        dataset.createDimension("lon", 3)
+        variable = dataset.createVariable("data", "f4", ("lat", "lon"))
+        variable[:] = np.arange(6).reshape(2, 3)
+    return filename
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        OSError("Unable to open file (file signature not found)"),
+        aiohttp.ClientResponseError(None, (), status=401, message="Unauthorized"),
+        aiohttp.ClientConnectionError("Connection reset"),
+    ],
+)
+def test_open_dataset_falls_back_to_download(netcdf3_granule, error):
+    with patch("handler.open_remote", side_effect=error), patch(
+        "handler.download_file", return_value=netcdf3_granule
+    ) as download_file:
+        dataset = handler.open_dataset(GRANULE_URL)
+
+    download_file.assert_called_once_with(GRANULE_URL)
+    try:
+        assert dataset["data"][:].sum() == 15
+    finally:
+        dataset.close()
+
+
+def test_open_dataset_downloads_without_remote_read(netcdf3_granule):
+    with patch("handler.open_remote") as open_remote, patch(
+        "handler.download_file", return_value=netcdf3_granule
+    ):
+        handler.open_dataset(GRANULE_URL, remote_read=False).close()
+
+    assert not open_remote.called
+
+
+def test_storage_options_use_a_bearer_token():
+    with patch.dict("os.environ", {"EARTHDATA_TOKEN": "token"}):
+        assert handler.storage_options(GRANULE_URL) == {
+            "headers": {"Authorization": "Bearer token"}
+        }
+        assert handler.storage_options("s3://bucket/granule.nc") == {}
+
+
+def test_earthdata_token_is_requested_with_credentials():
+    environ = {"EARTHDATA_USERNAME": "user", "EARTHDATA_PASSWORD": "password"}
+    with patch.dict("os.environ", environ, clear=True), patch(
+        "download.requests.post"
+    ) as post, patch("download._token", None):
+        post.return_value.json.return_value = {"access_token": "requested"}
+        assert download.earthdata_token() == "requested"
+        assert download.earthdata_token() == "requested"
+
+    post.assert_called_once()
+    assert post.call_args.kwargs["auth"] == ("user", "password")
+
+
+@pytest.fixture
+def grouped_granule(tmp_path):
+    filename = str(tmp_path / "granule.nc")
+    with Dataset(filename, "w") as dataset:
+        for name in ("HQ", "IR"):
+            group = dataset.createGroup(name)
+            group.createDimension("time", 2)
+            group.createDimension("lat", 18)
+            group.createDimension("lon", 36)
+            series = group.createVariable("precipitation", "f4", ("time", "lat", "lon"))
+            series[:] = np.ones((2, 18, 36))
+            static = group.createVariable("quality", "u1", ("lat", "lon"))
+            static[:] = np.ones((18, 36))
+    return filename
+
+
+def test_time_axis_of_a_variable_without_the_time_dimension(grouped_granule):
+    with Dataset(grouped_granule) as dataset:
+        assert handler.time_axis(dataset["HQ/precipitation"], "test", "time") == 0
+        assert handler.time_axis(dataset["HQ/quality"], "test", "time") is None
+
+
+def test_outputs_are_named_after_the_variable_paths(grouped_granule):
+    outputs = handler.to_cog(
+        False,
+        filename=grouped_granule,
+        collection="test",
+        variable_name="HQ/precipitation, IR/precipitation, HQ/quality",
+        time_dimension="time",
+        dst_crs="EPSG:4326",
+    )
+
+    basename = grouped_granule
+    assert [output["filename"] for output in outputs] == [
+        f"{basename}_HQ_precipitation_0.tif",
+        f"{basename}_HQ_precipitation_1.tif",
+        f"{basename}_IR_precipitation_0.tif",
+        f"{basename}_IR_precipitation_1.tif",
+        f"{basename}_HQ_quality.tif",
+    ]
+
+
+@pytest.mark.parametrize("memory_mb, cpus", [(1024, 1), (3008, 2), (10240, 6)])
+def test_concurrency_fits_in_memory(memory_mb, cpus):
+    processes = handler.default_processes(memory_mb, cpus)
+    workers = handler.default_workers(memory_mb, cpus, processes)
+
+    assert 1 <= processes <= cpus
+    assert processes * workers <= cpus
+    assert (
+        processes * (handler.PROCESS_MEMORY_MB + workers * handler.OUTPUT_MEMORY_MB)
+        <= memory_mb
+    )
+
+
+@pytest.fixture
+def reference_collection(tmp_path):
+    handler.config.read_dict(
+        {
+            "test-references": {
+                "output": "reference",
+                "concat_dims": "time",
+                "time_dimension": "time",
+            }
+        }
+    )
+    with patch("handler.LOCAL_REFERENCE_DIR", str(tmp_path)):
+        yield "test-references"
+    handler.config.remove_section("test-references")
+
+
+def test_combined_references_are_published(tmp_path, reference_collection):
+    events = []
+    for day in range(2):
+        filename = str(tmp_path / f"granule_{day}.nc")
+        with Dataset(filename, "w") as dataset:
+            dataset.createDimension("time", 1)
+            dataset.createDimension("lat", 2)
+            times = dataset.createVariable("time", "f8", ("time",))
+            times.units = "days since 2020-01-01"
+            times[:] = [day]
+            data = dataset.createVariable("data", "f4", ("time", "lat"))
+            data[:] = np.ones((1, 2))
+        events.append(
+            {
+                "collection": reference_collection,
+                "href": filename,
+                "granule_id": f"G{day}",
+            }
+        )
+
+    # The time ranges are read through the references
+    with patch("handler.open_dataset") as open_dataset:
+        output = handler.handler(events, None)
+
+    assert not open_dataset.called
+    assert not output["failed"]
+    combined = output["objects"][-1]
+    assert len(output["objects"]) == 3
+    assert output["objects"][0]["start_datetime"] == "2020-01-01T00:00:00Z"
+    assert combined["mode"] == "reference"
+    assert combined["remote_fileurl"] == combined["reference_url"]
+    assert combined["reference_url"].startswith(str(tmp_path))
+    assert combined["start_datetime"] == "2020-01-01T00:00:00Z"
+    assert combined["end_datetime"] == "2020-01-02T00:00:00Z"
+    assert combined["granules"] == [event["href"] for event in events]
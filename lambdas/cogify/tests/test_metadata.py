@@ -0,0 +1,29 @@
+import numpy as np
+
+import metadata
+
+
+def test_band_statistics_match_numpy():
+    rng = np.random.default_rng(0)
+    band = np.ma.masked_less(rng.normal(10, 2, (300, 200)).astype(np.float32), 8)
+    band[0, :10] = np.nan
+    statistics = metadata.BandStatistics(band.size)
+
+    for start in range(0, 300, 64):
+        statistics.update(band[start : start + 64])
+
+    values = np.ma.masked_invalid(band).compressed().astype(np.float64)
+    result = statistics.to_dict()["statistics"]
+    assert np.isclose(result["mean"], values.mean())
+    assert np.isclose(result["stddev"], values.std())
+    assert result["minimum"] == values.min()
+    assert result["maximum"] == values.max()
+    assert np.isclose(result["valid_percent"], values.size / band.size * 100)
+
+
+def test_histogram_samples_are_copies():
+    statistics = metadata.BandStatistics(10)
+
+    statistics.update(np.arange(10, dtype=np.uint8))
+
+    assert all(sample.base is None for sample in statistics.samples)
@@ -1,10 +1,47 @@
+import base64
+import io
 import json
 import os
+import queue
 import urllib.parse
-import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Optional, Set, Tuple
 
 import boto3
+from botocore.config import Config
 from botocore.errorfactory import ClientError
+from botocore.exceptions import BotoCoreError
+
+# copy_object handles objects up to 5 GB, larger ones are copied in parts
+COPY_OBJECT_LIMIT = 5 * 1024**3
+COPY_PART_SIZE = 512 * 1024**2
+COPY_PART_WORKERS = 8
+ACCESS_DENIED_CODES = ("AccessDenied", "403")
+# Largest part size and parts in flight per object of streaming transfers
+STREAM_PART_SIZE = int(os.environ.get("STREAM_PART_SIZE", 64 * 1024**2))
+STREAM_PARTS_IN_FLIGHT = 4
+MIN_PART_SIZE = 5 * 1024**2
+MAX_PARTS = 10000
+# Metadata key recording the ETag of the source object a copy was made from
+SOURCE_ETAG_METADATA = "source-etag"
+# Headers of the source object that copies keep
+COPIED_HEADERS = (
+    "ContentType",
+    "ContentEncoding",
+    "ContentDisposition",
+    "ContentLanguage",
+    "CacheControl",
+)
+# Number of objects transferred at once
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", 16))
+# Batches of at least this many objects list the target prefixes once, smaller
+# ones HEAD each target object
+LIST_THRESHOLD = int(os.environ.get("LIST_THRESHOLD", 50))
+# Pages of LIST_PAGE_SIZE keys listed per prefix, objects under larger prefixes
+# are looked up with a HEAD each
+LIST_PAGE_SIZE = 1000
+LIST_MAX_PAGES = int(os.environ.get("LIST_MAX_PAGES", 10))
 
 
 def assume_role(role_arn, session_name):
@@ -16,59 +53,542 @@ def assume_role(role_arn, session_name):
     return creds["Credentials"]
 
 
-def handler(event, context):
-    TARGET_BUCKET = os.environ["BUCKET"]
+def upload_attributes(head) -> Dict[str, object]:
+    """
+    Returns the content headers and user metadata of a source object's HEAD,
+    which copies made with MetadataDirective=REPLACE and multipart uploads have to
+    be given, adding the source ETag so that later runs can recognize the copy
+    """
+    attributes = {
+        "Metadata": {
+            **head.get("Metadata", {}),
+            SOURCE_ETAG_METADATA: head["ETag"].strip('"'),
+        }
+    }
+    for header in COPIED_HEADERS:
+        if head.get(header):
+            attributes[header] = head[header]
+    return attributes
+
+
+def multipart_copy(s3, src_bucket, src_key, size, dst_bucket, dst_key, attributes):
+    """
+    Copies an object server-side in parallel `upload_part_copy` parts
+    """
+    upload_id = s3.create_multipart_upload(
+        Bucket=dst_bucket, Key=dst_key, **attributes
+    )["UploadId"]
+
+    def copy_part(part_number):
+        start = (part_number - 1) * COPY_PART_SIZE
+        end = min(start + COPY_PART_SIZE, size) - 1
+        response = s3.upload_part_copy(
+            Bucket=dst_bucket,
+            Key=dst_key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            CopySource={"Bucket": src_bucket, "Key": src_key},
+            CopySourceRange=f"bytes={start}-{end}",
+        )
+        return {"PartNumber": part_number, "ETag": response["CopyPartResult"]["ETag"]}
+
+    part_count = -(-size // COPY_PART_SIZE)
+    try:
+        with ThreadPoolExecutor(max_workers=COPY_PART_WORKERS) as executor:
+            parts = list(executor.map(copy_part, range(1, part_count + 1)))
+        s3.complete_multipart_upload(
+            Bucket=dst_bucket,
+            Key=dst_key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+    except:
+        s3.abort_multipart_upload(Bucket=dst_bucket, Key=dst_key, UploadId=upload_id)
+        raise
+
+
+def server_side_copy(s3, src_bucket, src_key, size, dst_bucket, dst_key, attributes):
+    """
+    Copies an object within S3, without its bytes going through the function
+    """
+    if size > COPY_OBJECT_LIMIT:
+        multipart_copy(s3, src_bucket, src_key, size, dst_bucket, dst_key, attributes)
+    else:
+        s3.copy_object(
+            Bucket=dst_bucket,
+            Key=dst_key,
+            CopySource={"Bucket": src_bucket, "Key": src_key},
+            MetadataDirective="REPLACE",
+            **attributes,
+        )
+
+
+class BufferPool:
+    """
+    Fixed number of reusable part buffers shared by all streaming transfers, which
+    bounds their memory use whatever the number and size of the objects
+    """
+
+    def __init__(self, count: int, size: int):
+        self.size = size
+        self._buffers = queue.LifoQueue()
+        # Buffers are allocated on first use
+        for _ in range(count):
+            self._buffers.put(None)
+
+    @classmethod
+    def from_environment(cls) -> "BufferPool":
+        memory_mb = int(os.environ.get("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", 1024))
+        # Use at most half of the function's memory for part buffers, in parts
+        # small enough for one object's parts in flight to fit
+        budget = memory_mb * 1024**2 // 2
+        size = max(
+            MIN_PART_SIZE, min(STREAM_PART_SIZE, budget // STREAM_PARTS_IN_FLIGHT)
+        )
+        count = max(2, budget // size)
+        return cls(count=int(os.environ.get("STREAM_BUFFERS", count)), size=size)
+
+    @contextmanager
+    def buffer(self):
+        buffer = self._buffers.get() or bytearray(self.size)
+        try:
+            yield buffer
+        finally:
+            self._buffers.put(buffer)
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Read-only file over a filled part buffer, so that parts are uploaded
+    without copying them
+    """
+
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        count = max(0, min(len(b), len(self._view) - self._position))
+        b[:count] = self._view[self._position : self._position + count]
+        self._position += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = offset
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
+def stream_transfer(
+    source_s3,
+    target_s3,
+    pool,
+    src_bucket,
+    src_key,
+    size,
+    dst_bucket,
+    dst_key,
+    attributes=None,
+):
+    """
+    Pipes ranged GETs from the source client into a multipart upload with the target
+    client, keeping several parts in flight within the buffer pool
+    """
+    if not size:
+        target_s3.put_object(
+            Bucket=dst_bucket, Key=dst_key, Body=b"", **(attributes or {})
+        )
+        return
+    if size > pool.size * MAX_PARTS:
+        raise Exception(f"Object of {size} bytes is too large to stream")
+
+    upload_id = target_s3.create_multipart_upload(
+        Bucket=dst_bucket, Key=dst_key, **(attributes or {})
+    )["UploadId"]
+
+    def stream_part(part_number):
+        start = (part_number - 1) * pool.size
+        length = min(pool.size, size - start)
+        with pool.buffer() as buffer:
+            view = memoryview(buffer)
+            body = source_s3.get_object(
+                Bucket=src_bucket,
+                Key=src_key,
+                Range=f"bytes={start}-{start + length - 1}",
+            )["Body"]
+            position = 0
+            for chunk in body.iter_chunks(chunk_size=1024**2):
+                view[position : position + len(chunk)] = chunk
+                position += len(chunk)
+            if position != length:
+                raise Exception(
+                    f"Expected {length} bytes from {src_key}, got {position}"
+                )
+            response = target_s3.upload_part(
+                Bucket=dst_bucket,
+                Key=dst_key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=BufferReader(view[:length]),
+            )
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+    part_count = -(-size // pool.size)
+    try:
+        with ThreadPoolExecutor(max_workers=STREAM_PARTS_IN_FLIGHT) as executor:
+            parts = list(executor.map(stream_part, range(1, part_count + 1)))
+        target_s3.complete_multipart_upload(
+            Bucket=dst_bucket,
+            Key=dst_key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+    except:
+        target_s3.abort_multipart_upload(
+            Bucket=dst_bucket, Key=dst_key, UploadId=upload_id
+        )
+        raise
+
+
+def transfer_object(
+    source_s3,
+    target_s3,
+    pool,
+    src_bucket,
+    src_key,
+    size,
+    dst_bucket,
+    dst_key,
+    attributes,
+):
+    """
+    Copies an object server-side, falling back to streaming it between the source
+    and target clients when the target credentials can't read the source
+    """
+    try:
+        server_side_copy(
+            target_s3, src_bucket, src_key, size, dst_bucket, dst_key, attributes
+        )
+        return
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ACCESS_DENIED_CODES:
+            raise
+        print(
+            f"Server-side copy of s3://{src_bucket}/{src_key} denied, "
+            "falling back to a streaming transfer."
+        )
+
+    stream_transfer(
+        source_s3,
+        target_s3,
+        pool,
+        src_bucket,
+        src_key,
+        size,
+        dst_bucket,
+        dst_key,
+        attributes,
+    )
+
 
+def target_location(file_object) -> Tuple[str, str]:
+    """
+    Returns the bucket and key an event object's file is transferred to
+    """
+    if file_object.get("user_shared"):
+        target_bucket = os.environ.get("USER_SHARED_BUCKET")
+    else:
+        target_bucket = os.environ["BUCKET"]
+
+    filename = file_object["remote_fileurl"].rstrip("/").split("/")[-1]
+    target_key = f"{file_object.get('collection')}/{filename}"
+    # The file-staging directory is the default for MAAP's bucket
+    directory = file_object.get("directory", "file-staging")
+    if directory:
+        target_key = f"{directory}/{target_key}"
+    return target_bucket, target_key
+
+
+def target_prefix(bucket, key) -> Tuple[str, str]:
+    return bucket, key.rsplit("/", 1)[0] + "/"
+
+
+def list_existing(
+    target_s3, locations, max_pages=LIST_MAX_PAGES
+) -> Tuple[Dict[Tuple[str, str], Tuple[int, str]], Set[Tuple[str, str]]]:
+    """
+    Lists the target prefixes of a batch once, returning the size and ETag of
+    every object found by (bucket, key), and the (bucket, prefix) pairs that were
+    listed completely. Prefixes holding more than `max_pages` pages of keys, or
+    that can't be listed, are left out so their objects are looked up one by one.
+    """
+    prefixes = {target_prefix(bucket, key) for bucket, key in locations if bucket}
+    paginator = target_s3.get_paginator("list_objects_v2")
+
+    existing, listed = {}, set()
+    for bucket, prefix in prefixes:
+        found = {}
+        try:
+            for page_number, page in enumerate(
+                paginator.paginate(
+                    Bucket=bucket,
+                    Prefix=prefix,
+                    PaginationConfig={"PageSize": LIST_PAGE_SIZE},
+                )
+            ):
+                if page_number == max_pages:
+                    print(f"More than {max_pages} pages under s3://{bucket}/{prefix}")
+                    break
+                for obj in page.get("Contents", []):
+                    found[(bucket, obj["Key"])] = (obj["Size"], obj["ETag"])
+            else:
+                existing.update(found)
+                listed.add((bucket, prefix))
+        except (ClientError, BotoCoreError) as e:
+            print(f"Failed to list s3://{bucket}/{prefix}: {e}")
+    return existing, listed
+
+
+def head_existing(target_s3, bucket, key) -> Optional[Tuple[int, str]]:
+    """
+    Returns the size and ETag of a target object, or None if it's missing or
+    can't be read
+    """
+    try:
+        head = target_s3.head_object(Bucket=bucket, Key=key)
+    except (ClientError, BotoCoreError):
+        return None
+    return head["ContentLength"], head["ETag"]
+
+
+def full_object_checksum(head) -> Optional[str]:
+    # Checksums of multipart uploads are composite ("<checksum>-<parts>")
+    if (sha256 := head.get("ChecksumSHA256")) and "-" not in sha256:
+        return sha256
+    return None
+
+
+def multihash_checksum(head) -> Optional[str]:
+    """
+    Returns the hex multihash of an object's full-content checksum, as used by the
+    STAC file extension's `file:checksum`, when S3 knows one
+    """
+    if sha256 := full_object_checksum(head):
+        return "1220" + base64.b64decode(sha256).hex()
+    etag = head["ETag"].strip('"')
+    # Single-part ETags are the MD5 of the content, unless encrypted with KMS
+    if "-" not in etag and head.get("ServerSideEncryption") != "aws:kms":
+        return "d50110" + etag
+    return None
+
+
+def is_same_object(head, existing: Tuple[int, str]) -> bool:
+    """
+    Compares a source object to an existing target object by size and ETag.
+    ETags of multipart objects depend on the part sizes, so a copy made with
+    other part sizes differs even when the content is the same: `is_copy_of`
+    recognizes those.
+    """
+    size, etag = existing
+    return head["ContentLength"] == size and head["ETag"] == etag
+
+
+def is_copy_of(target_s3, bucket, key, head) -> bool:
+    """
+    Checks whether a target object of the same size was copied from the source,
+    by the source ETag recorded in its metadata, or has the same full-object
+    SHA-256 checksum. ETags of multipart and KMS-encrypted objects differ between
+    the source and its copy.
+    """
+    try:
+        target = target_s3.head_object(Bucket=bucket, Key=key, ChecksumMode="ENABLED")
+    except (ClientError, BotoCoreError):
+        return False
+    if target["ContentLength"] != head["ContentLength"]:
+        return False
+    if target.get("Metadata", {}).get(SOURCE_ETAG_METADATA) == head["ETag"].strip('"'):
+        return True
+    checksum = full_object_checksum(head)
+    return checksum is not None and full_object_checksum(target) == checksum
+
+
+def discovered_head(file_object) -> Optional[Dict[str, object]]:
+    """
+    Returns the source size and ETag listed by discovery, in the shape of a HEAD
+    response, when the event object has them
+    """
+    if file_object.get("source_size") is None or not file_object.get("source_etag"):
+        return None
+    return {
+        "ContentLength": file_object["source_size"],
+        "ETag": file_object["source_etag"],
+    }
+
+
+def transfer_file_object(file_object, source_s3, target_s3, pool, existing):
+    """
+    Transfers the file of a single event object to the target bucket, returning
+    the object pointing to its new location, with its size and checksum, and the
+    transfer status. Without a listing of the `existing` objects, the target
+    object is looked up on its own.
+    """
+    if not file_object.get("upload"):
+        return file_object, "skipped"
+
+    url = urllib.parse.urlparse(file_object["remote_fileurl"])
+    src_bucket = url.hostname
+    src_key = url.path.strip("/")
+    target_bucket, target_key = target_location(file_object)
+    target_url = f"s3://{target_bucket}/{target_key}"
+    listed = discovered_head(file_object)
+    # The listed source size and ETag are only needed here
+    file_object = {
+        key: value
+        for key, value in file_object.items()
+        if key not in ("source_size", "source_etag")
+    }
+
+    def transferred_object(head):
+        return {
+            **file_object,
+            "remote_fileurl": target_url,
+            "file_size": head["ContentLength"],
+            "file_checksum": multihash_checksum(head),
+        }
+
+    try:
+        # Only copy objects that are missing or differ in the target bucket
+        if existing is None:
+            target = head_existing(target_s3, target_bucket, target_key)
+        else:
+            target = existing.get((target_bucket, target_key))
+        # On reruns, a copy with the listed size and ETag needs no source HEAD.
+        # Matching single-part ETags of two objects are MD5s, not KMS ETags.
+        if target and listed and target == (listed["ContentLength"], listed["ETag"]):
+            return transferred_object(listed), "exists"
+
+        head = source_s3.head_object(
+            Bucket=src_bucket, Key=src_key, ChecksumMode="ENABLED"
+        )
+        # Targets are only reported with the source's size and checksum once
+        # their content is known to match
+        if target and (
+            is_same_object(head, target)
+            or (
+                head["ContentLength"] == target[0]
+                and is_copy_of(target_s3, target_bucket, target_key, head)
+            )
+        ):
+            return transferred_object(head), "exists"
+
+        transfer_object(
+            source_s3,
+            target_s3,
+            pool,
+            src_bucket,
+            src_key,
+            head["ContentLength"],
+            target_bucket,
+            target_key,
+            upload_attributes(head),
+        )
+        return transferred_object(head), "transferred"
+    except Exception as e:
+        print(
+            "Failed while trying to upload file from "
+            f"s3://{src_bucket}/{src_key} to {target_url}: {e}"
+        )
+        return {**file_object, "remote_fileurl": target_url}, f"failed: {e}"
+
+
+def s3_client(role_arn: Optional[str]):
     kwargs = {}
-    if role_arn := os.environ.get("DATA_MANAGEMENT_ROLE_ARN"):
+    if role_arn:
         creds = assume_role(role_arn, "veda-data-pipelines_data-transfer")
         kwargs = {
             "aws_access_key_id": creds["AccessKeyId"],
             "aws_secret_access_key": creds["SecretAccessKey"],
             "aws_session_token": creds["SessionToken"],
         }
-    source_s3 = boto3.client("s3", **kwargs)
-    target_s3 = boto3.client("s3", **kwargs)
+    # Enough connections for all objects and parts in flight
+    config = Config(max_pool_connections=MAX_WORKERS * STREAM_PARTS_IN_FLIGHT)
+    return boto3.client("s3", config=config, **kwargs)
 
-    for object in event:
-        if not object.get("upload"):
-            continue
 
-        if object.get("user_shared"):
-            TARGET_BUCKET = os.environ.get("USER_SHARED_BUCKET")
+def handler(event, context):
+    """
+    Transfers a list of file objects, returning the transferred (or skipped)
+    objects at their new location and the failed event objects with their error:
 
-        url = urllib.parse.urlparse(object["remote_fileurl"])
-        src_bucket = url.hostname
-        src_key = url.path.strip("/")
-        filename = src_key.split("/")[-1]
+    {"objects": [...], "failed": [{..., "error": "failed: ..."}]}
+    """
+    target_role_arn = os.environ.get("DATA_MANAGEMENT_ROLE_ARN")
+    target_s3 = s3_client(target_role_arn)
+    # Sources that the target credentials can't read are streamed with the
+    # SOURCE_ROLE_ARN credentials, or with the function's own role
+    source_role_arn = os.environ.get("SOURCE_ROLE_ARN")
+    if source_role_arn or target_role_arn:
+        source_s3 = s3_client(source_role_arn)
+    else:
+        source_s3 = target_s3
+    pool = BufferPool.from_environment()
+    locations = [
+        target_location(file_object)
+        for file_object in event
+        if file_object.get("upload")
+    ]
+    if len(locations) >= LIST_THRESHOLD:
+        existing, listed = list_existing(target_s3, locations, LIST_MAX_PAGES)
+    else:
+        existing, listed = {}, set()
 
-        target_key = f"{object.get('collection')}/{filename}"
-        # The file-staging directory is the default for MAAP's bucket
-        directory = object.get("directory", "file-staging")
-        if directory:
-            target_key = f"{directory}/{target_key}"
-        target_url = f"s3://{TARGET_BUCKET}/{target_key}"
+    def existing_objects(file_object):
+        """The listing, when it covers the object's target prefix"""
+        if file_object.get("upload") and (
+            target_prefix(*target_location(file_object)) in listed
+        ):
+            return existing
+        return None
 
-        # Check if the corresponding object exists in the target bucket
-        try:
-            target_s3.head_object(Bucket=TARGET_BUCKET, Key=target_key)
-        except ClientError:
-            try:
-                # Not found
-                with tempfile.TemporaryDirectory() as tmp_dir:
-                    tmp_filename = f"{tmp_dir}/{filename}"
-                    source_s3.download_file(src_bucket, src_key, tmp_filename)
-                    target_s3.upload_file(tmp_filename, TARGET_BUCKET, target_key)
-            except:
-                print(
-                    "Failed while trying to upload file from "
-                    f"s3://{src_bucket}/{src_key} to s3://{TARGET_BUCKET}/{target_key}."
-                )
-                raise
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        # map preserves the order of the event for the downstream Map
+        results = list(
+            executor.map(
+                lambda file_object: transfer_file_object(
+                    file_object,
+                    source_s3,
+                    target_s3,
+                    pool,
+                    existing_objects(file_object),
+                ),
+                event,
+            )
+        )
 
-        object["remote_fileurl"] = target_url
+    objects, failed = [], []
+    for event_object, (file_object, status) in zip(event, results):
+        print(f"{file_object['remote_fileurl']}: {status}")
+        if status.startswith("failed"):
+            # The event object, so the failures can be transferred again
+            failed.append({**event_object, "error": status})
+        else:
+            objects.append(file_object)
+    if failed:
+        print(f"Failed to transfer {len(failed)} of {len(event)} objects")
 
-    return event
+    return {"objects": objects, "failed": failed}
 
 
 if __name__ == "__main__":
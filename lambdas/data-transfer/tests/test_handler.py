@@ -1,3 +1,10 @@
+import base64
+import hashlib
+import os
+from unittest.mock import MagicMock, patch
+
+from botocore.exceptions import ClientError
+
 import handler
 
 
@@ -15,10 +22,390 @@ def test_handler(mock_src_bucket, mock_dst_bucket):
 
     expected_bucket = mock_dst_bucket.name
     expected_path = "/".join([test_event["collection"], test_object.key])
-    assert response == [
+    assert response == {
+        "objects": [
+            {
+                **test_event,
+                "remote_fileurl": f"s3://{expected_bucket}/{expected_path}",
+                "file_size": len(test_data),
+                "file_checksum": "d50110" + hashlib.md5(test_data).hexdigest(),
+            }
+        ],
+        "failed": [],
+    }
+    assert mock_dst_bucket.Object(expected_path).get()["Body"].read() == test_data
+
+
+def test_multipart_copy(mock_src_bucket, mock_dst_bucket):
+    test_data = os.urandom(11 * 1024**2)
+    test_object = mock_src_bucket.put_object(
+        Body=test_data,
+        Key="large-key",
+        ContentType="image/tiff",
+        ContentEncoding="gzip",
+        CacheControl="max-age=60",
+        Metadata={"source": "test"},
+    )
+    test_event = {
+        "upload": 1,
+        "remote_fileurl": f"s3://{test_object.bucket_name}/{test_object.key}",
+        "collection": "test_collection",
+        "directory": "",
+    }
+
+    with patch("handler.COPY_OBJECT_LIMIT", 5 * 1024**2), patch(
+        "handler.COPY_PART_SIZE", 5 * 1024**2
+    ):
+        handler.handler([test_event], None)
+
+    copied = mock_dst_bucket.Object("test_collection/large-key").get()
+    assert copied["ETag"].endswith('-3"')
+    assert copied["Body"].read() == test_data
+    assert copied["ContentType"] == "image/tiff"
+    assert copied["ContentEncoding"] == "gzip"
+    assert copied["CacheControl"] == "max-age=60"
+    assert copied["Metadata"] == {
+        "source": "test",
+        "source-etag": test_object.e_tag.strip('"'),
+    }
+
+
+def test_copy_falls_back_when_denied(mock_src_bucket, mock_dst_bucket):
+    test_data = b"test-object"
+    test_object = mock_src_bucket.put_object(Body=test_data, Key="test-key")
+    test_event = {
+        "upload": 1,
+        "remote_fileurl": f"s3://{test_object.bucket_name}/{test_object.key}",
+        "collection": "test_collection",
+        "directory": "",
+    }
+    denied = ClientError({"Error": {"Code": "AccessDenied"}}, "CopyObject")
+
+    with patch("handler.server_side_copy", side_effect=denied), patch(
+        "handler.stream_transfer", wraps=handler.stream_transfer
+    ) as stream_transfer:
+        handler.handler([test_event], None)
+
+    assert stream_transfer.called
+    copied = mock_dst_bucket.Object("test_collection/test-key").get()
+    assert copied["Body"].read() == test_data
+
+
+def test_denied_copies_are_read_with_another_role(mock_src_bucket, mock_dst_bucket):
+    """
+    Ensure that the fallback doesn't read the source with the denied credentials.
+    """
+    with patch("handler.s3_client") as s3_client, patch.dict(
+        os.environ, {"DATA_MANAGEMENT_ROLE_ARN": "arn:aws:iam::0:role/target"}
+    ):
+        handler.handler([], None)
+    # The function's own role
+    assert [call.args for call in s3_client.call_args_list] == [
+        ("arn:aws:iam::0:role/target",),
+        (None,),
+    ]
+
+    with patch("handler.s3_client") as s3_client, patch.dict(
+        os.environ,
+        {
+            "DATA_MANAGEMENT_ROLE_ARN": "arn:aws:iam::0:role/target",
+            "SOURCE_ROLE_ARN": "arn:aws:iam::0:role/source",
+        },
+    ):
+        handler.handler([], None)
+    assert s3_client.call_args_list[-1].args == ("arn:aws:iam::0:role/source",)
+
+
+def test_parallel_transfers_keep_order(mock_src_bucket, mock_dst_bucket):
+    test_events = []
+    for i in range(20):
+        test_object = mock_src_bucket.put_object(Body=b"data", Key=f"key-{i}")
+        test_events.append(
+            {
+                "upload": i % 3 != 0,
+                "remote_fileurl": f"s3://{test_object.bucket_name}/{test_object.key}",
+                "collection": "test_collection",
+                "directory": "",
+            }
+        )
+
+    response = handler.handler(test_events, None)
+
+    assert [obj["remote_fileurl"].split("/")[-1] for obj in response["objects"]] == [
+        f"key-{i}" for i in range(20)
+    ]
+    copied = {obj.key for obj in mock_dst_bucket.objects.all()}
+    assert copied == {f"test_collection/key-{i}" for i in range(20) if i % 3 != 0}
+
+
+def test_failed_transfers_are_returned(mock_src_bucket, mock_dst_bucket):
+    test_object = mock_src_bucket.put_object(Body=b"data", Key="key")
+    test_events = [
         {
-            **test_event,
-            "remote_fileurl": f"s3://{expected_bucket}/{expected_path}",
+            "upload": 1,
+            "remote_fileurl": f"s3://{mock_src_bucket.name}/{key}",
+            "collection": "test_collection",
+            "directory": "",
         }
+        for key in [test_object.key, "missing-key"]
     ]
-    assert mock_dst_bucket.Object(expected_path).get()["Body"].read() == test_data
+
+    response = handler.handler(test_events, None)
+
+    # The other objects are still transferred
+    assert [obj["remote_fileurl"] for obj in response["objects"]] == [
+        f"s3://{mock_dst_bucket.name}/test_collection/key"
+    ]
+    assert mock_dst_bucket.Object("test_collection/key").get()
+    # Only the failed event objects are returned, to be transferred again
+    assert len(response["failed"]) == 1
+    failure = response["failed"][0]
+    assert failure["remote_fileurl"] == test_events[1]["remote_fileurl"]
+    assert failure["error"].startswith("failed:")
+
+
+def test_stream_transfer(mock_src_bucket, mock_dst_bucket):
+    test_data = os.urandom(12 * 1024**2)
+    test_object = mock_src_bucket.put_object(Body=test_data, Key="test-key")
+    s3 = mock_src_bucket.meta.client
+    pool = handler.BufferPool(count=2, size=5 * 1024**2)
+
+    handler.stream_transfer(
+        s3,
+        s3,
+        pool,
+        test_object.bucket_name,
+        test_object.key,
+        len(test_data),
+        mock_dst_bucket.name,
+        "streamed-key",
+    )
+
+    copied = mock_dst_bucket.Object("streamed-key").get()
+    assert copied["ETag"].endswith('-3"')
+    assert copied["Body"].read() == test_data
+    # Buffers are reused across parts
+    assert pool._buffers.qsize() == 2
+
+
+def test_buffer_pool_fits_in_memory():
+    with patch.dict(os.environ, {"AWS_LAMBDA_FUNCTION_MEMORY_SIZE": "128"}):
+        pool = handler.BufferPool.from_environment()
+    assert pool.size * pool._buffers.qsize() <= 64 * 1024**2
+    assert pool.size >= handler.MIN_PART_SIZE
+
+    with patch.dict(os.environ, {"AWS_LAMBDA_FUNCTION_MEMORY_SIZE": "1024"}):
+        pool = handler.BufferPool.from_environment()
+    assert pool.size == handler.STREAM_PART_SIZE
+
+
+def test_existing_objects_are_listed_once(mock_src_bucket, mock_dst_bucket):
+    test_events = []
+    for i in range(5):
+        test_object = mock_src_bucket.put_object(Body=b"data", Key=f"key-{i}")
+        mock_dst_bucket.put_object(Body=b"data", Key=f"test_collection/key-{i}")
+        test_events.append(
+            {
+                "upload": 1,
+                "remote_fileurl": f"s3://{test_object.bucket_name}/{test_object.key}",
+                "collection": "test_collection",
+                "directory": "",
+            }
+        )
+
+    with patch("handler.transfer_object") as transfer_object, patch(
+        "handler.list_existing", wraps=handler.list_existing
+    ) as list_existing, patch("handler.LIST_THRESHOLD", 5):
+        handler.handler(test_events, None)
+
+    assert not transfer_object.called
+    assert list_existing.call_count == 1
+
+
+def test_small_batches_are_not_listed(mock_src_bucket, mock_dst_bucket):
+    test_object = mock_src_bucket.put_object(Body=b"data", Key="key")
+    mock_dst_bucket.put_object(Body=b"data", Key="test_collection/key")
+    test_event = {
+        "upload": 1,
+        "remote_fileurl": f"s3://{test_object.bucket_name}/{test_object.key}",
+        "collection": "test_collection",
+        "directory": "",
+    }
+
+    with patch("handler.transfer_object") as transfer_object, patch(
+        "handler.list_existing"
+    ) as list_existing:
+        handler.handler([test_event], None)
+
+    assert not list_existing.called
+    assert not transfer_object.called
+
+
+def test_failed_listing_looks_objects_up():
+    target_s3 = MagicMock()
+    target_s3.get_paginator.return_value.paginate.side_effect = ClientError(
+        {"Error": {"Code": "AccessDenied"}}, "ListObjectsV2"
+    )
+
+    existing, listed = handler.list_existing(
+        target_s3, [("dst-bucket", "test_collection/key"), (None, "shared/key")]
+    )
+
+    assert existing == {}
+    assert listed == set()
+    # Objects without a bucket, e.g. USER_SHARED_BUCKET unset, aren't listed
+    target_s3.get_paginator.return_value.paginate.assert_called_once_with(
+        Bucket="dst-bucket",
+        Prefix="test_collection/",
+        PaginationConfig={"PageSize": handler.LIST_PAGE_SIZE},
+    )
+
+
+def test_large_prefixes_fall_back_to_heads(mock_src_bucket, mock_dst_bucket):
+    test_events = []
+    for i in range(3):
+        test_object = mock_src_bucket.put_object(Body=b"data", Key=f"key-{i}")
+        mock_dst_bucket.put_object(Body=b"data", Key=f"test_collection/key-{i}")
+        test_events.append(
+            {
+                "upload": 1,
+                "remote_fileurl": f"s3://{test_object.bucket_name}/{test_object.key}",
+                "collection": "test_collection",
+                "directory": "",
+            }
+        )
+
+    s3 = mock_dst_bucket.meta.client
+    locations = [handler.target_location(event) for event in test_events]
+    with patch("handler.LIST_PAGE_SIZE", 1):
+        assert handler.list_existing(s3, locations, max_pages=2) == ({}, set())
+        existing, listed = handler.list_existing(s3, locations, max_pages=3)
+    assert len(existing) == 3
+    assert listed == {(mock_dst_bucket.name, "test_collection/")}
+
+    with patch("handler.LIST_PAGE_SIZE", 1), patch("handler.LIST_MAX_PAGES", 2), patch(
+        "handler.LIST_THRESHOLD", 1
+    ), patch(
+        "handler.list_existing", wraps=handler.list_existing
+    ) as list_existing, patch(
+        "handler.head_existing", wraps=handler.head_existing
+    ) as head_existing, patch(
+        "handler.transfer_object"
+    ) as transfer_object:
+        handler.handler(test_events, None)
+
+    assert list_existing.call_count == 1
+    assert head_existing.call_count == 3
+    assert not transfer_object.called
+
+
+def test_stale_objects_are_copied_again(mock_src_bucket, mock_dst_bucket):
+    test_data = b"test-object"
+    test_object = mock_src_bucket.put_object(Body=test_data, Key="test-key")
+    mock_dst_bucket.put_object(Body=b"partial", Key="test_collection/test-key")
+    test_event = {
+        "upload": 1,
+        "remote_fileurl": f"s3://{test_object.bucket_name}/{test_object.key}",
+        "collection": "test_collection",
+        "directory": "",
+    }
+
+    handler.handler([test_event], None)
+
+    copied = mock_dst_bucket.Object("test_collection/test-key").get()
+    assert copied["Body"].read() == test_data
+
+
+def test_changed_multipart_sources_are_copied_again(mock_src_bucket, mock_dst_bucket):
+    """
+    Ensure that a source that changed but kept its size isn't taken for its copy
+    because their multipart ETags differ.
+    """
+    test_data = os.urandom(11 * 1024**2)
+    test_event = {
+        "upload": 1,
+        "remote_fileurl": f"s3://{mock_src_bucket.name}/large-key",
+        "collection": "test_collection",
+        "directory": "",
+    }
+    with patch("handler.COPY_OBJECT_LIMIT", 5 * 1024**2), patch(
+        "handler.COPY_PART_SIZE", 5 * 1024**2
+    ):
+        mock_src_bucket.put_object(Body=test_data, Key="large-key")
+        handler.handler([test_event], None)
+        # A copy with other part sizes is recognized by its source ETag
+        with patch("handler.transfer_object") as transfer_object:
+            handler.handler([test_event], None)
+        assert not transfer_object.called
+
+        changed_data = os.urandom(len(test_data))
+        mock_src_bucket.put_object(Body=changed_data, Key="large-key")
+        handler.handler([test_event], None)
+
+    copied = mock_dst_bucket.Object("test_collection/large-key").get()
+    assert copied["Body"].read() == changed_data
+
+
+def test_reruns_use_the_discovered_size_and_etag(mock_src_bucket, mock_dst_bucket):
+    test_data = b"test-object"
+    test_object = mock_src_bucket.put_object(Body=test_data, Key="test-key")
+    test_event = {
+        "upload": 1,
+        "remote_fileurl": f"s3://{test_object.bucket_name}/{test_object.key}",
+        "collection": "test_collection",
+        "directory": "",
+        "source_size": len(test_data),
+        "source_etag": test_object.e_tag,
+    }
+    handler.handler([test_event], None)
+
+    with patch("handler.transfer_object") as transfer_object, patch(
+        "handler.s3_client", return_value=MagicMock(wraps=handler.s3_client(None))
+    ) as s3_client:
+        response = handler.handler([test_event], None)
+
+    assert not transfer_object.called
+    # Only the target object is looked up
+    assert s3_client.return_value.head_object.call_count == 1
+    (transferred,) = response["objects"]
+    assert transferred["file_checksum"] == "d50110" + hashlib.md5(test_data).hexdigest()
+    assert "source_etag" not in transferred
+
+
+def test_copies_are_recognized_by_their_source_etag(mock_src_bucket, mock_dst_bucket):
+    test_object = mock_src_bucket.put_object(Body=b"data", Key="test-key")
+    head = {"ContentLength": 4, "ETag": test_object.e_tag}
+    # KMS ETags of the same content differ between objects
+    mock_dst_bucket.put_object(
+        Body=b"data",
+        Key="copy",
+        Metadata={"source-etag": test_object.e_tag.strip('"')},
+    )
+    s3 = mock_dst_bucket.meta.client
+
+    assert not handler.is_same_object(head, (4, '"0123456789abcdef"'))
+    assert not handler.is_same_object(head, (4, '"0123456789abcdef-2"'))
+    assert handler.is_copy_of(s3, mock_dst_bucket.name, "copy", head)
+    assert not handler.is_copy_of(s3, mock_dst_bucket.name, "missing", head)
+
+
+def test_multihash_checksum():
+    sha256 = hashlib.sha256(b"data")
+    assert (
+        handler.multihash_checksum(
+            {
+                "ETag": '"abc-2"',
+                "ChecksumSHA256": base64.b64encode(sha256.digest()).decode(),
+            }
+        )
+        == "1220" + sha256.hexdigest()
+    )
+    md5 = hashlib.md5(b"data").hexdigest()
+    assert handler.multihash_checksum({"ETag": f'"{md5}"'}) == "d50110" + md5
+    assert handler.multihash_checksum({"ETag": '"abc-2"'}) is None
+    assert (
+        handler.multihash_checksum(
+            {"ETag": f'"{md5}"', "ServerSideEncryption": "aws:kms"}
+        )
+        is None
+    )
@@ -0,0 +1,39 @@
+import os
+
+import boto3
+import pytest
+from moto import mock_sqs
+
+
+@pytest.fixture
+def aws_credentials():
+    """Mocked AWS Credentials for moto."""
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ["AWS_SECURITY_TOKEN"] = "testing"
+    os.environ["AWS_SESSION_TOKEN"] = "testing"
+    os.environ["AWS_DEFAULT_REGION"] = "us-east-1"
+
+
+@pytest.fixture
+def queue_url(aws_credentials):
+    import handler
+
+    with mock_sqs():
+        handler._client = None
+        yield boto3.client("sqs").create_queue(QueueName="test-queue")["QueueUrl"]
+        handler._client = None
+
+
+@pytest.fixture
+def receive_all(queue_url):
+    def receive():
+        client = boto3.client("sqs")
+        bodies = []
+        while messages := client.receive_message(
+            QueueUrl=queue_url, MaxNumberOfMessages=10
+        ).get("Messages"):
+            bodies.extend(message["Body"] for message in messages)
+        return bodies
+
+    return receive
@@ -0,0 +1,139 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+# SendMessageBatch limits
+BATCH_ENTRIES = 10
+MAX_BATCH_BYTES = 256 * 1024
+# Left for the list brackets and separators
+MAX_MESSAGE_BYTES = MAX_BATCH_BYTES - 1024
+WORKERS = int(os.environ.get("ENQUEUE_WORKERS", 16))
+MAX_ATTEMPTS = 5
+# Step Functions keeps up to 32KB of an error's cause
+MAX_ERROR_CHARS = 16 * 1024
+
+_client = None
+
+
+class UnsentMessagesError(Exception):
+    """Raised with the messages that couldn't be sent, after the others were"""
+
+
+def sqs_client():
+    global _client
+    if _client is None:
+        _client = boto3.client(
+            "sqs",
+            config=Config(max_pool_connections=WORKERS, retries={"mode": "adaptive"}),
+        )
+    return _client
+
+
+def pack(objects: List[Dict[str, Any]], objects_per_message: int) -> List[str]:
+    """
+    Serializes the objects into message bodies. With objects_per_message > 1,
+    bodies are JSON lists of up to that many objects, within the SQS size limit.
+    """
+    if objects_per_message <= 1:
+        return [json.dumps(obj) for obj in objects]
+    bodies, current, current_bytes = [], [], 2
+    for obj in objects:
+        body = json.dumps(obj)
+        size = len(body.encode("utf8")) + 2
+        if current and (
+            len(current) == objects_per_message
+            or current_bytes + size > MAX_MESSAGE_BYTES
+        ):
+            bodies.append(f"[{', '.join(current)}]")
+            current, current_bytes = [], 2
+        current.append(body)
+        current_bytes += size
+    if current:
+        bodies.append(f"[{', '.join(current)}]")
+    return bodies
+
+
+def batches(bodies: List[str]) -> List[List[str]]:
+    """Groups message bodies into SendMessageBatch calls of at most 10 entries and 256KB"""
+    groups, current, current_bytes = [], [], 0
+    for body in bodies:
+        size = len(body.encode("utf8"))
+        if size > MAX_BATCH_BYTES:
+            raise ValueError(f"Message of {size} bytes exceeds the SQS limit")
+        if current and (
+            len(current) == BATCH_ENTRIES or current_bytes + size > MAX_BATCH_BYTES
+        ):
+            groups.append(current)
+            current, current_bytes = [], 0
+        current.append(body)
+        current_bytes += size
+    if current:
+        groups.append(current)
+    return groups
+
+
+def send_batch(queue_url: str, bodies: List[str]) -> List[str]:
+    """
+    Sends a batch, resending the entries SQS reports as failed, and returns the
+    bodies that couldn't be sent: rejected as invalid, or still failing after
+    MAX_ATTEMPTS
+    """
+    entries = [{"Id": str(i), "MessageBody": body} for i, body in enumerate(bodies)]
+    rejected = []
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            response = sqs_client().send_message_batch(
+                QueueUrl=queue_url, Entries=entries
+            )
+            failed = response.get("Failed", [])
+        except (BotoCoreError, ClientError) as e:
+            print(f"Failed to send {len(entries)} messages: {e!r}")
+            failed = [{"Id": entry["Id"], "SenderFault": False} for entry in entries]
+        if failed:
+            print(f"Failed to enqueue {len(failed)} messages: {failed}")
+        faults = {f["Id"] for f in failed if f["SenderFault"]}
+        retried = {f["Id"] for f in failed} - faults
+        rejected += [entry for entry in entries if entry["Id"] in faults]
+        entries = [entry for entry in entries if entry["Id"] in retried]
+        if not entries:
+            break
+        if attempt + 1 < MAX_ATTEMPTS:
+            time.sleep(0.1 * 2**attempt)
+    return [entry["MessageBody"] for entry in rejected + entries]
+
+
+def handler(event, context):
+    """
+    Enqueues the discovered (or cogified) file objects with SendMessageBatch calls
+    in parallel, instead of one SqsSendMessage state per object.
+
+    Every batch is attempted. Messages that couldn't be sent are raised together,
+    after the others were sent, so the state machine shouldn't retry the
+    invocation, which would send them all again.
+
+    Event: {"queue_url": ..., "objects": [...], "objects_per_message": 1}
+    """
+    queue_url = event["queue_url"]
+    bodies = pack(event.get("objects", []), int(event.get("objects_per_message", 1)))
+    groups = batches(bodies)
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        unsent = [
+            body
+            for unsent_bodies in executor.map(
+                lambda group: send_batch(queue_url, group), groups
+            )
+            for body in unsent_bodies
+        ]
+    if unsent:
+        raise UnsentMessagesError(
+            f"{len(unsent)} of {len(bodies)} messages were not sent: "
+            + json.dumps(unsent)[:MAX_ERROR_CHARS]
+        )
+    print(f"Sent {len(event.get('objects', []))} objects in {len(bodies)} messages")
+    return {"messages": len(bodies)}
@@ -0,0 +1,107 @@
+import json
+from unittest.mock import patch
+
+import pytest
+
+import handler
+
+
+def file_objects(count, padding=0):
+    return [
+        {
+            "collection": "test_collection",
+            "remote_fileurl": f"s3://bucket/file-{i}.tif",
+            "padding": "x" * padding,
+        }
+        for i in range(count)
+    ]
+
+
+def test_handler(queue_url, receive_all):
+    objects = file_objects(25)
+
+    with patch.object(
+        handler.sqs_client(),
+        "send_message_batch",
+        wraps=handler.sqs_client().send_message_batch,
+    ) as send_message_batch:
+        response = handler.handler({"queue_url": queue_url, "objects": objects}, None)
+
+    assert response == {"messages": 25}
+    assert send_message_batch.call_count == 3
+    assert sorted(map(json.loads, receive_all()), key=str) == sorted(objects, key=str)
+
+
+def test_packed_messages(queue_url, receive_all):
+    objects = file_objects(25)
+
+    response = handler.handler(
+        {"queue_url": queue_url, "objects": objects, "objects_per_message": 10},
+        None,
+    )
+
+    assert response == {"messages": 3}
+    received = [json.loads(body) for body in receive_all()]
+    assert sorted(map(len, received)) == [5, 10, 10]
+    assert sorted(sum(received, []), key=str) == sorted(objects, key=str)
+
+
+def test_pack_respects_size_limit():
+    objects = file_objects(10, padding=100 * 1024)
+
+    bodies = handler.pack(objects, objects_per_message=10)
+
+    assert len(bodies) == 5
+    assert all(len(body) <= handler.MAX_BATCH_BYTES for body in bodies)
+    assert all(len(batch) == 1 for batch in handler.batches(bodies))
+
+
+def test_resends_failed_entries(queue_url):
+    client = handler.sqs_client()
+    responses = [
+        {"Failed": [{"Id": "1", "SenderFault": False, "Code": "InternalError"}]},
+        {"Successful": []},
+    ]
+    with patch.object(client, "send_message_batch", side_effect=responses) as send:
+        handler.send_batch(queue_url, ["a", "b"])
+
+    assert send.call_args_list[1].kwargs["Entries"] == [{"Id": "1", "MessageBody": "b"}]
+
+
+def test_sender_faults_are_not_resent(queue_url):
+    client = handler.sqs_client()
+    failure = {
+        "Failed": [
+            {"Id": "0", "SenderFault": True, "Code": "Invalid"},
+            {"Id": "1", "SenderFault": False, "Code": "InternalError"},
+        ]
+    }
+    with patch.object(
+        client, "send_message_batch", side_effect=[failure, {"Successful": []}]
+    ) as send:
+        assert handler.send_batch(queue_url, ["a", "b", "c"]) == ["a"]
+
+    assert send.call_args_list[1].kwargs["Entries"] == [{"Id": "1", "MessageBody": "b"}]
+
+
+def test_only_unsent_messages_are_raised(queue_url, receive_all):
+    objects = file_objects(25)
+    client = handler.sqs_client()
+    send_message_batch = client.send_message_batch
+
+    def fail_second_batch(QueueUrl, Entries):
+        if json.loads(Entries[0]["MessageBody"]) == objects[10]:
+            raise client.exceptions.ClientError(
+                {"Error": {"Code": "InternalError"}}, "SendMessageBatch"
+            )
+        return send_message_batch(QueueUrl=QueueUrl, Entries=Entries)
+
+    with patch.object(
+        client, "send_message_batch", side_effect=fail_second_batch
+    ), patch("handler.time.sleep"):
+        with pytest.raises(handler.UnsentMessagesError, match="10 of 25 messages"):
+            handler.handler({"queue_url": queue_url, "objects": objects}, None)
+
+    # The other batches were sent once
+    received = sorted(map(json.loads, receive_all()), key=str)
+    assert received == sorted(objects[:10] + objects[20:], key=str)
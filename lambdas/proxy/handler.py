@@ -1,12 +1,15 @@
 from collections import defaultdict
+import hashlib
 import os
 import json
 import re
 import boto3
 
-from uuid import uuid4
-
 INVALID_NAME_CHARS = re.compile("[^a-zA-Z0-9_-]")
+# Step Functions execution input limit, less a margin
+MAX_INPUT_BYTES = int(os.environ.get("MAX_INPUT_BYTES", 256 * 1024 - 1024))
+# Objects per execution, 0 for no limit other than the input size
+MAX_OBJECTS_PER_EXECUTION = int(os.environ.get("MAX_OBJECTS_PER_EXECUTION", 0))
 
 
 def filter_sfname(name):
@@ -15,23 +18,103 @@ def filter_sfname(name):
     return re.sub(INVALID_NAME_CHARS, "", name)
 
 
-def group_by_collection(records):
+def group_by_collection(messages):
+    """
+    Groups (message ID, file objects) pairs by the collection of their first
+    object. Messages aren't split across collections, so that each one is started
+    in a single execution.
+    """
     collections = defaultdict(list)
-    for record in records:
-        collections[record.get("collection", None)].append(record)
+    for message_id, objects in messages:
+        if objects:
+            collections[objects[0].get("collection", None)].append(
+                (message_id, objects)
+            )
     return collections
 
 
+def unpack(records, failed_messages):
+    """
+    Yields (message ID, file objects) for every message, which holds one file
+    object, or a list of them when packed by the enqueue lambda.
+    Messages that aren't JSON objects or lists of them are added to failed_messages.
+    """
+    for record in records:
+        try:
+            body = json.loads(record["body"])
+        except ValueError as e:
+            print(f"Invalid message {record['messageId']}: {e!r}")
+            failed_messages.add(record["messageId"])
+            continue
+        objects = body if isinstance(body, list) else [body]
+        if not all(isinstance(obj, dict) for obj in objects):
+            print(f"Invalid message {record['messageId']}: not file objects")
+            failed_messages.add(record["messageId"])
+            continue
+        yield record["messageId"], objects
+
+
+def coalesce(
+    messages, max_bytes=MAX_INPUT_BYTES, max_objects=MAX_OBJECTS_PER_EXECUTION
+):
+    """
+    Splits (message ID, file objects) pairs into execution inputs as large as
+    the input size and object limits allow, keeping the order of the objects.
+    The objects of a message are never split, so a message that exceeds the
+    limits on its own gets an execution of its own.
+    """
+    chunks, current, current_bytes, current_objects = [], [], 2, 0
+    for message_id, objects in messages:
+        size = sum(len(json.dumps(obj).encode("utf8")) + 2 for obj in objects)
+        if current and (
+            current_bytes + size > max_bytes
+            or (max_objects and current_objects + len(objects) > max_objects)
+        ):
+            chunks.append(current)
+            current, current_bytes, current_objects = [], 2, 0
+        current.append((message_id, objects))
+        current_bytes += size
+        current_objects += len(objects)
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def execution_name(collection, chunk):
+    """
+    Names the execution after the collection and the messages it holds, so
+    redelivered messages start the same execution again and Step Functions
+    deduplicates it
+    """
+    digest = hashlib.sha256(json.dumps(chunk).encode("utf8")).hexdigest()
+    return f"{filter_sfname(collection)[:40]}-{digest[:32]}"
+
+
 def handler(event, context):
     STEP_FUNCTION_ARN = os.environ["STEP_FUNCTION_ARN"]
-    step_function_input = (json.loads(record["body"]) for record in event["Records"])
-
     client = boto3.client("stepfunctions")
-    for collection, records in group_by_collection(step_function_input).items():
-        name = filter_sfname(collection)
-        client.start_execution(
-            name=f"{name[:40]}-{str(uuid4())}",
-            stateMachineArn=STEP_FUNCTION_ARN,
-            input=json.dumps(records),
-        )
-    return
+    failed_messages = set()
+    collections = group_by_collection(unpack(event["Records"], failed_messages))
+    for collection, messages in collections.items():
+        for chunk in coalesce(messages):
+            objects = [obj for _, message_objects in chunk for obj in message_objects]
+            try:
+                client.start_execution(
+                    name=execution_name(collection, chunk),
+                    stateMachineArn=STEP_FUNCTION_ARN,
+                    input=json.dumps(objects),
+                )
+            except client.exceptions.ExecutionAlreadyExists:
+                # Already started by an earlier delivery of the same messages
+                print(f"Execution for {len(objects)} objects already exists")
+            except Exception as e:
+                print(f"Failed to start execution for {len(objects)} objects: {e!r}")
+                failed_messages.update(message_id for message_id, _ in chunk)
+
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": record["messageId"]}
+            for record in event["Records"]
+            if record["messageId"] in failed_messages
+        ]
+    }
@@ -0,0 +1,145 @@
+import json
+import os
+from unittest import mock
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+
+import handler
+
+STEP_FUNCTION_ARN = "arn:aws:states:us-east-1:123456789012:stateMachine:test"
+
+
+def record(message_id, body):
+    return {"messageId": message_id, "body": json.dumps(body)}
+
+
+def file_object(collection, i):
+    return {"collection": collection, "remote_fileurl": f"s3://bucket/{i}.tif"}
+
+
+@pytest.fixture
+def stepfunctions():
+    client = boto3.client("stepfunctions", region_name="us-east-1")
+    with mock.patch.dict(
+        os.environ, {"STEP_FUNCTION_ARN": STEP_FUNCTION_ARN}
+    ), mock.patch.object(client, "start_execution") as start_execution, mock.patch(
+        "handler.boto3.client", return_value=client
+    ):
+        yield start_execution
+
+
+def test_coalesces_records_by_collection(stepfunctions):
+    event = {
+        "Records": [
+            record("1", file_object("a", 1)),
+            record("2", file_object("b", 2)),
+            record("3", file_object("a", 3)),
+        ]
+    }
+
+    assert handler.handler(event, None) == {"batchItemFailures": []}
+
+    inputs = [json.loads(call.kwargs["input"]) for call in stepfunctions.call_args_list]
+    assert inputs == [
+        [file_object("a", 1), file_object("a", 3)],
+        [file_object("b", 2)],
+    ]
+
+
+def test_packed_messages_are_not_split(stepfunctions):
+    """
+    Ensure that every message is started in a single execution, even when its
+    objects span collections
+    """
+    event = {
+        "Records": [
+            record("1", [file_object("a", 1), file_object("b", 2)]),
+            record("2", [file_object("b", i) for i in range(3, 6)]),
+            record("3", [file_object("a", 6)]),
+        ]
+    }
+
+    assert handler.handler(event, None) == {"batchItemFailures": []}
+
+    inputs = [json.loads(call.kwargs["input"]) for call in stepfunctions.call_args_list]
+    assert inputs == [
+        [file_object("a", 1), file_object("b", 2), file_object("a", 6)],
+        [file_object("b", i) for i in range(3, 6)],
+    ]
+
+
+def test_coalesce_limits():
+    messages = [(str(i), [file_object("a", i)]) for i in range(10)]
+    size = len(json.dumps(messages[0][1][0])) + 2
+
+    assert [len(c) for c in handler.coalesce(messages, 2 + 4 * size, 0)] == [4, 4, 2]
+    assert [len(c) for c in handler.coalesce(messages, 10**6, 3)] == [3, 3, 3, 1]
+
+    packed = [
+        ("1", [file_object("a", 1)]),
+        ("2", [file_object("a", i) for i in range(5)]),
+    ]
+    assert [len(c) for c in handler.coalesce(packed, 10**6, 3)] == [1, 1]
+
+
+def test_reports_failed_records(stepfunctions):
+    def start_execution(name, stateMachineArn, input):
+        if json.loads(input)[0]["collection"] == "b":
+            raise ClientError({"Error": {"Code": "ThrottlingException"}}, "Start")
+
+    stepfunctions.side_effect = start_execution
+    event = {
+        "Records": [
+            record("1", file_object("a", 1)),
+            record("2", file_object("b", 2)),
+            {"messageId": "3", "body": "not json"},
+        ]
+    }
+
+    assert handler.handler(event, None) == {
+        "batchItemFailures": [{"itemIdentifier": "2"}, {"itemIdentifier": "3"}]
+    }
+
+
+def test_records_that_are_not_file_objects_fail_alone(stepfunctions):
+    event = {
+        "Records": [
+            record("1", file_object("a", 1)),
+            record("2", "x"),
+            record("3", 5),
+            record("4", [file_object("a", 2), None]),
+        ]
+    }
+
+    assert handler.handler(event, None) == {
+        "batchItemFailures": [
+            {"itemIdentifier": "2"},
+            {"itemIdentifier": "3"},
+            {"itemIdentifier": "4"},
+        ]
+    }
+    (call,) = stepfunctions.call_args_list
+    assert json.loads(call.kwargs["input"]) == [file_object("a", 1)]
+
+
+def test_redelivered_records_reuse_execution_names(stepfunctions):
+    event = {"Records": [record("1", file_object("a", 1))]}
+
+    handler.handler(event, None)
+    handler.handler(event, None)
+
+    first, second = stepfunctions.call_args_list
+    assert first.kwargs["name"] == second.kwargs["name"]
+    assert len(first.kwargs["name"]) <= 80
+
+
+def test_existing_execution_is_not_a_failure(stepfunctions):
+    client = handler.boto3.client("stepfunctions")
+    stepfunctions.side_effect = client.exceptions.ExecutionAlreadyExists(
+        {"Error": {"Code": "ExecutionAlreadyExists"}}, "StartExecution"
+    )
+    event = {"Records": [record("1", file_object("a", 1))]}
+
+    assert handler.handler(event, None) == {"batchItemFailures": []}
@@ -0,0 +1,69 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from rasterio.errors import RasterioIOError
+
+import build_stac
+import submit_stac
+from ingestor import BatchOutput, ItemFailure
+
+BUILD_WORKERS = int(os.environ.get("BUILD_WORKERS", 8))
+# Reads of freshly transferred files can fail transiently
+BUILD_ATTEMPTS = 5
+# Seconds before the first retry, doubled after every attempt
+BUILD_RETRY_DELAY = 1
+
+
+def item_id(event: Dict[str, Any]) -> str:
+    return event.get("id") or event.get("granule_id") or event.get("remote_fileurl")
+
+
+def build(
+    event: Dict[str, Any],
+) -> Tuple[Optional[Dict[str, Any]], Optional[ItemFailure]]:
+    """Builds the STAC item of a file object, returning the failure instead of raising"""
+    for attempt in range(BUILD_ATTEMPTS):
+        try:
+            return build_stac.build_stac_item(event), None
+        except RasterioIOError as e:
+            if attempt + 1 == BUILD_ATTEMPTS:
+                return None, {"id": item_id(event), "error": repr(e)}
+            time.sleep(BUILD_RETRY_DELAY * 2**attempt)
+        except Exception as e:
+            return None, {"id": item_id(event), "error": repr(e)}
+
+
+def handler(event: Union[List[Dict[str, Any]], Dict[str, Any]], context) -> BatchOutput:
+    """
+    Builds the STAC items of a batch of file objects and submits them to the
+    ingestor in the same invocation, so items never pass through the state
+    payload or S3. Only the IDs of the items and the failures are returned.
+
+    Event: {"objects": [...], "build_workers": 8, "dry_run": false}, or the list
+    of file objects
+    """
+    if isinstance(event, list):
+        event = {"objects": event}
+    workers = int(event.get("build_workers") or BUILD_WORKERS)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(build, event["objects"]))
+    stac_items = [stac_item for stac_item, _ in results if stac_item]
+    failed = [failure for _, failure in results if failure]
+
+    if event.get("dry_run"):
+        print(f"Dry run, not inserting, would have inserted {len(stac_items)} items")
+        output: BatchOutput = {"succeeded": [], "failed": []}
+    elif stac_items:
+        output = submit_stac.ingestor.submit_many(stac_items)
+    else:
+        output = {"succeeded": [], "failed": []}
+
+    output["failed"] = failed + output["failed"]
+    print(
+        f"Published {len(output['succeeded'])} STAC items, "
+        f"{len(output['failed'])} failed"
+    )
+    return output
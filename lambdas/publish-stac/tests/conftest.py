@@ -0,0 +1,21 @@
+import importlib.util
+import os
+import sys
+from pathlib import Path
+
+LAMBDAS_DIR = Path(__file__).parents[2]
+
+# The image copies the build-stac and submit-stac handlers next to this one,
+# load them from their directories when testing from the repository
+os.environ.setdefault("COGNITO_APP_SECRET", "test-secret")
+os.environ.setdefault("STAC_INGESTOR_API_URL", "http://test")
+if importlib.util.find_spec("build_stac") is None:
+    sys.path.extend([str(LAMBDAS_DIR / "build-stac"), str(LAMBDAS_DIR / "submit-stac")])
+    for name, path in (
+        ("build_stac", LAMBDAS_DIR / "build-stac" / "handler.py"),
+        ("submit_stac", LAMBDAS_DIR / "submit-stac" / "handler.py"),
+    ):
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
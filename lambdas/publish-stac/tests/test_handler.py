@@ -0,0 +1,88 @@
+from unittest.mock import patch
+
+from rasterio.errors import RasterioIOError
+
+import handler
+
+EVENTS = [
+    {"collection": "test-collection", "remote_fileurl": f"s3://bucket/{i}.tif"}
+    for i in range(3)
+]
+
+
+def build_item(event):
+    if event["remote_fileurl"].endswith("1.tif"):
+        raise ValueError("No datetime found")
+    return {"id": event["remote_fileurl"], "collection": event["collection"]}
+
+
+def submit_many(stac_items):
+    return {"succeeded": [item["id"] for item in stac_items], "failed": []}
+
+
+def test_handler_builds_and_submits():
+    with patch.object(
+        handler.build_stac, "build_stac_item", side_effect=build_item
+    ), patch.object(
+        handler.submit_stac.ingestor, "submit_many", side_effect=submit_many
+    ) as submitted:
+        output = handler.handler({"objects": EVENTS}, None)
+
+    submitted.assert_called_once()
+    assert output["succeeded"] == ["s3://bucket/0.tif", "s3://bucket/2.tif"]
+    assert output["failed"] == [
+        {"id": "s3://bucket/1.tif", "error": "ValueError('No datetime found')"}
+    ]
+
+
+def test_handler_accepts_list_and_retries_reads():
+    calls = []
+
+    def flaky_build(event):
+        calls.append(event)
+        if len(calls) == 1:
+            raise RasterioIOError("Read failed")
+        return {"id": "item"}
+
+    with patch.object(
+        handler.build_stac, "build_stac_item", side_effect=flaky_build
+    ), patch.object(
+        handler.submit_stac.ingestor, "submit_many", side_effect=submit_many
+    ), patch.object(
+        handler.time, "sleep"
+    ) as sleep:
+        output = handler.handler(EVENTS[:1], None)
+
+    assert len(calls) == 2
+    sleep.assert_called_once_with(handler.BUILD_RETRY_DELAY)
+    assert output == {"succeeded": ["item"], "failed": []}
+
+
+def test_dry_run_does_not_submit():
+    with patch.object(
+        handler.build_stac, "build_stac_item", side_effect=build_item
+    ), patch.object(handler.submit_stac.ingestor, "submit_many") as submitted:
+        output = handler.handler({"objects": EVENTS, "dry_run": True}, None)
+
+    submitted.assert_not_called()
+    assert output["succeeded"] == []
+    assert len(output["failed"]) == 1
+
+
+def test_build_backs_off_until_the_last_attempt():
+    with patch.object(
+        handler.build_stac,
+        "build_stac_item",
+        side_effect=RasterioIOError("Read failed"),
+    ), patch.object(handler.time, "sleep") as sleep:
+        stac_item, failure = handler.build(EVENTS[0])
+
+    assert stac_item is None
+    assert failure == {
+        "id": "s3://bucket/0.tif",
+        "error": "RasterioIOError('Read failed')",
+    }
+    assert [call.args[0] for call in sleep.call_args_list] == [
+        handler.BUILD_RETRY_DELAY * 2**attempt
+        for attempt in range(handler.BUILD_ATTEMPTS - 1)
+    ]
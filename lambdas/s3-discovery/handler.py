@@ -72,6 +72,10 @@ def handler(event, context):
                 "properties": properties,
                 **date_fields,
             }
+            if file_obj["upload"]:
+                # Lets data-transfer skip unchanged objects without a HEAD request
+                file_obj["source_size"] = obj["Size"]
+                file_obj["source_etag"] = obj["ETag"]
             payload["objects"].append(file_obj)
             file_obj_size = len(json.dumps(file_obj, ensure_ascii=False).encode("utf8"))
             file_objs_size = file_objs_size + file_obj_size
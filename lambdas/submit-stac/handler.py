@@ -1,15 +1,31 @@
-from dataclasses import dataclass
+import asyncio
+from dataclasses import dataclass, field
+import gzip
+import io
 import json
 import os
 from urllib.parse import urlparse
-from typing import Any, Dict, Optional, TypedDict, Union
+from typing import IO, Any, Dict, Iterator, List, Optional, TypedDict, Union
 
 import boto3
 import requests
+from requests.adapters import HTTPAdapter
 
+from ingestor import AdaptiveIngestionClient, BatchOutput
+from tokens import TokenManager
 
 COGNITO_APP_SECRET = os.environ["COGNITO_APP_SECRET"]
 STAC_INGESTOR_API_URL = os.environ["STAC_INGESTOR_API_URL"]
+# Path of the ingestor's bulk endpoint, items are submitted one by one when unset
+STAC_INGESTOR_BULK_PATH = os.environ.get("STAC_INGESTOR_BULK_PATH")
+BULK_SIZE = int(os.environ.get("BULK_SIZE", 100))
+MAX_CONCURRENCY = int(os.environ.get("MAX_CONCURRENCY", 32))
+# Step Functions keeps up to 32KB of an error's cause
+MAX_ERROR_CHARS = 16 * 1024
+
+
+class FailedItemsError(Exception):
+    """Raised with the items the ingestor rejected, after the others were submitted"""
 
 
 class InputBase(TypedDict):
@@ -24,65 +40,51 @@ class StacItemInput(InputBase):
     stac_item: Dict[str, Any]
 
 
-class AppConfig(TypedDict):
-    cognito_domain: str
-    client_id: str
-    client_secret: str
-    scope: str
+class StacItemsInput(InputBase):
+    stac_items: List[Dict[str, Any]]
 
 
-class Creds(TypedDict):
-    access_token: str
-    expires_in: int
-    token_type: str
+def pooled_session(pool_size: int = 10) -> requests.Session:
+    """
+    Session keeping up to `pool_size` keep-alive connections to the ingestor
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
 
 @dataclass
 class IngestionApi:
     base_url: str
-    token: str
+    tokens: TokenManager
+    bulk_path: Optional[str] = None
+    session: requests.Session = field(default_factory=pooled_session, repr=False)
 
     @classmethod
-    def from_veda_auth_secret(cls, *, secret_id: str, base_url: str) -> "IngestionApi":
-        cognito_details = cls._get_cognito_service_details(secret_id)
-        credentials = cls._get_app_credentials(**cognito_details)
-        return cls(token=credentials["access_token"], base_url=base_url)
-
-    @staticmethod
-    def _get_cognito_service_details(secret_id: str) -> AppConfig:
-        client = boto3.client("secretsmanager")
-        response = client.get_secret_value(SecretId=secret_id)
-        return json.loads(response["SecretString"])
-
-    @staticmethod
-    def _get_app_credentials(
-        cognito_domain: str, client_id: str, client_secret: str, scope: str, **kwargs
-    ) -> Creds:
-        response = requests.post(
-            f"{cognito_domain}/oauth2/token",
-            headers={
-                "Content-Type": "application/x-www-form-urlencoded",
-            },
-            auth=(client_id, client_secret),
-            data={
-                "grant_type": "client_credentials",
-                # A space-separated list of scopes to request for the generated access token.
-                "scope": scope,
-            },
+    def from_veda_auth_secret(
+        cls, *, secret_id: str, base_url: str, **kwargs
+    ) -> "IngestionApi":
+        return cls(
+            tokens=TokenManager(secret_id=secret_id), base_url=base_url, **kwargs
         )
-        try:
-            response.raise_for_status()
-        except:
-            print(response.text)
-            raise
-        return response.json()
 
-    def submit(self, stac_item: Dict[str, Any]):
-        response = requests.post(
-            f"{self.base_url.rstrip('/')}/ingestions",
-            json=stac_item,
-            headers={"Authorization": f"bearer {self.token}"},
+    @property
+    def token(self) -> str:
+        return self.tokens.get_token()
+
+    def _post(self, path: str, body: Any):
+        url = f"{self.base_url.rstrip('/')}/{path.lstrip('/')}"
+        response = self.session.post(
+            url, json=body, headers={"Authorization": f"bearer {self.token}"}
         )
+        if response.status_code == 401:
+            # The token was revoked or expired early, retry once with a new one
+            self.tokens.invalidate()
+            response = self.session.post(
+                url, json=body, headers={"Authorization": f"bearer {self.token}"}
+            )
 
         try:
             response.raise_for_status()
@@ -92,30 +94,100 @@ class IngestionApi:
 
         return response.json()
 
+    def submit(self, stac_item: Dict[str, Any]):
+        return self._post("/ingestions", stac_item)
+
+    def submit_many(self, stac_items: List[Dict[str, Any]]) -> BatchOutput:
+        """
+        Submits many STAC items concurrently, adapting the concurrency to the
+        ingestor's response times and throttling.
+        Failures are reported per item instead of raised.
+        """
+        client = AdaptiveIngestionClient(
+            base_url=self.base_url,
+            token=self.tokens.get_token,
+            on_unauthorized=self.tokens.invalidate,
+            bulk_path=self.bulk_path,
+            bulk_size=BULK_SIZE,
+            max_concurrency=MAX_CONCURRENCY,
+        )
+        return asyncio.run(client.submit_many(stac_items))
+
+
+def _open_s3_file(file_url: str) -> IO[bytes]:
+    url = urlparse(file_url)
+
+    response = boto3.client("s3").get_object(
+        Bucket=url.hostname,
+        Key=url.path.lstrip("/"),
+    )
+    if url.path.endswith(".gz") or response.get("ContentEncoding") == "gzip":
+        # Spilled items are gzip-compressed, decompress while streaming
+        return gzip.GzipFile(fileobj=response["Body"])
+    return response["Body"]
+
+
+def _is_manifest(file_url: Optional[str]) -> bool:
+    return bool(file_url) and file_url.endswith((".ndjson", ".ndjson.gz"))
+
 
 def get_stac_item(event: Dict[str, Any]) -> Dict[str, Any]:
     if stac_item := event.get("stac_item"):
         return stac_item
 
     if file_url := event.get("stac_file_url"):
-        url = urlparse(file_url)
-
-        response = boto3.client("s3").get_object(
-            Bucket=url.hostname,
-            Key=url.path.lstrip("/"),
-        )
-        return json.load(response["Body"])
+        with _open_s3_file(file_url) as body:
+            return json.load(body)
 
     raise Exception("No stac_item or stac_file_url provided")
 
 
+def get_stac_items(event: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Yields the STAC items of a list input or of an NDJSON manifest on S3
+    """
+    if "stac_items" in event:
+        yield from event["stac_items"]
+        return
+
+    with _open_s3_file(event["stac_file_url"]) as body:
+        for line in io.TextIOWrapper(body, encoding="utf8"):
+            if line.strip():
+                yield json.loads(line)
+
+
 ingestor = IngestionApi.from_veda_auth_secret(
     secret_id=COGNITO_APP_SECRET,
     base_url=STAC_INGESTOR_API_URL,
+    bulk_path=STAC_INGESTOR_BULK_PATH,
 )
 
 
-def handler(event: Union[S3LinkInput, StacItemInput], context) -> None:
+def handler(
+    event: Union[S3LinkInput, StacItemInput, StacItemsInput], context
+) -> Optional[BatchOutput]:
+    if "stac_items" in event or _is_manifest(event.get("stac_file_url")):
+        stac_items = list(get_stac_items(event))
+
+        if event.get("dry_run"):
+            print(
+                f"Dry run, not inserting, would have inserted {len(stac_items)} items"
+            )
+            return
+
+        output = ingestor.submit_many(stac_items)
+        print(
+            f"Submitted {len(output['succeeded'])} STAC items, "
+            f"{len(output['failed'])} failed"
+        )
+        if output["failed"]:
+            # Fail the state so callers don't see rejected items as a success
+            raise FailedItemsError(
+                f"{len(output['failed'])} of {len(stac_items)} items failed: "
+                + json.dumps(output["failed"])[:MAX_ERROR_CHARS]
+            )
+        return output
+
     stac_item = get_stac_item(event)
 
     if event.get("dry_run"):
@@ -0,0 +1,224 @@
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, List, Optional, TypedDict, Union
+
+import aiohttp
+
+# Responses that mean the ingestor is overloaded and the request can be retried
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class ItemFailure(TypedDict):
+    id: str
+    error: str
+
+
+class BatchOutput(TypedDict):
+    succeeded: List[str]
+    failed: List[ItemFailure]
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Returns the delay in seconds requested by a Retry-After header, which is either
+    a number of seconds or an HTTP date
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class AdaptiveLimiter:
+    """
+    Async concurrency limit following additive-increase/multiplicative-decrease:
+    the limit grows by about one per round of fast successful requests and is cut
+    by `decrease` whenever the ingestor throttles or fails.
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        minimum: int = 1,
+        maximum: int = 32,
+        fast_seconds: float = 2.0,
+        decrease: float = 0.5,
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.fast_seconds = fast_seconds
+        self.decrease = decrease
+        self.in_flight = 0
+        self.resume_at = 0.0
+        self.decreased_at = float("-inf")
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        # Hold off every request while the ingestor asked us to back off
+        if (delay := self.resume_at - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self, latency: float):
+        if latency <= self.fast_seconds:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_throttle(
+        self, started_at: Optional[float] = None, retry_after: Optional[float] = None
+    ):
+        """
+        Decreases the limit once per window of requests: throttles of requests
+        started before the last decrease were caused by the previous limit
+        """
+        if started_at is None or started_at >= self.decreased_at:
+            self.limit = max(self.minimum, self.limit * self.decrease)
+            self.decreased_at = time.monotonic()
+        if retry_after:
+            self.resume_at = max(self.resume_at, time.monotonic() + retry_after)
+
+
+@dataclass
+class AdaptiveIngestionClient:
+    """
+    Async STAC ingestor client that submits as fast as the ingestor allows,
+    adapting its concurrency to throttling and response times.
+    """
+
+    base_url: str
+    # Either a token or a function returning a current one
+    token: Union[str, Callable[[], str]]
+    # Called when the ingestor rejects the token, before retrying once
+    on_unauthorized: Optional[Callable[[], None]] = None
+    bulk_path: Optional[str] = None
+    bulk_size: int = 100
+    initial_concurrency: int = 4
+    max_concurrency: int = 32
+    max_attempts: int = 6
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    timeout: float = 60.0
+
+    async def _headers(self) -> Dict[str, str]:
+        if callable(self.token):
+            # Fetching a token blocks, keep it off the event loop
+            token = await asyncio.get_running_loop().run_in_executor(None, self.token)
+        else:
+            token = self.token
+        return {"Authorization": f"bearer {token}"}
+
+    def retry_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Delay before retrying, honoring Retry-After or using exponential backoff
+        with full jitter
+        """
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    async def _post(
+        self,
+        session: aiohttp.ClientSession,
+        limiter: AdaptiveLimiter,
+        path: str,
+        body: Any,
+    ) -> Optional[str]:
+        """
+        Posts the body, retrying throttled and failed requests.
+        Returns an error message if the request did not succeed.
+        """
+        url = f"{self.base_url.rstrip('/')}/{path.lstrip('/')}"
+        reauthorized = False
+        for attempt in range(self.max_attempts):
+            retry_after = None
+            headers = await self._headers()
+            async with limiter:
+                start = time.monotonic()
+                try:
+                    async with session.post(
+                        url, json=body, headers=headers
+                    ) as response:
+                        status = response.status
+                        error = f"{status}: {await response.text()}"
+                        retry_after = parse_retry_after(
+                            response.headers.get("Retry-After")
+                        )
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    status, error = None, repr(e)
+                latency = time.monotonic() - start
+
+            if status is not None and status < 300:
+                limiter.on_success(latency)
+                return None
+            if status == 401 and self.on_unauthorized and not reauthorized:
+                # The token was revoked or expired early, retry once with a new one
+                reauthorized = True
+                self.on_unauthorized()
+                continue
+            if status is not None and status not in RETRY_STATUSES:
+                return error
+
+            limiter.on_throttle(start, retry_after)
+            if attempt + 1 < self.max_attempts:
+                await asyncio.sleep(self.retry_delay(attempt, retry_after))
+
+        print(f"Giving up on {url} after {self.max_attempts} attempts: {error}")
+        return error
+
+    async def submit_many(self, stac_items: List[Dict[str, Any]]) -> BatchOutput:
+        """
+        Submits STAC items, in chunks to the bulk endpoint when one is configured
+        and one item per request otherwise. Failures are reported per item.
+        """
+        if self.bulk_path:
+            path = self.bulk_path
+            batches = [
+                stac_items[i : i + self.bulk_size]
+                for i in range(0, len(stac_items), self.bulk_size)
+            ]
+        else:
+            path = "/ingestions"
+            batches = [[stac_item] for stac_item in stac_items]
+
+        limiter = AdaptiveLimiter(
+            initial=self.initial_concurrency, maximum=self.max_concurrency
+        )
+        async with aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        ) as session:
+            errors = await asyncio.gather(
+                *(
+                    self._post(
+                        session, limiter, path, batch if self.bulk_path else batch[0]
+                    )
+                    for batch in batches
+                )
+            )
+
+        output: BatchOutput = {"succeeded": [], "failed": []}
+        for batch, error in zip(batches, errors):
+            for stac_item in batch:
+                if error:
+                    output["failed"].append({"id": stac_item.get("id"), "error": error})
+                else:
+                    output["succeeded"].append(stac_item.get("id"))
+        return output
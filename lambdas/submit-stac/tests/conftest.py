@@ -0,0 +1,91 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional, Tuple
+from unittest import mock
+
+import pytest
+
+# Takes the request body and returns the status code and headers of the response
+Responder = Callable[[dict], Tuple[int, dict]]
+
+
+class StubIngestor(ThreadingHTTPServer):
+    """
+    Local stand-in for the STAC ingestor, recording requests and concurrency
+    """
+
+    daemon_threads = True
+
+    def __init__(self, responder: Responder):
+        super().__init__(("127.0.0.1", 0), StubIngestorHandler)
+        self.responder = responder
+        self.requests: List[dict] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class StubIngestorHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server: StubIngestor = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.requests.append(body)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            status, headers = server.responder(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+        content = b"{}"
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_ingestor():
+    servers: List[StubIngestor] = []
+
+    def start(responder: Optional[Responder] = None) -> StubIngestor:
+        server = StubIngestor(responder or (lambda body: (201, {})))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def handler_module():
+    """
+    Imports the handler, which reads its configuration from the environment
+    """
+    with mock.patch.dict(
+        os.environ,
+        {"COGNITO_APP_SECRET": "test-secret", "STAC_INGESTOR_API_URL": "http://test"},
+    ):
+        import handler
+
+        yield handler
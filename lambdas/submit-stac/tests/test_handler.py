@@ -0,0 +1,24 @@
+from unittest import mock
+
+import pytest
+
+
+def test_batch_failures_are_raised(handler_module):
+    output = {"succeeded": ["item-1"], "failed": [{"id": "item-2", "error": "409"}]}
+    with mock.patch.object(
+        handler_module.ingestor, "submit_many", return_value=output
+    ) as submit_many:
+        with pytest.raises(handler_module.FailedItemsError, match="item-2"):
+            handler_module.handler(
+                {"stac_items": [{"id": "item-1"}, {"id": "item-2"}]}, None
+            )
+
+    submit_many.assert_called_once()
+
+
+def test_batch_output_is_returned(handler_module):
+    output = {"succeeded": ["item-1"], "failed": []}
+    with mock.patch.object(handler_module.ingestor, "submit_many", return_value=output):
+        assert (
+            handler_module.handler({"stac_items": [{"id": "item-1"}]}, None) == output
+        )
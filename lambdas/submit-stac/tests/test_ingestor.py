@@ -0,0 +1,195 @@
+import asyncio
+import itertools
+import threading
+import time
+
+import pytest
+from ingestor import AdaptiveIngestionClient, AdaptiveLimiter, parse_retry_after
+
+
+def client(url: str, **kwargs) -> AdaptiveIngestionClient:
+    return AdaptiveIngestionClient(
+        base_url=url, token="token", base_delay=0.01, **kwargs
+    )
+
+
+def test_submit_many(stub_ingestor):
+    """
+    Ensure that items are submitted individually with per-item failure reporting.
+    """
+    server = stub_ingestor(lambda body: (400 if body["id"] == "bad" else 201, {}))
+    items = [{"id": f"item-{i}"} for i in range(20)] + [{"id": "bad"}]
+
+    output = asyncio.run(client(server.url).submit_many(items))
+
+    assert output["succeeded"] == [f"item-{i}" for i in range(20)]
+    assert [failure["id"] for failure in output["failed"]] == ["bad"]
+    # Client errors are not retried
+    assert len(server.requests) == 21
+
+
+def test_token_is_fetched_off_the_event_loop(stub_ingestor):
+    """
+    Ensure that a blocking token function doesn't run on the event loop thread.
+    """
+    server = stub_ingestor()
+    threads = []
+
+    def token():
+        threads.append(threading.current_thread())
+        return "token"
+
+    output = asyncio.run(
+        AdaptiveIngestionClient(base_url=server.url, token=token).submit_many(
+            [{"id": "item"}]
+        )
+    )
+
+    assert output["succeeded"] == ["item"]
+    assert threads and threading.main_thread() not in threads
+
+
+def test_unauthorized_refreshes_token_once(stub_ingestor):
+    """
+    Ensure that a rejected token is invalidated and the request retried once.
+    """
+    responses = iter([401, 201, 401, 401])
+    server = stub_ingestor(lambda body: (next(responses), {}))
+    invalidated = []
+    api = client(server.url, on_unauthorized=lambda: invalidated.append(True))
+
+    assert asyncio.run(api.submit_many([{"id": "item"}]))["succeeded"] == ["item"]
+    assert len(invalidated) == 1
+
+    output = asyncio.run(api.submit_many([{"id": "other"}]))
+    assert [failure["id"] for failure in output["failed"]] == ["other"]
+    assert len(invalidated) == 2
+    assert len(server.requests) == 4
+
+
+def test_submit_many_bulk(stub_ingestor):
+    """
+    Ensure that items are chunked when a bulk endpoint is configured.
+    """
+    server = stub_ingestor()
+    items = [{"id": f"item-{i}"} for i in range(25)]
+
+    output = asyncio.run(
+        client(server.url, bulk_path="/bulk", bulk_size=10).submit_many(items)
+    )
+
+    assert len(output["succeeded"]) == 25
+    assert [len(body) for body in server.requests] == [10, 10, 5]
+
+
+def test_retries_throttled_requests(stub_ingestor):
+    """
+    Ensure that throttled requests are retried, honoring Retry-After.
+    """
+    counter = itertools.count()
+
+    def responder(body):
+        if next(counter) < 3:
+            return 429, {"Retry-After": "0"}
+        return 201, {}
+
+    server = stub_ingestor(responder)
+
+    output = asyncio.run(client(server.url).submit_many([{"id": "item"}]))
+
+    assert output == {"succeeded": ["item"], "failed": []}
+    assert len(server.requests) == 4
+
+
+def test_gives_up_after_max_attempts(stub_ingestor):
+    """
+    Ensure that persistent server errors are reported as failures.
+    """
+    server = stub_ingestor(lambda body: (503, {}))
+
+    output = asyncio.run(
+        client(server.url, max_attempts=3).submit_many([{"id": "item"}])
+    )
+
+    assert output["failed"][0]["id"] == "item"
+    assert output["failed"][0]["error"].startswith("503")
+    assert len(server.requests) == 3
+
+
+def test_concurrency_stays_within_limit(stub_ingestor):
+    """
+    Ensure that the concurrency never exceeds the configured maximum.
+    """
+
+    def responder(body):
+        time.sleep(0.01)
+        return 201, {}
+
+    server = stub_ingestor(responder)
+    items = [{"id": f"item-{i}"} for i in range(100)]
+
+    output = asyncio.run(client(server.url, max_concurrency=8).submit_many(items))
+
+    assert len(output["succeeded"]) == 100
+    assert server.max_in_flight <= 8
+
+
+def test_limiter_aimd():
+    """
+    Ensure that the limit grows on fast successes and halves when throttled.
+    """
+
+    async def run():
+        limiter = AdaptiveLimiter(initial=4, maximum=6, fast_seconds=1)
+        for _ in range(4):
+            limiter.on_success(0.1)
+        assert limiter.limit == pytest.approx(5, abs=0.1)
+
+        limiter.on_success(5)
+        assert limiter.limit == pytest.approx(5, abs=0.1)
+
+        for _ in range(20):
+            limiter.on_success(0.1)
+        assert limiter.limit == 6
+
+        limiter.on_throttle()
+        assert limiter.limit == 3
+
+        for _ in range(5):
+            limiter.on_throttle()
+        assert limiter.limit == 1
+
+    asyncio.run(run())
+
+
+def test_limiter_decreases_once_per_window():
+    """
+    Ensure that a burst of throttled requests started under the same limit only
+    decreases it once.
+    """
+
+    async def run():
+        limiter = AdaptiveLimiter(initial=16, maximum=32)
+        started_at = time.monotonic()
+        for _ in range(8):
+            limiter.on_throttle(started_at)
+        assert limiter.limit == 8
+
+        # Requests started after the decrease can decrease it again
+        limiter.on_throttle(time.monotonic())
+        assert limiter.limit == 4
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        (None, None),
+        ("3", 3),
+        ("Wed, 21 Oct 2015 07:28:00 GMT", 0),
+        ("not-a-date", None),
+    ],
+)
+def test_parse_retry_after(value, expected):
+    assert parse_retry_after(value) == expected
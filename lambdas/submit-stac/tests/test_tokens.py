@@ -0,0 +1,46 @@
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+
+def test_token_is_fetched_lazily_and_cached(handler_module):
+    """
+    Ensure that the token is fetched on first use and reused until it nearly expires.
+    """
+    manager = handler_module.TokenManager(secret_id="test-secret", refresh_margin=60)
+    with mock.patch.object(
+        manager, "_get_cognito_service_details", return_value={}
+    ) as get_details, mock.patch.object(
+        manager,
+        "_get_app_credentials",
+        return_value={"access_token": "token-1", "expires_in": 3600},
+    ) as get_credentials, mock.patch(
+        "time.time", return_value=1000
+    ) as now:
+        assert not get_credentials.called
+        assert manager.get_token() == "token-1"
+        assert manager.get_token() == "token-1"
+        assert get_credentials.call_count == 1
+
+        # Refreshed shortly before expiry, the secret is only read once
+        now.return_value = 1000 + 3600 - 30
+        get_credentials.return_value = {"access_token": "token-2", "expires_in": 3600}
+        assert manager.get_token() == "token-2"
+        assert get_credentials.call_count == 2
+        assert get_details.call_count == 1
+
+        manager.invalidate()
+        manager.get_token()
+        assert get_credentials.call_count == 3
+
+
+def test_scripts_copy_is_identical():
+    """
+    Ensure that the copy used by the scripts package hasn't drifted.
+    """
+    tokens = Path(__file__).parents[1] / "tokens.py"
+    scripts_copy = Path(__file__).parents[3] / "scripts" / "tokens.py"
+    if not scripts_copy.exists():
+        pytest.skip("Not running from the repository")
+    assert scripts_copy.read_text() == tokens.read_text()
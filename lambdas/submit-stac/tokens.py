@@ -0,0 +1,130 @@
+import base64
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional, TypedDict
+
+import boto3
+import requests
+
+
+class AppConfig(TypedDict):
+    cognito_domain: str
+    client_id: str
+    client_secret: str
+    scope: str
+
+
+class Creds(TypedDict):
+    access_token: str
+    expires_in: int
+    token_type: str
+
+
+@dataclass
+class TokenManager:
+    """
+    Fetches the ingestor access token on first use and caches it in memory,
+    refreshing it `refresh_margin` seconds before it expires. If `cache_path` is
+    set, the token is also cached in that file (readable only by the user), so
+    successive CLI commands can reuse it.
+
+    Used by the submit-stac lambda. scripts/tokens.py is a copy, as the scripts
+    package can't import from the lambdas; keep the two identical.
+    """
+
+    secret_id: str
+    cache_path: Optional[Path] = None
+    refresh_margin: int = 300
+    _app_config: Optional[AppConfig] = field(default=None, init=False, repr=False)
+    _token: Optional[str] = field(default=None, init=False, repr=False)
+    _expires_at: float = field(default=0.0, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def get_token(self) -> str:
+        with self._lock:
+            if not self._token or self._expiring():
+                self._load()
+            if not self._token or self._expiring():
+                if self._app_config is None:
+                    self._app_config = self._get_cognito_service_details(self.secret_id)
+                credentials = self._get_app_credentials(**self._app_config)
+                self._token = credentials["access_token"]
+                self._expires_at = time.time() + credentials["expires_in"]
+                self._save()
+            return self._token
+
+    def invalidate(self):
+        with self._lock:
+            self._token = None
+            self._expires_at = 0.0
+            self._save()
+
+    def _expiring(self) -> bool:
+        return time.time() >= self._expires_at - self.refresh_margin
+
+    def _load(self):
+        if not (self.cache_path and self.cache_path.exists()):
+            return
+        try:
+            cached = json.loads(self.cache_path.read_text()).get(self.secret_id)
+        except (OSError, ValueError):
+            return
+        if cached:
+            self._token = cached["access_token"]
+            self._expires_at = cached["expires_at"]
+
+    def _save(self):
+        if not self.cache_path:
+            return
+        try:
+            cache = json.loads(self.cache_path.read_text())
+        except (OSError, ValueError):
+            cache = {}
+        if self._token:
+            cache[self.secret_id] = {
+                "access_token": self._token,
+                "expires_at": self._expires_at,
+            }
+        else:
+            cache.pop(self.secret_id, None)
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.cache_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        # The mode only applies to new files
+        os.chmod(self.cache_path, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(cache, f)
+
+    @staticmethod
+    def _get_cognito_service_details(secret_id: str) -> AppConfig:
+        client = boto3.client("secretsmanager")
+        response = client.get_secret_value(SecretId=secret_id)
+        if "SecretString" in response:
+            return json.loads(response["SecretString"])
+        return json.loads(base64.b64decode(response["SecretBinary"]))
+
+    @staticmethod
+    def _get_app_credentials(
+        cognito_domain: str, client_id: str, client_secret: str, scope: str, **kwargs
+    ) -> Creds:
+        response = requests.post(
+            f"{cognito_domain}/oauth2/token",
+            headers={
+                "Content-Type": "application/x-www-form-urlencoded",
+            },
+            auth=(client_id, client_secret),
+            data={
+                "grant_type": "client_credentials",
+                # A space-separated list of scopes to request for the generated access token.
+                "scope": scope,
+            },
+        )
+        try:
+            response.raise_for_status()
+        except:
+            print(response.text)
+            raise
+        return response.json()
@@ -1,68 +1,57 @@
-import base64
 from binascii import Incomplete
 from dataclasses import dataclass
-import json
-from typing import TypedDict, Union
+import os
+from pathlib import Path
+from typing import Union
 
-import boto3
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from .tokens import TokenManager
 
-class AppConfig(TypedDict):
-    cognito_domain: str
-    client_id: str
-    client_secret: str
-    scope: str
 
-
-class Creds(TypedDict):
-    access_token: str
-    expires_in: int
-    token_type: str
+def retrying_session() -> requests.Session:
+    """
+    Session retrying throttled and failed idempotent requests with exponential
+    backoff, honoring the Retry-After header of the ingestor. POST requests
+    aren't retried, as the ingestor may have processed them.
+    """
+    retry = Retry(
+        total=6,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(max_retries=retry))
+    session.mount("http://", HTTPAdapter(max_retries=retry))
+    return session
 
 
 @dataclass
 class IngestionApi:
     base_url: str
-    token: str
+    tokens: TokenManager
 
     @classmethod
     def from_veda_auth_secret(cls, *, secret_id: str, base_url: str) -> "IngestionApi":
-        cognito_details = cls._get_cognito_service_details(secret_id)
-        credentials = cls._get_app_credentials(**cognito_details)
-        return cls(token=credentials["access_token"], base_url=base_url)
-
-    @staticmethod
-    def _get_cognito_service_details(secret_id: str) -> AppConfig:
-        client = boto3.client("secretsmanager")
-        response = client.get_secret_value(SecretId=secret_id)
-        if "SecretString" in response:
-            return json.loads(response["SecretString"])
-        else:
-            return json.loads(base64.b64decode(response["SecretBinary"]))
-
-    @staticmethod
-    def _get_app_credentials(
-        cognito_domain: str, client_id: str, client_secret: str, scope: str, **kwargs
-    ) -> Creds:
-        response = requests.post(
-            f"{cognito_domain}/oauth2/token",
-            headers={
-                "Content-Type": "application/x-www-form-urlencoded",
-            },
-            auth=(client_id, client_secret),
-            data={
-                "grant_type": "client_credentials",
-                # A space-separated list of scopes to request for the generated access token.
-                "scope": scope,
-            },
+        # Set VEDA_TOKEN_CACHE to a file path, e.g. ~/.cache/veda/tokens.json, to
+        # reuse tokens between CLI commands
+        cache_path = os.environ.get("VEDA_TOKEN_CACHE")
+        return cls(
+            tokens=TokenManager(
+                secret_id=secret_id,
+                cache_path=Path(cache_path).expanduser() if cache_path else None,
+            ),
+            base_url=base_url,
         )
-        try:
-            response.raise_for_status()
-        except:
-            print(response.text)
-            raise
-        return response.json()
+
+    @property
+    def token(self) -> str:
+        return self.tokens.get_token()
 
     def request(
         self,
@@ -72,7 +61,7 @@ class IngestionApi:
         json: Union[Incomplete, None] = None,
     ):
         if not session:
-            session = requests
+            session = retrying_session()
 
         return session.request(
             method,
@@ -2,11 +2,10 @@ from binascii import Incomplete
 import json
 import os
 from typing import Any, Callable
-import requests
 
 from dotenv import load_dotenv
 
-from scripts.api import IngestionApi
+from scripts.api import IngestionApi, retrying_session
 from .utils import args_handler, get_collections
 
 
@@ -26,7 +25,7 @@ def map_collections(query: str, mapper: Callable[[IngestionApi, Any], None]):
 def insert(collections: str):
     print("Inserting collections:")
 
-    session = requests.Session()
+    session = retrying_session()
 
     def insert_one(api: IngestionApi, collection: Incomplete):
         try:
@@ -49,7 +48,7 @@ def insert(collections: str):
 def delete(collections: str):
     print("Deleting collections")
 
-    session = requests.Session()
+    session = retrying_session()
 
     def delete_one(api: IngestionApi, collection: Incomplete):
         try:
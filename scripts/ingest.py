@@ -3,9 +3,8 @@ from operator import itemgetter
 import os
 from typing import List
 from dotenv import load_dotenv
-import requests
 
-from scripts.api import IngestionApi
+from scripts.api import IngestionApi, retrying_session
 from .utils import args_handler
 
 
@@ -34,7 +33,7 @@ def get(ids: List[str]):
         secret_id=os.environ.get("COGNITO_APP_SECRET"),
         base_url=os.environ.get("STAC_INGESTOR_API_URL"),
     )
-    session = requests.Session()
+    session = retrying_session()
 
     for id in ids:
         try:
@@ -58,7 +57,7 @@ def delete(ids: List[str]):
         secret_id=os.environ.get("COGNITO_APP_SECRET"),
         base_url=os.environ.get("STAC_INGESTOR_API_URL"),
     )
-    session = requests.Session()
+    session = retrying_session()
 
     for id in ids:
         try: